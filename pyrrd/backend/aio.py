@@ -0,0 +1,376 @@
+"""
+Non-blocking versions of create, update, fetch and graph for programs that
+run an event loop. Each function queues its rrdtool command on the pool of
+"rrdtool -" processes used by the external backend and returns a Future
+straight away instead of waiting for rrdtool to answer.
+
+The number of commands handed to rrdtool at once is capped by the
+Executor's limit; the rest wait in the executor, where they can still be
+cancelled. A Future has the interface of the futures in the standard
+library (result, exception, done, cancel, add_done_callback), and
+wrapFuture hands it to an asyncio (or trollius) event loop::
+
+    >>> from pyrrd.backend import aio
+    >>> future = aio.update(filename, ["920804700:12345"]) # doctest: +SKIP
+    >>> yield From(aio.wrapFuture(future, loop)) # doctest: +SKIP
+"""
+from collections import deque
+import threading
+
+from pyrrd.backend import external
+from pyrrd.exceptions import ExternalCommandError, QueueFullError
+
+
+PENDING = "PENDING"
+RUNNING = "RUNNING"
+CANCELLED = "CANCELLED"
+FINISHED = "FINISHED"
+# how long to wait before trying again to queue a command for a worker whose
+# queue is full, if none of our own commands are running to make room
+RETRY_INTERVAL = 0.01
+
+_executor = None
+_executorLock = threading.Lock()
+
+
+class CancelledError(ExternalCommandError):
+    pass
+
+
+class Future(object):
+    """
+    The eventual result of a command.
+
+    >>> future = Future()
+    >>> finished = []
+    >>> future.add_done_callback(finished.append)
+    >>> future.setResult(42)
+    >>> finished == [future]
+    True
+    >>> future.done(), future.result()
+    (True, 42)
+    """
+    def __init__(self):
+        self.state = PENDING
+        self.value = None
+        self.error = None
+        self.job = None
+        self.callbacks = []
+        self.condition = threading.Condition()
+
+    def cancel(self):
+        """
+        Cancel the command if rrdtool hasn't started it; returns whether it
+        was cancelled.
+        """
+        self.condition.acquire()
+        try:
+            if self.state == CANCELLED:
+                return True
+            if self.state == FINISHED:
+                return False
+            job = self.job
+        finally:
+            self.condition.release()
+        if job is not None:
+            # the executor's callback on the job marks this as cancelled
+            return job.cancel()
+        return self.finish(CANCELLED)
+
+    def cancelled(self):
+        return self.state == CANCELLED
+
+    def running(self):
+        return self.state == RUNNING
+
+    def done(self):
+        return self.state in [CANCELLED, FINISHED]
+
+    def wait(self, timeout):
+        self.condition.acquire()
+        try:
+            if not self.done():
+                self.condition.wait(timeout)
+            if not self.done():
+                raise ExternalCommandError(
+                    "no result after %s seconds" % timeout)
+        finally:
+            self.condition.release()
+
+    def result(self, timeout=None):
+        self.wait(timeout)
+        if self.state == CANCELLED:
+            raise CancelledError("the command was cancelled")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def exception(self, timeout=None):
+        self.wait(timeout)
+        if self.state == CANCELLED:
+            raise CancelledError("the command was cancelled")
+        return self.error
+
+    def add_done_callback(self, callback):
+        self.condition.acquire()
+        try:
+            if not self.done():
+                self.callbacks.append(callback)
+                return
+        finally:
+            self.condition.release()
+        callback(self)
+
+    def setRunning(self, job):
+        self.condition.acquire()
+        try:
+            if self.state != PENDING:
+                return False
+            self.state = RUNNING
+            self.job = job
+            return True
+        finally:
+            self.condition.release()
+
+    def setResult(self, value):
+        self.value = value
+        self.finish(FINISHED)
+
+    def setException(self, error):
+        self.error = error
+        self.finish(FINISHED)
+
+    def finish(self, state):
+        self.condition.acquire()
+        try:
+            if self.done():
+                return False
+            self.state = state
+            self.condition.notifyAll()
+            callbacks = self.callbacks
+            self.callbacks = []
+        finally:
+            self.condition.release()
+        for callback in callbacks:
+            callback(self)
+        return True
+
+
+class Executor(object):
+    """
+    Hands commands to an RRDToolPool, at most limit of them at a time.
+    """
+    def __init__(self, pool=None, limit=100):
+        self.pool = pool
+        self.limit = limit
+        self.running = 0
+        self.pending = deque()
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def getPool(self):
+        if self.pool is None:
+            self.pool = external.getPool()
+        return self.pool
+
+    def submit(self, command, args="", parse=None):
+        """
+        Queue a command; the result of the Future is its output, passed
+        through parse if it is given.
+        """
+        future = Future()
+        self.lock.acquire()
+        try:
+            self.pending.append((future, command, args, parse))
+        finally:
+            self.lock.release()
+        self.dispatch()
+        return future
+
+    def submitChain(self, command, argsList, error=None):
+        """
+        Queue commands to run one after the other, each once the one before
+        has succeeded. The result of the Future is their joined output; if
+        one fails, the rest are not run and the exception is what
+        error(exception, index) returns, or the exception itself.
+        """
+        future = Future()
+        outputs = []
+
+        def run(previous):
+            if previous is not None:
+                if previous.cancelled():
+                    future.finish(CANCELLED)
+                    return
+                exception = previous.exception()
+                if exception is not None:
+                    if error is not None:
+                        exception = error(exception, len(outputs))
+                    future.setException(exception)
+                    return
+                outputs.append(previous.result())
+            if future.done():
+                return
+            if len(outputs) == len(argsList):
+                future.setResult("".join(outputs))
+                return
+            self.submit(command, argsList[len(outputs)]).add_done_callback(
+                run)
+
+        run(None)
+        return future
+
+    def dispatch(self):
+        pool = self.getPool()
+        while True:
+            self.lock.acquire()
+            try:
+                if self.running >= self.limit or not self.pending:
+                    return
+                future, command, args, parse = self.pending.popleft()
+                if future.done():
+                    continue
+                self.running += 1
+            finally:
+                self.lock.release()
+            try:
+                job = pool.submit(command, args, block=False)
+            except QueueFullError:
+                self.retry((future, command, args, parse))
+                return
+            except ExternalCommandError, error:
+                self.lock.acquire()
+                self.running -= 1
+                self.lock.release()
+                future.setException(error)
+                continue
+            if not future.setRunning(job):
+                # cancelled in the meantime
+                job.cancel()
+            job.addCallback(
+                lambda job, future=future, parse=parse: self.complete(
+                    job, future, parse))
+
+    def retry(self, item):
+        self.lock.acquire()
+        try:
+            self.running -= 1
+            self.pending.appendleft(item)
+            if self.running or self.timer is not None:
+                # a command of ours finishing will make room
+                return
+            self.timer = threading.Timer(RETRY_INTERVAL, self.finished, [None])
+            self.timer.daemon = True
+            self.timer.start()
+        finally:
+            self.lock.release()
+
+    def finished(self, job):
+        self.lock.acquire()
+        try:
+            if job is None:
+                self.timer = None
+            else:
+                self.running -= 1
+        finally:
+            self.lock.release()
+        self.dispatch()
+
+    def complete(self, job, future, parse):
+        try:
+            if job.cancelled:
+                future.finish(CANCELLED)
+            elif job.error is not None:
+                future.setException(job.error)
+            else:
+                try:
+                    output = job.output
+                    if parse is not None:
+                        output = parse(output)
+                except Exception, error:
+                    future.setException(error)
+                else:
+                    future.setResult(output)
+        finally:
+            self.finished(job)
+
+
+def getExecutor():
+    global _executor
+    _executorLock.acquire()
+    try:
+        if _executor is None:
+            _executor = Executor()
+        return _executor
+    finally:
+        _executorLock.release()
+
+
+def wrapFuture(future, loop):
+    """
+    Return an asyncio (or trollius) future, created by the loop, that gets
+    the outcome of one of our Futures.
+    """
+    loopFuture = loop.create_future()
+
+    def copy(ignored):
+        if loopFuture.cancelled():
+            return
+        if future.cancelled():
+            loopFuture.cancel()
+        elif future.exception() is not None:
+            loopFuture.set_exception(future.exception())
+        else:
+            loopFuture.set_result(future.result())
+
+    def cancel(ignored):
+        if loopFuture.cancelled():
+            future.cancel()
+
+    loopFuture.add_done_callback(cancel)
+    future.add_done_callback(
+        lambda ignored: loop.call_soon_threadsafe(copy, None))
+    return loopFuture
+
+
+def create(filename, parameters, executor=None):
+    parameters = "%s %s" % (filename, external.concat(parameters))
+    return (executor or getExecutor()).submit("create", parameters)
+
+
+def update(filename, data, debug=False, executor=None):
+    """
+    Updates too long for one command line are sent in parts, as they are
+    by external.update.
+    """
+    command = debug and "updatev" or "update"
+    chunks = external.chunkUpdate(command, filename, data)
+    executor = executor or getExecutor()
+    if len(chunks) == 1:
+        return executor.submit(command, chunks[0])
+    return executor.submitChain(command, chunks, lambda error, index:
+        external.chunkError(error, filename, data, chunks, index))
+
+
+def fetch(filename, query, returnStyle=None, executor=None):
+    """
+    The result is what external.fetch returns, or just the part of it for
+    the returnStyle if one is given.
+    """
+    def parse(output):
+        results = external.parseFetch(output)
+        if returnStyle is not None:
+            return results[returnStyle]
+        return results
+
+    parameters = "%s %s" % (filename, external.concat(query))
+    return (executor or getExecutor()).submit("fetch", parameters, parse)
+
+
+def graph(filename, parameters, executor=None):
+    parameters = "%s %s" % (filename, external.concat(parameters))
+    return (executor or getExecutor()).submit("graph", parameters)
+
+
+def prepareObject(function, obj):
+    return external.prepareObject(function, obj)
@@ -148,7 +148,7 @@ RRD graph is generated.
 import rrdtool
 
 from pyrrd.backend import external
-from pyrrd.backend.common import buildParameters
+from pyrrd.backend.common import FetchResults, FetchRows, buildParameters
 
 
 def _cmd(command, args, debug=False):
@@ -289,6 +289,20 @@ def fetch(filename, parameters, useBindings=False):
         return external.fetch(filename, external.concat(parameters))
 
 
+def iterFetch(filename, parameters):
+    """
+    The rows of a fetch (see common.FetchRows), from the bindings' result.
+    """
+    parameters = [filename] + list(parameters)
+    (start, end, step), dsNames, rows = _cmd('fetch', parameters)
+    return FetchRows(dsNames, iterRows(start, step, rows))
+
+
+def iterRows(start, step, rows):
+    for index, row in enumerate(rows):
+        yield start + (index + 1) * step, row
+
+
 def dump(filename, outfile="", parameters=[]):
     """
     The rrdtool Python bindings don't have support for dump, so we need to use
@@ -324,7 +338,7 @@ def dump(filename, outfile="", parameters=[]):
     return external.dump(filename, outfile, parameters)
 
 
-def load(filename):
+def load(filename, includeData=False):
     """
     The rrdtool Python bindings don't have support for load, so we need to use
     the external load function.
@@ -338,11 +352,15 @@ def load(filename):
     ...   'RRA:AVERAGE:0.5:6:10']
     >>> create(rrdfile, parameters)
 
-    >>> tree = load(rrdfile)
-    >>> [x.tag for x in tree]
+    >>> node = load(rrdfile)
+    >>> [x.tag for x in node.tree]
     ['version', 'step', 'lastupdate', 'ds', 'rra', 'rra']
     """
-    return external.load(filename)
+    return external.load(filename, includeData)
+
+
+def loadHeader(filename):
+    return external.loadHeader(filename)
 
 
 def info(filename, obj=None, useBindings=False, rawData=False, stream=None):
@@ -425,6 +443,21 @@ def graph(filename, parameters):
     output = _cmd('graph', parameters)
 
 
+def xport(parameters):
+    """
+    The series exported by rrdtool.xport, as FetchResults named by their
+    legends.
+    """
+    result = _cmd('xport', list(parameters))
+    meta = result["meta"]
+    # the legends were quoted for rrdtool's own argument parsing, which the
+    # bindings don't do
+    legends = [legend.strip('"') for legend in meta["legend"]]
+    return FetchResults.fromRows(
+        legends, iterRows(meta["start"], meta["step"], result["data"]),
+        meta["start"], meta["end"], meta["step"])
+
+
 def prepareObject(function, obj):
     """
     This is a funtion that serves to make interacting with the
@@ -481,6 +514,12 @@ def prepareObject(function, obj):
         params += [unicode(x) for x in obj.data]
         return (obj.filename, params)
 
+    if function == 'xport':
+        validParams = ['start', 'end', 'step', 'maxrows']
+        params = buildParameters(obj, validParams)
+        params += [unicode(x) for x in obj.data]
+        return (params,)
+
 
 if __name__ == "__main__":
     import doctest
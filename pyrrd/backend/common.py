@@ -1,8 +1,17 @@
+from array import array
 import re
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from pyrrd.util import NaN
 
 
+UNKNOWN = float("nan")
+
+
 def coerce(value):
     """
     >>> coerce("NaN")
@@ -61,6 +70,144 @@ def iterParse(lines):
         yield (int(time), coerce(value))
 
 
+class FetchResults(object):
+    """
+    The result of a fetch, with the values kept as columns: "times" holds
+    the timestamp of each row and "columns" one array of doubles per data
+    source, named in "dsNames", with NaN for unknown values. "values" gives
+    them as a single 2-D (rows by data sources) NumPy array of float64, or
+    as the list of columns when NumPy is not installed.
+
+    Indexing with a return style gives the data in one of the layouts that
+    RRD.fetch has always returned ("ds" or "time"), built on demand, or as
+    columns: a (times, {dsName: column}) tuple. In the "ds" and "time"
+    layouts, unknown values are pyrrd.util.NaN, as they have always been
+    there.
+
+    >>> results = FetchResults.fromRows(["a", "b"], [
+    ...     (300, (1.0, None)), (600, (2.0, 3.0))])
+    >>> results.start, results.end, results.step
+    (0, 600, 300)
+    >>> results["columns"][1]["b"]
+    array('d', [nan, 3.0])
+    >>> results["time"][600]
+    {'a': 2.0, 'b': 3.0}
+    >>> results["ds"]["b"]
+    [(300, nan), (600, 3.0)]
+    """
+    def __init__(self, start, end, step, dsNames, times, columns):
+        self.start = start
+        self.end = end
+        self.step = step
+        self.dsNames = tuple(dsNames)
+        self.times = times
+        self.columns = columns
+
+    @classmethod
+    def fromRows(cls, dsNames, rows, start=None, end=None, step=None):
+        """
+        Collect (timestamp, values) rows, e.g. from parseFetchOutput, into
+        columns. Where they are not given, the step, start and end are
+        worked out from the timestamps.
+        """
+        times = array("l")
+        columns = [array("d") for name in dsNames]
+        for time, values in rows:
+            times.append(time)
+            for column, value in zip(columns, values):
+                if value is None:
+                    value = UNKNOWN
+                column.append(value)
+        if step is None and len(times) > 1:
+            step = times[1] - times[0]
+        if start is None and times:
+            start = times[0] - (step or 0)
+        if end is None and times:
+            end = times[-1]
+        return cls(start, end, step, dsNames, times, columns)
+
+    @property
+    def values(self):
+        if numpy is None:
+            return self.columns
+        values = numpy.empty((len(self.times), len(self.columns)))
+        if len(self.times):
+            for index, column in enumerate(self.columns):
+                values[:, index] = numpy.frombuffer(column, numpy.float64)
+        return values
+
+    def __getitem__(self, returnStyle):
+        if returnStyle == "columns":
+            return self.times, dict(zip(self.dsNames, self.columns))
+        elif returnStyle == "ds":
+            results = {}
+            for name, column in zip(self.dsNames, self.columns):
+                results[name] = zip(self.times, legacyValues(column))
+            return results
+        elif returnStyle == "time":
+            results = {}
+            columns = [legacyValues(column) for column in self.columns]
+            for index, time in enumerate(self.times):
+                results[time] = dict([(name, column[index])
+                    for name, column in zip(self.dsNames, columns)])
+            return results
+        raise KeyError(returnStyle)
+
+
+def legacyValues(column):
+    """
+    The values of a column, with unknown values as pyrrd.util.NaN.
+    """
+    values = list(column)
+    for index, value in enumerate(values):
+        # only NaN is not equal to itself
+        if value != value:
+            values[index] = NaN(UNKNOWN)
+    return values
+
+
+class FetchRows(object):
+    """
+    The rows of a fetch, produced as they are iterated over: each one is a
+    (timestamp, values) tuple, with the values in the order of dsNames.
+    """
+    def __init__(self, dsNames, rows):
+        self.dsNames = tuple(dsNames)
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+def parseFetchOutput(lines):
+    """
+    Read the output of "rrdtool fetch" from an iterable of lines. Only the
+    header is read straight away; the rows are parsed as they are asked for.
+
+    >>> rows = parseFetchOutput(iter([
+    ...     '                speed\\n', '\\n', ' 920804700: nan\\n',
+    ...     ' 920805000: 4.0000000000e-02\\n']))
+    >>> rows.dsNames
+    ('speed',)
+    >>> list(rows)
+    [(920804700, (nan,)), (920805000, (0.04,))]
+    """
+    lines = iter(lines)
+    header = ""
+    for line in lines:
+        if line.strip():
+            header = line
+            break
+    return FetchRows(header.split(), iterFetchRows(lines))
+
+
+def iterFetchRows(lines):
+    for line in lines:
+        time, _, data = line.partition(":")
+        if data:
+            yield int(time), tuple([coerce(datum) for datum in data.split()])
+
+
 def buildParameters(obj, validList):
     """
     >>> class TestClass(object):
@@ -94,6 +241,27 @@ def buildParameters(obj, validList):
     return [x for x in params if x]
 
 
+def chunkValues(prefix, values, maxLength):
+    """
+    Join the values onto as few copies of prefix as it takes to keep each
+    line no longer than maxLength.
+
+    >>> chunkValues("update a.rrd", ["1:1", "2:2", "3:3"], 40)
+    ['update a.rrd 1:1 2:2 3:3']
+    >>> chunkValues("update a.rrd", ["1:1", "2:2", "3:3"], 20)
+    ['update a.rrd 1:1 2:2', 'update a.rrd 3:3']
+    """
+    lines = []
+    line = prefix
+    for value in values:
+        if line != prefix and len(line) + len(value) + 1 > maxLength:
+            lines.append(line)
+            line = prefix
+        line += " " + value
+    if line != prefix:
+        lines.append(line)
+    return lines
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
@@ -1,12 +1,56 @@
+from array import array
+import atexit
+import os
+import shlex
 import sys
+from StringIO import StringIO
 from subprocess import Popen, PIPE
+import threading
 
 from pyrrd.backend import common
-from pyrrd.exceptions import ExternalCommandError
-from pyrrd.util import XML
+from pyrrd.backend.pipe import MAX_LINE_LENGTH, RRDToolPool
+from pyrrd.exceptions import ExternalCommandError, PartialUpdateError
+from pyrrd.node import parse
+from pyrrd.util import iterparse
+
+
+# Send the commands to long-running "rrdtool -" processes instead of starting
+# a new rrdtool (and shell) for each of them. The commands for a file always
+# go to the same one of the poolSize processes (one per CPU by default).
+pipeMode = True
+poolSize = None
+# the longest line "rrdtool -" reads (MAX_LENGTH in rrd_tool.c)
+MAX_PIPE_LINE = MAX_LINE_LENGTH
+# without pipeMode a command is a single argument of "sh -c", which Linux
+# limits to 128 KiB (MAX_ARG_STRLEN); cmd.exe takes at most 8191 characters
+MAX_SHELL_COMMAND = 131072
+MAX_WINDOWS_COMMAND = 8191
+_pool = None
+_poolLock = threading.Lock()
+
+
+def getPool():
+    """
+    Return the pool of rrdtool processes shared by this module, creating it
+    first if needed; it is stopped when the interpreter exits.
+    """
+    global _pool
+    _poolLock.acquire()
+    try:
+        if _pool is None:
+            _pool = RRDToolPool(poolSize)
+            atexit.register(_pool.close)
+        return _pool
+    finally:
+        _poolLock.release()
 
 
 def _cmd(command, args=""):
+    if pipeMode:
+        if len("%s %s" % (command, args)) + 1 < MAX_PIPE_LINE:
+            return getPool().execute(command, args)
+        # too long for the pipe, such as an xport of many files
+        return runProcess(command, args)
     if sys.platform == 'win32':
         close_fds = False
     else:
@@ -30,6 +74,86 @@ def concat(args):
     return args
 
 
+def maxCommandLength():
+    """
+    The longest "rrdtool <command> <args>" line that _cmd can run.
+    """
+    if pipeMode:
+        # less the newline
+        return MAX_PIPE_LINE - 2
+    if sys.platform == "win32":
+        return MAX_WINDOWS_COMMAND
+    limit = MAX_SHELL_COMMAND
+    try:
+        argMax = os.sysconf("SC_ARG_MAX")
+    except (AttributeError, ValueError, OSError):
+        argMax = -1
+    if argMax > 0:
+        # the environment shares the space with the arguments
+        environment = sum([len(key) + len(value) + 2
+                           for key, value in os.environ.items()])
+        limit = min(limit, argMax - environment - 2048)
+    return limit - 1
+
+
+def splitUpdate(filename, data):
+    """
+    Return the start of an update command (the file name and the options)
+    and the list of its values.
+
+    >>> splitUpdate("a.rrd", "--template ds1:ds0 1:1:2 2:3:4")
+    ('a.rrd --template ds1:ds0', ['1:1:2', '2:3:4'])
+    """
+    if isinstance(data, basestring):
+        data = data.split()
+    options = []
+    values = list(data)
+    while values and values[0].startswith("-"):
+        options.extend(values[:2])
+        del values[:2]
+    return " ".join([filename] + options), values
+
+
+def chunkUpdate(command, filename, data, maxLength=None):
+    """
+    Split an update into as few commands as fit on a command line (see
+    maxCommandLength), each with the file name and options. Returns the
+    parameters of each command.
+
+    >>> chunkUpdate("update", "a.rrd", "1:1 2:2")
+    ['a.rrd 1:1 2:2']
+    >>> chunkUpdate("update", "a.rrd", ["--template", "ds0", "1:1", "2:2",
+    ...     "3:3"], 45)
+    ['a.rrd --template ds0 1:1 2:2', 'a.rrd --template ds0 3:3']
+    """
+    if maxLength is None:
+        maxLength = maxCommandLength()
+    maxLength -= len("rrdtool %s " % command)
+    parameters = "%s %s" % (filename, concat(data))
+    if len(parameters) <= maxLength:
+        return [parameters]
+    prefix, values = splitUpdate(filename, data)
+    return common.chunkValues(prefix, values, maxLength)
+
+
+def chunkError(error, filename, data, chunks, index):
+    """
+    The error to raise when the command for chunks[index] has failed with
+    error: unless the update was sent whole, a PartialUpdateError saying
+    which chunk failed and how many values were written before it.
+    """
+    if len(chunks) == 1:
+        return error
+    prefix, values = splitUpdate(filename, data)
+    size = len(prefix.split())
+    written = sum([len(chunk.split()) - size for chunk in chunks[:index]])
+    time = values[written].split(":")[0]
+    return PartialUpdateError(
+        "%s (in update %s of %s, starting at time %s; the %s values before "
+        "it were written)" % (error, index + 1, len(chunks), time, written),
+        index, time, written)
+
+
 def create(filename, parameters):
     """
     >>> import tempfile
@@ -49,6 +173,10 @@ def create(filename, parameters):
 
 def update(filename, data, debug=False):
     """
+    An update too long for one command line is sent as several, one after
+    the other on the same rrdtool process; if one fails, the values before
+    it stay written and a PartialUpdateError says where it stopped.
+
     >>> import tempfile
     >>> rrdfile = tempfile.NamedTemporaryFile()
     >>> parameters = ' --start 920804400'
@@ -73,11 +201,13 @@ def update(filename, data, debug=False):
     ...   '920808300:12420 920808600:12422 920808900:12423')
 
     """
-    parameters = "%s %s" % (filename, concat(data))
-    if debug:
-        _cmd('updatev', parameters)
-    else:
-        _cmd('update', parameters)
+    command = debug and 'updatev' or 'update'
+    chunks = chunkUpdate(command, filename, data)
+    for index, parameters in enumerate(chunks):
+        try:
+            _cmd(command, parameters)
+        except ExternalCommandError, error:
+            raise chunkError(error, filename, data, chunks, index)
 
 
 def fetchRaw(filename, query):
@@ -107,43 +237,126 @@ def fetch(filename, query):
 
     >>> results = fetch(rrdfile.name, 'AVERAGE --start 920804400 --end 920809200')
 
-    # Results are provided in two ways, one of which is by the data source
+    # Results are provided in three ways, one of which is by the data source
     # name:
     >>> sorted(results["ds"].keys())
     ['speed']
 
     # accessing a DS entry like this gives of a (time, data) tuple:
-    >>> results["ds"]["speed"][0]
+    >>> results["ds"]["speed"][1]
     (920805000, 0.04)
 
-    # The other way of accessing the results data is by data source time
+    # Another way of accessing the results data is by data source time
     # entries:
     >>> keys = sorted(results["time"].keys())
     >>> len(keys)
-    16
+    17
     >>> keys[0:6]
-    [920805000, 920805300, 920805600, 920805900, 920806200, 920806500]
+    [920804700, 920805000, 920805300, 920805600, 920805900, 920806200]
     >>> results["time"][920805000]
     {'speed': 0.04}
 
+    # The last is as columns: an array of times and an array of values for
+    # each data source (results.values has them all as one NumPy array):
+    >>> times, columns = results["columns"]
+    >>> times[1], columns["speed"][1]
+    (920805000, 0.04)
+
     The benefits of using an approach like this become obvious when the RRD
     file has multiple DSs and RRAs.
     """
-    output = fetchRaw(filename, concat(query))
-    lines = [line for line in output.split('\n') if line]
-    dsNames = lines[0].split()
-    results = {
-        "ds": {},
-        "time": {},
-        }
-    for line in lines[2:]:
-        time, data = line.split(":")
-        data = [common.coerce(datum) for datum in data.split()]
-        results["time"][int(time)] = dict(zip(dsNames, data))
-        for dsName, datum in zip(dsNames, data):
-            results["ds"].setdefault(dsName, [])
-            results["ds"][dsName].append((int(time), common.coerce(datum)))
-    return results
+    return parseFetch(fetchRaw(filename, concat(query)))
+
+
+def parseFetch(output):
+    """
+    Turn the output of "rrdtool fetch" into FetchResults; each value is
+    converted once, straight into the column arrays.
+    """
+    rows = common.parseFetchOutput(output.splitlines())
+    return common.FetchResults.fromRows(rows.dsNames, rows)
+
+
+def iterFetch(filename, query):
+    """
+    Run "rrdtool fetch" and return its rows (see common.FetchRows) as they
+    are read from its output, so that the memory used does not depend on
+    the number of rows. Unlike the other commands, this one always runs in
+    a process of its own.
+
+    >>> import tempfile
+    >>> rrdfile = tempfile.NamedTemporaryFile()
+    >>> parameters = ' --start 920804400'
+    >>> parameters += ' DS:speed:COUNTER:600:U:U'
+    >>> parameters += ' RRA:AVERAGE:0.5:1:24'
+    >>> create(rrdfile.name, parameters)
+    >>> update(rrdfile.name, '920804700:12345 920805000:12357')
+
+    >>> query = 'AVERAGE --start 920804400 --end 920805000'
+    >>> rows = iterFetch(rrdfile.name, query)
+    >>> rows.dsNames
+    ('speed',)
+    >>> list(rows)[:2]
+    [(920804700, (nan,)), (920805000, (0.04,))]
+    """
+    args = ["rrdtool", "fetch", filename]
+    args.extend([unicode(x).encode("utf-8") for x in concat(query).split()])
+    return common.parseFetchOutput(iterOutput(spawn(args)))
+
+
+def spawn(args):
+    """
+    Start rrdtool (without a shell) with its output and errors piped back.
+    """
+    try:
+        return Popen(args, stdout=PIPE, stderr=PIPE,
+                     close_fds=(sys.platform != "win32"))
+    except OSError, error:
+        raise ExternalCommandError("Could not run rrdtool: %s" % (
+            error.strerror,))
+
+
+def runProcess(command, args=""):
+    """
+    Run a command in an rrdtool process of its own, without a shell, so
+    that its arguments are only limited by the size of the argument list.
+    They are split as the shell would split them.
+    """
+    args = concat(args)
+    if isinstance(args, unicode):
+        args = args.encode("utf-8")
+    process = spawn(["rrdtool", command] + shlex.split(args))
+    stdout, stderr = process.communicate()
+    if stderr:
+        raise ExternalCommandError(stderr.strip())
+    if process.returncode != 0:
+        raise ExternalCommandError("Return code from rrdtool %s was %s." % (
+            command, process.returncode))
+    return stdout
+
+
+def iterOutput(process):
+    """
+    Yield the lines a process writes as it writes them, and raise an
+    ExternalCommandError at the end if it failed. The process is killed if
+    the lines are not all read.
+    """
+    try:
+        for line in iter(process.stdout.readline, ""):
+            yield line
+        stderr = process.stderr.read()
+        process.wait()
+        if stderr:
+            raise ExternalCommandError(stderr.strip())
+        if process.returncode != 0:
+            raise ExternalCommandError("Return code from rrdtool was %s." % (
+                process.returncode,))
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
 
 
 def dump(filename, outfile="", parameters=""):
@@ -177,9 +390,13 @@ def dump(filename, outfile="", parameters=""):
         return output.strip()
 
 
-def load(filename):
+def load(filename, includeData=False):
     """
-    Load RRD data via the RRDtool XML dump into an ElementTree.
+    Load RRD data via the RRDtool XML dump into an RRDXMLNode. The dump is
+    parsed as rrdtool writes it, and the rows are dropped once they have been
+    read, so the memory used does not grow with the size of the file; with
+    includeData, the values of the rows are kept (compactly) in each RRA's
+    "database".
 
     >>> import tempfile
     >>> rrdfile = tempfile.NamedTemporaryFile()
@@ -188,11 +405,51 @@ def load(filename):
     >>> parameters += ' RRA:AVERAGE:0.5:1:24'
     >>> parameters += ' RRA:AVERAGE:0.5:6:10'
     >>> create(rrdfile.name, parameters)
-    >>> tree = load(rrdfile.name)
-    >>> [x.tag for x in tree]
+    >>> node = load(rrdfile.name)
+    >>> [x.tag for x in node.tree]
     ['version', 'step', 'lastupdate', 'ds', 'rra', 'rra']
+    >>> len(node.tree.find("rra").find("database"))
+    0
+    >>> node = load(rrdfile.name, includeData=True)
+    >>> len(node.rra[0].database), len(node.rra[1].database)
+    (24, 10)
     """
-    return XML(dump(filename))
+    process = spawn(["rrdtool", "dump", filename])
+    try:
+        try:
+            node = parse(process.stdout, includeData)
+        except SyntaxError, error:
+            node = None
+        # what is left of a dump that could not be parsed isn't read, so
+        # rrdtool must not be left blocked writing it
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+    if stderr:
+        raise ExternalCommandError(stderr.strip())
+    if process.returncode != 0:
+        raise ExternalCommandError("Return code from rrdtool was %s." % (
+            process.returncode,))
+    if node is None:
+        raise ExternalCommandError("rrdtool's dump is not valid XML: %s" % (
+            error,))
+    return node
+
+
+def loadHeader(filename):
+    """
+    rrdtool writes the file as soon as it is updated, so its header can be
+    read directly, without a dump (see native.loadHeader).
+    """
+    # native hands some of its work to this module, so it is imported here
+    from pyrrd.backend import native
+    return native.loadHeader(filename)
 
 
 def info(filename, obj, **kwargs):
@@ -240,6 +497,62 @@ def graph(filename, parameters):
     _cmd('graph', parameters)
 
 
+def xport(parameters):
+    """
+    Run "rrdtool xport" and return the exported series as FetchResults,
+    named by their legends. An xport of many files is usually too long for
+    rrdtool's pipe mode and is then run by an rrdtool of its own.
+    """
+    return parseXport(_cmd('xport', concat(parameters)))
+
+
+def parseXport(output):
+    """
+    Turn the XML that "rrdtool xport" writes into FetchResults; each row is
+    dropped as soon as its values are in the columns.
+
+    >>> results = parseXport('''<?xml version="1.0" encoding="ISO-8859-1"?>
+    ... <xport><meta><start>920804400</start><step>300</step>
+    ... <end>920805000</end><rows>2</rows><columns>2</columns>
+    ... <legend><entry>in</entry><entry>in and out</entry></legend></meta>
+    ... <data><row><t>920804700</t><v>1.0000000000e+00</v><v>NaN</v></row>
+    ... <row><t>920805000</t><v>2.0000000000e+00</v><v>5.0000000000e+00</v></row>
+    ... </data></xport>''')
+    >>> results.dsNames, list(results.times)
+    (('in', 'in and out'), [920804700, 920805000])
+    >>> results.start, results.end, results.step
+    (920804400, 920805000, 300)
+    >>> results["ds"]["in"]
+    [(920804700, 1.0), (920805000, 2.0)]
+    >>> results.columns[1]
+    array('d', [nan, 5.0])
+    """
+    meta = {}
+    legends = []
+    times = array("l")
+    columns = None
+    for event, element in iterparse(StringIO(output)):
+        if element.tag == "row":
+            if columns is None:
+                columns = [array("d") for legend in legends]
+            time = element.findtext("t")
+            if time is None:
+                # older versions of rrdtool leave the times out
+                time = meta["start"] + meta["step"] * (len(times) + 1)
+            times.append(int(time))
+            for column, value in zip(columns, element.findall("v")):
+                column.append(float(value.text))
+            element.clear()
+        elif element.tag == "entry":
+            legends.append(element.text or "")
+        elif element.tag in ["start", "end", "step"]:
+            meta[element.tag] = int(element.text)
+    if columns is None:
+        columns = [array("d") for legend in legends]
+    return common.FetchResults(meta.get("start"), meta.get("end"),
+                               meta.get("step"), legends, times, columns)
+
+
 def prepareObject(function, obj):
     """
     This is a funtion that serves to make interacting with the
@@ -296,6 +609,12 @@ def prepareObject(function, obj):
         data = [unicode(x) for x in obj.data]
         return (obj.filename, params + data)
 
+    elif function == 'xport':
+        validParams = ['start', 'end', 'step', 'maxrows']
+        params = common.buildParameters(obj, validParams)
+        data = [unicode(x) for x in obj.data]
+        return (params + data,)
+
 
 if __name__ == "__main__":
     import doctest
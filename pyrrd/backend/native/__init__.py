@@ -0,0 +1,190 @@
+"""
+A backend that reads RRD files directly, without calling out to rrdtool or
+going through an XML dump. Files in any of the formats rrdtool has written
+(versions 0001 to 0004, 32- or 64-bit, little- or big-endian) are read and
+updated in their own layout, wherever they were created.
+
+Operations that are not (yet) implemented natively are handed off to the
+external backend, so this module can be used anywhere the other backends
+are::
+
+    >>> from pyrrd.backend import native
+    >>> from pyrrd.rrd import RRD
+    >>> rrd = RRD(filename, mode="r", backend=native) # doctest: +SKIP
+"""
+import sys
+
+from pyrrd.backend import external
+from pyrrd.backend.common import FetchRows
+from pyrrd.backend.native import (
+    creator, dumper, fetcher, restorer, updater)
+from pyrrd.backend.native.reader import RRDFile, formatInfoValue
+from pyrrd.exceptions import FormatError
+
+
+# fetches are parsed here, in Python, so pyrrd.rrd.fetchMany spreads them
+# over processes rather than threads
+fetchWorkers = "process"
+
+
+def create(filename, parameters, preallocate=False):
+    """
+    Write the new file in-process. The parameters may hold the DataSource
+    and RRA objects themselves (see prepareObject) or the usual "DS:..." and
+    "RRA:..." strings. With preallocate set, the disk space for the whole
+    file is reserved with posix_fallocate before it is written, where the
+    platform has it (preallocate is only understood by this backend).
+    With --no-overwrite, an existing file is left alone and a CreateError
+    raised. Definitions that need COMPUTE data sources or Holt-Winters
+    archives are handed to rrdtool.
+    """
+    if not creator.create(filename, parameters, preallocate):
+        if isinstance(parameters, list):
+            parameters = [unicode(x) for x in parameters]
+        external.create(filename, parameters)
+
+
+def update(filename, data, debug=False):
+    """
+    Apply the readings in-process, with one open of the file and a write for
+    the header plus one per run of changed rows. Files with COMPUTE data
+    sources or Holt-Winters archives are handed to rrdtool.
+    """
+    if not updater.update(filename, data):
+        external.update(filename, data, debug)
+
+
+def fetch(filename, query):
+    """
+    Read the rows straight out of the file. The archive is chosen as rrdtool
+    chooses it, and the result can be indexed with any of the return styles
+    ("ds", "time" or "columns"; see common.FetchResults).
+    """
+    cf, resolution, start, end = fetcher.parseQuery(query)
+    rrd = RRDFile(filename)
+    try:
+        return fetcher.fetch(rrd, cf, resolution, start, end)
+    finally:
+        rrd.close()
+
+
+def iterFetch(filename, query):
+    """
+    Return the rows of a fetch (see common.FetchRows), read from the file a
+    chunk at a time as they are iterated over.
+    """
+    cf, resolution, start, end = fetcher.parseQuery(query)
+    rrd = RRDFile(filename)
+    rows = fetcher.iterRows(rrd, cf, resolution, start, end)
+    return FetchRows([ds.name for ds in rrd.ds], closing(rrd, rows))
+
+
+def closing(rrd, rows):
+    try:
+        for row in rows:
+            yield row
+    finally:
+        rrd.close()
+
+
+def iterDump(filename):
+    """
+    Yield the XML dump of a file as it is produced, a line or a row at a
+    time.
+    """
+    rrd = RRDFile(filename)
+    try:
+        for chunk in dumper.iterDump(rrd):
+            yield chunk
+    finally:
+        rrd.close()
+
+
+def dump(filename, outfile="", parameters=""):
+    """
+    Dump a file to XML without calling rrdtool. The dump is streamed to
+    outfile, which can be a file name or a file-like object, so memory use
+    stays the same whatever the size of the archives; without an outfile it
+    is returned as a string, as the other backends do. The parameters are
+    accepted for compatibility and ignored.
+    """
+    chunks = iterDump(filename)
+    if not outfile:
+        return "".join(chunks).strip()
+    if isinstance(outfile, basestring):
+        fh = open(outfile, "w")
+        try:
+            fh.writelines(chunks)
+        finally:
+            fh.close()
+    else:
+        outfile.writelines(chunks)
+
+
+def restore(xmlfile, filename, layout=None):
+    """
+    Write a binary RRD file from an XML dump (a file name or a file-like
+    object) without calling rrdtool. The dump is parsed incrementally and
+    the rows are written as they are read, so memory use stays bounded.
+    The file gets the layout of this host unless a format.Layout is given.
+    """
+    restorer.restore(xmlfile, filename, layout)
+
+
+def load(filename, includeData=False):
+    """
+    Read the header of an RRD file and return it as a node that the mapper
+    can use directly. The rows are always available, through each RRA's
+    "database", so includeData makes no difference.
+    """
+    return RRDFile(filename)
+
+
+def loadHeader(filename):
+    """
+    Read just the header of an RRD file, for the mapper in read mode (the
+    rows are read through each RRA's "database" when they are asked for).
+    Returns None if the file can't be read this way.
+    """
+    try:
+        return RRDFile(filename)
+    except (EnvironmentError, FormatError):
+        return None
+
+
+def info(filename, obj=None, useBindings=False, rawData=False, stream=None):
+    """
+    Read the header of the file and give what "rrdtool info" gives: the
+    flat dict of the rrdtool Python bindings if rawData is set, otherwise the
+    "key = value" lines rrdtool prints, written to stream (stdout by
+    default). The obj and useBindings parameters are accepted for
+    compatibility with the other backends and are not used.
+    """
+    rrd = RRDFile(filename)
+    items = rrd.getInfo(filename)
+    if rawData:
+        return dict(items)
+    if stream is None:
+        stream = sys.stdout
+    for key, value in items:
+        stream.write("%s = %s\n" % (key, formatInfoValue(value)))
+
+
+def graph(filename, parameters):
+    return external.graph(filename, parameters)
+
+
+def xport(parameters):
+    return external.xport(parameters)
+
+
+def prepareObject(function, obj):
+    """
+    The same as external.prepareObject, except that the data sources and
+    archives to create are passed on as objects rather than strings.
+    """
+    if function == "create":
+        filename, parameters = external.prepareObject(function, obj)
+        parameters = parameters[:len(parameters) - len(obj.ds) - len(obj.rra)]
+        return (filename, parameters + list(obj.ds) + list(obj.rra))
+    return external.prepareObject(function, obj)
@@ -0,0 +1,334 @@
+"""
+An in-process implementation of "rrdtool create" for the native backend.
+
+The header is packed from the data source and archive definitions in the
+layout of the host (as rrdtool itself would write it), the consolidation
+state is initialised the way rrd_create.c does it, and the rows are filled
+with NaN. The definitions can be given as DataSource and RRA objects or as
+the "DS:..." and "RRA:..." strings rrdtool takes.
+"""
+from cStringIO import StringIO
+import errno
+import os
+import time
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+from pyrrd.backend.native import format
+from pyrrd.backend.native.fetcher import parseTime
+from pyrrd.backend.native.reader import RRDFile
+from pyrrd.exceptions import CreateError, FetchError
+
+
+NaN = float("nan")
+SUPPORTED_DS_TYPES = ["GAUGE", "COUNTER", "DERIVE", "ABSOLUTE"]
+SUPPORTED_CFS = ["AVERAGE", "MIN", "MAX", "LAST"]
+# the number of NaN values written at a time
+CHUNK_SIZE = 65536
+
+
+def getFallocate():
+    """
+    Look up posix_fallocate in the C library, if there is one.
+    """
+    if ctypes is None:
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fallocate = libc.posix_fallocate64
+    except (OSError, AttributeError, TypeError):
+        return None
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    return fallocate
+
+
+def allocate(fh, size):
+    """
+    Reserve the disk space for a file of the given size up front, so the
+    rows are laid out in as few extents as possible and a full disk is
+    reported before anything is written. Returns whether space was reserved.
+    """
+    fallocate = getFallocate()
+    if fallocate is None:
+        return False
+    error = fallocate(fh.fileno(), 0, size)
+    if error:
+        raise CreateError("could not preallocate %s bytes (errno %s)" % (
+            size, error))
+    return True
+
+
+class DSDefinition(object):
+    """
+    The values of a ds_def_t entry.
+
+    >>> ds = DSDefinition.fromString("DS:speed:COUNTER:600:U:100")
+    >>> ds.validate()
+    >>> ds.name, ds.type, ds.heartbeat, ds.min, ds.max
+    ('speed', 'COUNTER', 600, nan, 100.0)
+    """
+    def __init__(self, name, type, heartbeat, min, max):
+        self.name = str(name)
+        self.type = str(type).upper()
+        self.heartbeat = heartbeat
+        self.min = min
+        self.max = max
+
+    @classmethod
+    def fromString(cls, definition):
+        parts = definition.split(":")
+        if len(parts) < 3 or parts[0] != "DS":
+            raise CreateError("invalid DS format '%s'" % definition)
+        if parts[2].upper() == "COMPUTE":
+            return cls(parts[1], parts[2], 0, NaN, NaN)
+        if len(parts) != 6:
+            raise CreateError("invalid DS format '%s'" % definition)
+        return cls(parts[1], parts[2], parts[3], parts[4], parts[5])
+
+    @classmethod
+    def fromObject(cls, ds):
+        return cls(ds.name, ds.type, ds.minimal_heartbeat, ds.min, ds.max)
+
+    def getPar(self):
+        par = [0.0] * format.MAX_PAR
+        par[format.DS_mrhb_cnt] = self.heartbeat
+        par[format.DS_min_val] = self.min
+        par[format.DS_max_val] = self.max
+        return par
+
+    def validate(self):
+        if not 0 < len(self.name) < format.DS_NAM_SIZE:
+            raise CreateError("invalid DS name '%s'" % self.name)
+        try:
+            self.heartbeat = int(self.heartbeat)
+            self.min = parseLimit(self.min)
+            self.max = parseLimit(self.max)
+        except (TypeError, ValueError):
+            raise CreateError("invalid DS definition for '%s'" % self.name)
+        if self.heartbeat <= 0:
+            raise CreateError("the heartbeat of '%s' must be positive" % (
+                self.name))
+        if self.min >= self.max:
+            raise CreateError("min must be less than max in DS '%s'" % (
+                self.name))
+
+
+class RRADefinition(object):
+    """
+    The values of an rra_def_t entry.
+
+    >>> rra = RRADefinition.fromString("RRA:AVERAGE:0.5:6:10")
+    >>> rra.cf, rra.xff, rra.steps, rra.rows
+    ('AVERAGE', '0.5', '6', '10')
+    """
+    def __init__(self, cf, xff, steps, rows):
+        self.cf = str(cf).upper()
+        self.xff = xff
+        self.steps = steps
+        self.rows = rows
+        # any other par entries, by index
+        self.params = {}
+
+    @classmethod
+    def fromString(cls, definition):
+        parts = definition.split(":")
+        if len(parts) < 2 or parts[0] != "RRA":
+            raise CreateError("invalid RRA format '%s'" % definition)
+        if parts[1].upper() not in SUPPORTED_CFS:
+            return cls(parts[1], 0, 1, 1)
+        if len(parts) != 5:
+            raise CreateError("invalid RRA format '%s'" % definition)
+        return cls(*parts[1:])
+
+    @classmethod
+    def fromObject(cls, rra):
+        return cls(rra.cf, rra.xff, rra.steps, rra.rows)
+
+    def getPar(self):
+        par = [0.0] * format.MAX_PAR
+        par[format.RRA_cdp_xff_val] = self.xff
+        for index, value in self.params.items():
+            par[index] = value
+        return par
+
+    def validate(self):
+        try:
+            self.xff = float(self.xff)
+            self.steps = int(self.steps)
+            self.rows = int(self.rows)
+        except (TypeError, ValueError):
+            raise CreateError("invalid %s RRA definition" % self.cf)
+        if not 0 <= self.xff < 1:
+            raise CreateError("the xff of an RRA must be between 0 and 1")
+        if self.steps <= 0 or self.rows <= 0:
+            raise CreateError("the steps and rows of an RRA must be positive")
+
+
+def parseLimit(value):
+    """
+    >>> parseLimit("U"), parseLimit(None), parseLimit("12.5")
+    (nan, nan, 12.5)
+    """
+    if value is None or unicode(value).upper() in ["U", "NAN"]:
+        return NaN
+    return float(value)
+
+
+def parseParameters(parameters):
+    """
+    Sort the arguments built by prepareObject("create", ...) into the start
+    time, step, definitions and whether an existing file may be replaced
+    (not with --no-overwrite). Items that are not strings are taken to be
+    DataSource or RRA objects.
+    """
+    if isinstance(parameters, basestring):
+        parameters = parameters.split()
+    now = int(time.time())
+    start = now - 10
+    step = 300
+    dss = []
+    rras = []
+    overwrite = True
+    parameters = iter(parameters)
+    for parameter in parameters:
+        if not isinstance(parameter, basestring):
+            if hasattr(parameter, "minimal_heartbeat"):
+                dss.append(DSDefinition.fromObject(parameter))
+            else:
+                rras.append(RRADefinition.fromObject(parameter))
+        elif parameter in ["--start", "-b"]:
+            try:
+                start = parseTime(parameters.next(), now)
+            except FetchError, error:
+                raise CreateError(error.args[0])
+        elif parameter in ["--step", "-s"]:
+            step = int(parameters.next())
+        elif parameter in ["--no-overwrite", "-O"]:
+            overwrite = False
+        elif parameter.startswith("DS:"):
+            dss.append(DSDefinition.fromString(parameter))
+        elif parameter.startswith("RRA:"):
+            rras.append(RRADefinition.fromString(parameter))
+        else:
+            raise CreateError("unknown create argument '%s'" % parameter)
+    return start, step, dss, rras, overwrite
+
+
+def isSupported(dss, rras):
+    for ds in dss:
+        if ds.type not in SUPPORTED_DS_TYPES:
+            return False
+    for rra in rras:
+        if rra.cf not in SUPPORTED_CFS:
+            return False
+    return True
+
+
+def pad(data, size):
+    return data + "\x00" * (size - len(data))
+
+
+def packDefinitions(layout, step, dss, rras, version=format.VERSION3):
+    """
+    Return the stat_head_t, ds_def_t and rra_def_t entries as bytes.
+    """
+    chunks = [layout.packHead(version, len(dss), len(rras), step)]
+    for ds in dss:
+        chunks.append(pad(
+            pad(ds.name, format.DS_NAM_SIZE) + pad(ds.type, format.DST_SIZE),
+            layout.dsParOffset))
+        chunks.append(layout.packUnivals(ds.getPar(), format.DS_COUNT_PARAMS))
+    for rra in rras:
+        definition = pad(pad(rra.cf, format.CF_NAM_SIZE), layout.rowCntOffset)
+        definition += layout.packLong(rra.rows) + layout.packLong(rra.steps)
+        chunks.append(pad(definition, layout.rraParOffset))
+        chunks.append(layout.packUnivals(
+            rra.getPar(), format.rraCountParams(rra.cf)))
+    return "".join(chunks)
+
+
+def initialize(rrd, start):
+    """
+    Set up the live_head_t, pdp_prep_t, cdp_prep_t and rra_ptr_t entries of
+    a new file: nothing known yet, with the time since the last step
+    boundary counted as unknown.
+    """
+    rrd.lastupdate = start
+    rrd.lastupdateUsec = 0
+    unknownSeconds = start % rrd.step
+    for ds in rrd.ds:
+        ds.last_ds = "U"
+        ds.scratch = [0.0] * format.MAX_PAR
+        ds.scratch[format.PDP_unkn_sec_cnt] = unknownSeconds
+    for rra in rrd.rra:
+        rra.cur_row = rra.rows - 1
+        interval = rrd.step * rra.pdp_per_row
+        for cdp in rra.cdp_prep.ds:
+            cdp.scratch = [0.0] * format.MAX_PAR
+            cdp.scratch[format.CDP_val] = NaN
+            cdp.scratch[format.CDP_unkn_pdp_cnt] = (
+                (start - unknownSeconds) % interval) // rrd.step
+            for index in format.CDP_COUNT_PARAMS:
+                if index != format.CDP_unkn_pdp_cnt:
+                    cdp.scratch[index] = 0
+
+
+def create(filename, parameters, preallocate=False):
+    """
+    Write a new RRD file. Returns False, without touching the file, for
+    definitions that are left to rrdtool (COMPUTE data sources and the
+    Holt-Winters archives).
+    """
+    start, step, dss, rras, overwrite = parseParameters(parameters)
+    if not isSupported(dss, rras):
+        return False
+    if step <= 0:
+        raise CreateError("the step must be positive")
+    if not dss or not rras:
+        raise CreateError(
+            "you must define at least one data source and one RRA")
+    names = set()
+    for ds in dss:
+        ds.validate()
+        if ds.name in names:
+            raise CreateError("duplicate DS name '%s'" % ds.name)
+        names.add(ds.name)
+    for rra in rras:
+        rra.validate()
+
+    layout = format.nativeLayout()
+    definitions = packDefinitions(layout, step, dss, rras)
+    headerSize = layout.headerSize(format.VERSION3, len(dss), len(rras))
+    rrd = RRDFile(filename, StringIO(pad(definitions, headerSize)))
+    initialize(rrd, start)
+    header = definitions + rrd.packState()
+    valueCount = sum([rra.rows for rra in rras]) * len(dss)
+
+    if overwrite:
+        fh = open(filename, "wb")
+    else:
+        try:
+            fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                         getattr(os, "O_BINARY", 0), 0666)
+        except OSError, error:
+            if error.errno == errno.EEXIST:
+                raise CreateError("opening '%s': File exists" % filename)
+            raise
+        fh = os.fdopen(fd, "wb")
+    try:
+        if preallocate:
+            allocate(fh, len(header) + valueCount * format.VALUE_SIZE)
+        fh.write(header)
+        chunk = layout.packDouble(NaN) * CHUNK_SIZE
+        while valueCount > CHUNK_SIZE:
+            fh.write(chunk)
+            valueCount -= CHUNK_SIZE
+        fh.write(chunk[:valueCount * format.VALUE_SIZE])
+    finally:
+        fh.close()
+    return True
+
@@ -0,0 +1,161 @@
+"""
+An in-process implementation of "rrdtool dump" for the native backend.
+
+The XML is produced a line at a time by a generator: the header comes from
+the nodes read by RRDFile and the rows are read one at a time through the
+memory map, so the memory used does not depend on the size of the archives.
+The elements are the ones rrdtool writes (see reference/rrdtool-dump.dtd;
+like rrdtool since 1.2, the RRA parameters are wrapped in <params> and the
+cdp_prep of the classic consolidation functions includes the primary and
+secondary values).
+"""
+import math
+import time
+
+from pyrrd.backend.native import format
+
+
+def formatValue(value):
+    """
+    >>> formatValue(0.5)
+    '5.0000000000e-01'
+    >>> formatValue(float("nan"))
+    'NaN'
+    """
+    if math.isnan(value):
+        return "NaN"
+    return "%0.10e" % value
+
+
+def formatTime(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S %Z", time.localtime(timestamp))
+
+
+def element(name, value, indent):
+    return "%s<%s> %s </%s>\n" % ("\t" * indent, name, value, name)
+
+
+def iterParams(rrd, rra):
+    """
+    Yield the lines of an RRA's <params> element.
+    """
+    par = rra.par
+    if rra.cf in ["HWPREDICT", "MHWPREDICT"]:
+        yield element("hw_alpha", formatValue(par[format.RRA_hw_alpha]), 2)
+        yield element("hw_beta", formatValue(par[format.RRA_hw_beta]), 2)
+        yield element(
+            "dependent_rra_idx", par[format.RRA_dependent_rra_idx], 2)
+    elif rra.cf in ["SEASONAL", "DEVSEASONAL"]:
+        yield element("seasonal_gamma",
+                      formatValue(par[format.RRA_seasonal_gamma]), 2)
+        if rrd.version >= format.VERSION4:
+            yield element("seasonal_smoothing_window", formatValue(
+                par[format.RRA_seasonal_smoothing_window]), 2)
+        yield element(
+            "seasonal_smooth_idx", par[format.RRA_seasonal_smooth_idx], 2)
+        yield element(
+            "dependent_rra_idx", par[format.RRA_dependent_rra_idx], 2)
+    elif rra.cf == "FAILURES":
+        yield element("delta_pos", formatValue(par[format.RRA_delta_pos]), 2)
+        yield element("delta_neg", formatValue(par[format.RRA_delta_neg]), 2)
+        yield element("window_len", par[format.RRA_window_len], 2)
+        yield element(
+            "failure_threshold", par[format.RRA_failure_threshold], 2)
+        yield element(
+            "dependent_rra_idx", par[format.RRA_dependent_rra_idx], 2)
+    elif rra.cf == "DEVPREDICT":
+        yield element(
+            "dependent_rra_idx", par[format.RRA_dependent_rra_idx], 2)
+    else:
+        yield element("xff", formatValue(rra.xff), 2)
+
+
+def iterCDPPrep(rrd, rra, cdp):
+    """
+    Yield the lines of one data source's entry in an RRA's <cdp_prep>.
+    """
+    scratch = cdp.scratch
+    if rra.cf in ["HWPREDICT", "MHWPREDICT"]:
+        for name, index in [
+            ("intercept", format.CDP_hw_intercept),
+            ("last_intercept", format.CDP_hw_last_intercept),
+            ("slope", format.CDP_hw_slope),
+            ("last_slope", format.CDP_hw_last_slope)]:
+            yield element(name, formatValue(scratch[index]), 3)
+        yield element("nan_count", scratch[format.CDP_null_count], 3)
+        yield element(
+            "last_nan_count", scratch[format.CDP_last_null_count], 3)
+    elif rra.cf in ["SEASONAL", "DEVSEASONAL"]:
+        yield element(
+            "seasonal", formatValue(scratch[format.CDP_hw_seasonal]), 3)
+        yield element("last_seasonal",
+                      formatValue(scratch[format.CDP_hw_last_seasonal]), 3)
+        yield element("init_flag", scratch[format.CDP_init_seasonal], 3)
+    elif rra.cf == "FAILURES":
+        # the violation history is kept as one byte per entry
+        history = cdp.pack(rrd.layout)[:rra.par[format.RRA_window_len]]
+        yield element(
+            "history", "".join([str(ord(byte)) for byte in history]), 3)
+    elif rra.cf != "DEVPREDICT":
+        for name, index in [
+            ("primary_value", format.CDP_primary_val),
+            ("secondary_value", format.CDP_secondary_val),
+            ("value", format.CDP_val)]:
+            yield element(name, formatValue(scratch[index]), 3)
+        yield element(
+            "unknown_datapoints", scratch[format.CDP_unkn_pdp_cnt], 3)
+
+
+def iterDump(rrd):
+    """
+    Yield the XML dump of an RRDFile as strings of a line or less.
+    """
+    yield '<?xml version="1.0" encoding="utf-8"?>\n'
+    yield "<!-- Round Robin Database Dump -->\n"
+    yield "<rrd>\n"
+    yield element("version", rrd.version, 1)
+    yield "\t<step> %s </step> <!-- Seconds -->\n" % rrd.step
+    yield "\t<lastupdate> %s </lastupdate> <!-- %s -->\n\n" % (
+        rrd.lastupdate, formatTime(rrd.lastupdate))
+    for ds in rrd.ds:
+        yield "\t<ds>\n"
+        yield element("name", ds.name, 2)
+        yield element("type", ds.type, 2)
+        yield element("minimal_heartbeat", ds.minimal_heartbeat, 2)
+        yield element("min", formatValue(ds.min), 2)
+        yield element("max", formatValue(ds.max), 2)
+        yield "\n\t\t<!-- PDP Status -->\n"
+        lastDS = ds.last_ds
+        if lastDS == "U":
+            lastDS = "UNKN"
+        yield element("last_ds", lastDS, 2)
+        yield element("value", formatValue(ds.value), 2)
+        yield element("unknown_sec", ds.unknown_sec, 2)
+        yield "\t</ds>\n\n"
+
+    yield "<!-- Round Robin Archives -->\n"
+    for rra in rrd.rra:
+        yield "\t<rra>\n"
+        yield element("cf", rra.cf, 2)
+        yield "\t\t<pdp_per_row> %s </pdp_per_row>" % rra.pdp_per_row
+        yield " <!-- %s seconds -->\n\n" % (rra.pdp_per_row * rrd.step)
+        yield "\t\t<params>\n"
+        for line in iterParams(rrd, rra):
+            yield line
+        yield "\t\t</params>\n"
+        yield "\t\t<cdp_prep>\n"
+        for cdp in rra.cdp_prep.ds:
+            yield "\t\t\t<ds>\n"
+            for line in iterCDPPrep(rrd, rra, cdp):
+                yield line
+            yield "\t\t\t</ds>\n"
+        yield "\t\t</cdp_prep>\n"
+        yield "\t\t<database>\n"
+        for timestamp, values in rra.database.items():
+            yield "\t\t\t<!-- %s / %s --> <row>%s</row>\n" % (
+                formatTime(timestamp), timestamp,
+                "".join(["<v> %s </v>" % formatValue(value)
+                         for value in values]))
+        yield "\t\t</database>\n"
+        yield "\t</rra>\n"
+    yield "</rrd>\n"
@@ -0,0 +1,235 @@
+"""
+An in-process implementation of "rrdtool fetch" for the native backend.
+
+The archive is chosen the way rrd_fetch.c chooses it and the values are
+copied out of the memory-mapped rows as arrays, one per data source, with
+NaN for unknown values.
+"""
+from array import array
+import re
+import time
+
+from pyrrd.backend.common import FetchResults
+from pyrrd.exceptions import FetchError
+
+
+NaN = float("nan")
+TIME_UNITS = {
+    "": 1, "s": 1, "sec": 1, "second": 1, "seconds": 1,
+    "m": 60, "min": 60, "minute": 60, "minutes": 60,
+    "h": 3600, "hour": 3600, "hours": 3600,
+    "d": 86400, "day": 86400, "days": 86400,
+    "w": 604800, "week": 604800, "weeks": 604800,
+    "mon": 2678400, "month": 2678400, "months": 2678400,
+    "y": 31536000, "year": 31536000, "years": 31536000,
+    }
+OFFSET_PATTERN = re.compile(r"([+-])\s*(\d+)\s*([a-z]*)")
+
+
+def parseOffset(spec):
+    """
+    >>> parseOffset("-1d")
+    -86400
+    >>> parseOffset("-1h+30min")
+    -1800
+    >>> parseOffset("")
+    0
+    """
+    total = 0
+    position = 0
+    for match in OFFSET_PATTERN.finditer(spec):
+        if match.start() != position:
+            break
+        sign, amount, unit = match.groups()
+        if unit not in TIME_UNITS:
+            raise FetchError("unknown time unit '%s'" % unit)
+        amount = int(amount) * TIME_UNITS[unit]
+        if sign == "-":
+            amount = -amount
+        total += amount
+        position = match.end()
+    if position != len(spec):
+        raise FetchError("unsupported time specification '%s'" % spec)
+    return total
+
+
+def parseTime(spec, now, start=None, end=None):
+    """
+    Understand the simple forms of rrdtool's AT-style times: seconds since
+    the epoch, "now", and offsets from now, start or end.
+
+    >>> parseTime("920804400", 1000)
+    920804400
+    >>> parseTime("now-1h", 7200)
+    3600
+    >>> parseTime("-300", 1000)
+    700
+    >>> parseTime("end-1d", 1000, end=100000)
+    13600
+    """
+    spec = unicode(spec).strip().lower()
+    if re.match(r"^\d+$", spec):
+        return int(spec)
+    for prefix, reference in [("now", now), ("n", now), ("end", end),
+                              ("e", end), ("start", start), ("s", start)]:
+        if spec.startswith(prefix) and (
+            len(spec) == len(prefix) or spec[len(prefix)] in "+-"):
+            if reference is None:
+                raise FetchError(
+                    "'%s' cannot be used here: %s" % (prefix, spec))
+            return reference + parseOffset(spec[len(prefix):])
+    if spec[:1] in "+-":
+        return now + parseOffset(spec)
+    raise FetchError("unsupported time specification '%s'" % spec)
+
+
+def parseQuery(query):
+    """
+    Take apart the arguments built by prepareObject("fetch", ...).
+
+    >>> parseQuery(["AVERAGE", "--start", "920804400", "--end", "920809200"])
+    ('AVERAGE', None, '920804400', '920809200')
+    >>> parseQuery("MAX -r 3600")
+    ('MAX', '3600', None, None)
+    """
+    if isinstance(query, basestring):
+        query = query.split()
+    options = {}
+    names = {"--resolution": "resolution", "-r": "resolution",
+             "--start": "start", "-s": "start", "--end": "end", "-e": "end"}
+    query = iter(query)
+    cf = None
+    for arg in query:
+        if arg in names:
+            options[names[arg]] = query.next()
+        elif "=" in arg and arg.split("=", 1)[0] in names:
+            name, value = arg.split("=", 1)
+            options[names[name]] = value
+        elif cf is None:
+            cf = arg.upper()
+        else:
+            raise FetchError("unknown fetch argument '%s'" % arg)
+    return (cf, options.get("resolution"), options.get("start"),
+            options.get("end"))
+
+
+def resolveTimes(start, end, now=None):
+    """
+    Apply rrdtool's defaults: end is now and start is one day before end.
+    """
+    if now is None:
+        now = int(time.time())
+    if end is None:
+        end = "now"
+    if start is None:
+        start = "end-1d"
+    # either may refer to the other, but not both
+    try:
+        endTime = parseTime(end, now)
+        startTime = parseTime(start, now, end=endTime)
+    except FetchError:
+        startTime = parseTime(start, now)
+        endTime = parseTime(end, now, start=startTime)
+    if startTime > endTime:
+        raise FetchError("start (%s) should be less than end (%s)" % (
+            startTime, endTime))
+    return startTime, endTime
+
+
+def selectRRA(rrd, cf, step, start, end):
+    """
+    Return the index of the archive rrdtool would read: among the archives
+    with the right consolidation function, the one whose resolution is
+    closest to step of those that reach back to start, or else the one that
+    reaches back furthest. As in rrd_fetch.c, the end is not considered, so
+    an end after the last update (such as "now") doesn't change the choice.
+    """
+    bestFull = bestPartial = None
+    for index, rra in enumerate(rrd.rra):
+        if rra.cf != cf:
+            continue
+        interval = rra.pdp_per_row * rrd.step
+        calEnd = rrd.lastupdate - rrd.lastupdate % interval
+        calStart = calEnd - interval * rra.rows
+        stepDiff = abs(step - interval)
+        if calStart <= start:
+            if bestFull is None or stepDiff < bestFull[0]:
+                bestFull = (stepDiff, index)
+        else:
+            match = (end - start) - (calStart - start)
+            if (bestPartial is None or match > bestPartial[0] or
+                (match == bestPartial[0] and stepDiff < bestPartial[1])):
+                bestPartial = (match, stepDiff, index)
+    if bestFull is not None:
+        return bestFull[1]
+    elif bestPartial is not None:
+        return bestPartial[2]
+    raise FetchError(
+        "the RRD does not contain an RRA matching the chosen CF")
+
+
+def locate(rrd, cf, resolution=None, start=None, end=None):
+    """
+    Work out what a fetch returns: the RRA, the step, the aligned start and
+    end, and the range of logical rows (which may reach before the first or
+    past the last row of the RRA; those rows are unknown).
+    """
+    start, end = resolveTimes(start, end)
+    step = int(resolution or 1)
+    rra = rrd.rra[selectRRA(rrd, cf.upper(), step, start, end)]
+
+    step = rra.pdp_per_row * rrd.step
+    start -= start % step
+    end += step - end % step
+    rraEnd = rrd.lastupdate - rrd.lastupdate % step
+    rraStart = rraEnd - step * (rra.rows - 1)
+    first = (start + step - rraStart) // step
+    last = rra.rows - (rraEnd - end) // step
+    return rra, step, start, end, first, last
+
+
+def fetch(rrd, cf, resolution=None, start=None, end=None):
+    """
+    Fetch from an RRDFile. The rows returned are those with timestamps
+    after start up to and including end, once both have been aligned to the
+    archive's resolution.
+    """
+    rra, step, start, end, first, last = locate(
+        rrd, cf, resolution, start, end)
+    width = len(rrd.ds)
+    values = rra.database.getValues(max(first, 0), min(last, rra.rows))
+    before = min(max(-first, 0), last - first)
+    after = min(max(last - rra.rows, 0), last - first - before)
+    columns = []
+    for column in xrange(width):
+        data = array("d", [NaN]) * before
+        data.extend(values[column::width])
+        data.extend(array("d", [NaN]) * after)
+        columns.append(data)
+    times = array("l", xrange(start + step, end + step, step))
+    return FetchResults(start, end, step, [ds.name for ds in rrd.ds],
+                        times, columns)
+
+
+def iterRows(rrd, cf, resolution=None, start=None, end=None,
+             chunkSize=4096):
+    """
+    Yield the rows fetch would return as (timestamp, values) tuples,
+    reading chunkSize rows at a time from the file.
+    """
+    rra, step, start, end, first, last = locate(
+        rrd, cf, resolution, start, end)
+    width = len(rrd.ds)
+    unknown = (NaN,) * width
+    time = start + step
+    for row in xrange(first, last, chunkSize):
+        stop = min(row + chunkSize, last)
+        values = rra.database.getValues(
+            min(max(row, 0), rra.rows), max(min(stop, rra.rows), 0))
+        for index in xrange(row, stop):
+            if 0 <= index < rra.rows:
+                offset = (index - max(row, 0)) * width
+                yield time, tuple(values[offset:offset + width])
+            else:
+                yield time, unknown
+            time += step
@@ -62,12 +62,301 @@ new words:
        originated from the same data source (ds).
 
 """
+import struct
+import sys
+
+from pyrrd.exceptions import FormatError
+
+
 RRD_COOKIE = "RRD"
+VERSION1 = "0001"
 VERSION2 = "0002"
 VERSION3 = "0003"
 VERSION4 = "0004"
+VERSIONS = [VERSION1, VERSION2, VERSION3, VERSION4]
 FLOAT_COOKIE = 8.642135e130
 
 # It looks like some of the header delimited with "\x00"
 #   - splitting on that gives the RRD_COOKIE at index 0
 #   - an the VERSION at index 1
+
+DS_NAM_SIZE = 20
+DST_SIZE = 20
+CF_NAM_SIZE = 20
+LAST_DS_LEN = 30
+# every par/scratch array in rrd_format.h has ten unival entries
+MAX_PAR = 10
+UNIVAL_SIZE = 8
+VALUE_SIZE = 8
+
+# indices into ds_def_t.par
+DS_mrhb_cnt = 0
+DS_min_val = 1
+DS_max_val = 2
+DS_cdef = 3
+
+# indices into rra_def_t.par
+RRA_cdp_xff_val = 0
+RRA_hw_alpha = 1
+RRA_hw_beta = 2
+RRA_dependent_rra_idx = 3
+RRA_seasonal_smooth_idx = 4
+RRA_failure_threshold = 5
+RRA_seasonal_gamma = 1
+RRA_seasonal_smoothing_window = 2
+RRA_delta_pos = 1
+RRA_delta_neg = 2
+RRA_window_len = 4
+
+# indices into pdp_prep_t.scratch
+PDP_unkn_sec_cnt = 0
+PDP_val = 1
+
+# indices into cdp_prep_t.scratch
+CDP_val = 0
+CDP_unkn_pdp_cnt = 1
+CDP_hw_intercept = 2
+CDP_hw_last_intercept = 3
+CDP_hw_slope = 4
+CDP_hw_last_slope = 5
+CDP_hw_seasonal = 2
+CDP_hw_last_seasonal = 3
+CDP_init_seasonal = 6
+CDP_seasonal_deviation = 2
+CDP_null_count = 6
+CDP_last_null_count = 7
+CDP_primary_val = 8
+CDP_secondary_val = 9
+
+# par entries that hold an unsigned long rather than a double
+DS_COUNT_PARAMS = [DS_mrhb_cnt]
+PDP_COUNT_PARAMS = [PDP_unkn_sec_cnt]
+CDP_COUNT_PARAMS = [CDP_unkn_pdp_cnt, CDP_null_count, CDP_last_null_count]
+
+
+def rraCountParams(cf):
+    """
+    The rra_def_t par entries that an RRA with the given consolidation
+    function stores as unsigned longs.
+
+    >>> rraCountParams("AVERAGE")
+    []
+    >>> rraCountParams("HWPREDICT")
+    [3]
+    """
+    if cf in ["AVERAGE", "MIN", "MAX", "LAST"]:
+        return []
+    elif cf == "FAILURES":
+        return [RRA_dependent_rra_idx, RRA_window_len, RRA_failure_threshold]
+    elif cf in ["SEASONAL", "DEVSEASONAL"]:
+        return [RRA_dependent_rra_idx, RRA_seasonal_smooth_idx]
+    return [RRA_dependent_rra_idx]
+
+
+def align(offset, alignment):
+    """
+    >>> align(9, 4)
+    12
+    >>> align(9, 8)
+    16
+    >>> align(16, 8)
+    16
+    """
+    return (offset + alignment - 1) // alignment * alignment
+
+
+class Layout(object):
+    """
+    RRD files are a straight dump of the C structs in rrd_format.h, so their
+    layout depends on the compiler that wrote them: the byte order, the size
+    of an unsigned long (and time_t) and the alignment of a double.
+
+    >>> i386 = Layout("<", longSize=4, doubleAlign=4)
+    >>> i386.statHeadSize, i386.dsDefSize, i386.rraDefSize
+    (112, 120, 108)
+    >>> i386.headerSize("0003", 1, 1)
+    544
+
+    >>> amd64 = Layout("<", longSize=8, doubleAlign=8)
+    >>> amd64.statHeadSize, amd64.dsDefSize, amd64.rraDefSize
+    (128, 120, 120)
+    >>> amd64.headerSize("0003", 1, 2)
+    792
+    """
+    def __init__(self, byteOrder="<", longSize=8, doubleAlign=8):
+        self.byteOrder = byteOrder
+        self.longSize = longSize
+        self.doubleAlign = doubleAlign
+        self.longFormat = {4: "I", 8: "Q"}[longSize]
+        self.univalAlign = max(longSize, doubleAlign)
+
+        # stat_head_t
+        self.floatCookieOffset = align(len(RRD_COOKIE) + 1 + 5, doubleAlign)
+        self.dsCntOffset = align(self.floatCookieOffset + 8, longSize)
+        self.rraCntOffset = self.dsCntOffset + longSize
+        self.pdpStepOffset = self.rraCntOffset + longSize
+        offset = align(self.pdpStepOffset + longSize, self.univalAlign)
+        self.statHeadSize = align(
+            offset + MAX_PAR * UNIVAL_SIZE, self.univalAlign)
+        # ds_def_t
+        self.dsParOffset = align(DS_NAM_SIZE + DST_SIZE, self.univalAlign)
+        self.dsDefSize = self.dsParOffset + MAX_PAR * UNIVAL_SIZE
+        # rra_def_t
+        self.rowCntOffset = align(CF_NAM_SIZE, longSize)
+        self.pdpCntOffset = self.rowCntOffset + longSize
+        self.rraParOffset = align(
+            self.pdpCntOffset + longSize, self.univalAlign)
+        self.rraDefSize = self.rraParOffset + MAX_PAR * UNIVAL_SIZE
+        # pdp_prep_t, cdp_prep_t and rra_ptr_t
+        self.pdpScratchOffset = align(LAST_DS_LEN, self.univalAlign)
+        self.pdpPrepSize = self.pdpScratchOffset + MAX_PAR * UNIVAL_SIZE
+        self.cdpPrepSize = MAX_PAR * UNIVAL_SIZE
+        self.rraPtrSize = longSize
+
+    def __repr__(self):
+        return "Layout(%r, longSize=%s, doubleAlign=%s)" % (
+            self.byteOrder, self.longSize, self.doubleAlign)
+
+    def liveHeadSize(self, version):
+        """
+        Files older than version 0003 only store a time_t for the last
+        update; later ones add the microseconds as a long.
+        """
+        if version < VERSION3:
+            return self.longSize
+        return 2 * self.longSize
+
+    def headerSize(self, version, dsCount, rraCount):
+        return (self.statHeadSize
+            + dsCount * self.dsDefSize
+            + rraCount * self.rraDefSize
+            + self.liveHeadSize(version)
+            + dsCount * self.pdpPrepSize
+            + rraCount * dsCount * self.cdpPrepSize
+            + rraCount * self.rraPtrSize)
+
+    def unpackLong(self, data, offset):
+        return struct.unpack_from(
+            self.byteOrder + self.longFormat, data, offset)[0]
+
+    def unpackDouble(self, data, offset):
+        return struct.unpack_from(self.byteOrder + "d", data, offset)[0]
+
+    def packLong(self, value):
+        return struct.pack(self.byteOrder + self.longFormat, value)
+
+    def packDouble(self, value):
+        return struct.pack(self.byteOrder + "d", value)
+
+    def packHead(self, version, dsCount, rraCount, step):
+        """
+        Return a stat_head_t entry as bytes.
+        """
+        parSize = MAX_PAR * UNIVAL_SIZE
+        head = RRD_COOKIE + "\x00" + version + "\x00"
+        head += "\x00" * (self.floatCookieOffset - len(head))
+        head += self.packDouble(FLOAT_COOKIE)
+        head += "\x00" * (self.dsCntOffset - len(head))
+        head += self.packLong(dsCount)
+        head += self.packLong(rraCount)
+        head += self.packLong(step)
+        head += "\x00" * (self.statHeadSize - parSize - len(head))
+        return head + "\x00" * parSize
+
+    def packUnivals(self, values, countIndices):
+        """
+        The inverse of unpackUnivals.
+        """
+        chunks = []
+        for index, value in enumerate(values):
+            if index in countIndices:
+                chunk = self.packLong(value)
+                chunks.append(chunk + "\x00" * (UNIVAL_SIZE - len(chunk)))
+            else:
+                chunks.append(self.packDouble(value))
+        return "".join(chunks)
+
+    def unpackUnivals(self, data, offset, countIndices):
+        """
+        Return the ten entries of a par/scratch array. The entries listed in
+        countIndices are read as unsigned longs, the others as doubles.
+        """
+        values = []
+        for index in xrange(MAX_PAR):
+            position = offset + index * UNIVAL_SIZE
+            if index in countIndices:
+                values.append(self.unpackLong(data, position))
+            else:
+                values.append(self.unpackDouble(data, position))
+        return values
+
+
+def nativeLayout():
+    """
+    The layout used by the platform this interpreter runs on.
+    """
+    if sys.byteorder == "little":
+        byteOrder = "<"
+    else:
+        byteOrder = ">"
+    longSize = struct.calcsize("L")
+    doubleAlign = struct.calcsize("cd") - struct.calcsize("d")
+    return Layout(byteOrder, longSize, doubleAlign)
+
+
+def isPlausible(layout, data):
+    """
+    Check that the counts in a stat_head_t read with the given layout make
+    sense. Reading 8-byte longs as 4-byte ones gives a zero count (the high
+    half of the first one) and the reverse gives counts of 2**32 or more,
+    so this tells the long sizes apart.
+    """
+    values = [layout.unpackLong(data, offset) for offset in [
+        layout.dsCntOffset, layout.rraCntOffset, layout.pdpStepOffset]]
+    for value in values:
+        if not 0 < value < 2 ** 32:
+            return False
+    return True
+
+
+def detectLayout(data):
+    """
+    Work out the layout of a file from the first bytes of its header. The
+    float cookie is placed right after the version string, so its offset
+    gives away the alignment of doubles on the host that wrote the file and
+    the order of its bytes gives away the byte order. The size of a long is
+    found by checking which reading of the counts that follow makes sense.
+
+    >>> i386 = Layout("<", longSize=4, doubleAlign=4)
+    >>> detectLayout(i386.packHead(VERSION3, 1, 1, 300))
+    Layout('<', longSize=4, doubleAlign=4)
+    >>> ppc64 = Layout(">", longSize=8, doubleAlign=8)
+    >>> detectLayout(ppc64.packHead(VERSION1, 2, 3, 60))
+    Layout('>', longSize=8, doubleAlign=8)
+    >>> arm = Layout("<", longSize=4, doubleAlign=8)
+    >>> detectLayout(arm.packHead(VERSION4, 1, 1, 300))
+    Layout('<', longSize=4, doubleAlign=8)
+    """
+    if data[:len(RRD_COOKIE) + 1] != RRD_COOKIE + "\x00":
+        raise FormatError("Not an RRD file (bad cookie).")
+    if len(data) < 24:
+        raise FormatError("The RRD header is truncated.")
+    version = data[len(RRD_COOKIE) + 1:].split("\x00", 1)[0]
+    if version not in VERSIONS:
+        raise FormatError("Unsupported RRD file version '%s'." % version)
+    native = nativeLayout()
+    byteOrders = [native.byteOrder, {"<": ">", ">": "<"}[native.byteOrder]]
+    for byteOrder in byteOrders:
+        for doubleAlign in (8, 4):
+            offset = align(len(RRD_COOKIE) + 1 + 5, doubleAlign)
+            value = struct.unpack_from(byteOrder + "d", data, offset)[0]
+            if value != FLOAT_COOKIE:
+                continue
+            for longSize in (8, 4):
+                layout = Layout(byteOrder, longSize, doubleAlign)
+                if len(data) < layout.pdpStepOffset + longSize:
+                    raise FormatError("The RRD header is truncated.")
+                if isPlausible(layout, data):
+                    return layout
+    raise FormatError(
+        "This RRD file was written on an incompatible architecture.")
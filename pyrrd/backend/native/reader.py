@@ -0,0 +1,565 @@
+"""
+A pure-Python reader for binary RRD files. The classes in this module parse
+the sections described in format.py straight out of the file and present them
+as nodes, so the mapper module can build DS and RRA objects from them just as
+it does from the XML node classes in pyrrd.node.
+"""
+from array import array
+import math
+import mmap
+import struct
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pyrrd.backend.native import format
+from pyrrd.exceptions import FormatError
+from pyrrd.node import Node
+
+
+HEADER_READ_SIZE = 4096
+
+if sys.byteorder == "little":
+    nativeByteOrder = "<"
+else:
+    nativeByteOrder = ">"
+
+
+def cString(data):
+    """
+    >>> cString("speed\\x00\\x00\\x00")
+    'speed'
+    """
+    return data.split("\x00", 1)[0]
+
+
+def unknownAsNaN(value):
+    """
+    The XML nodes map unset limits to "NaN"; do the same here.
+
+    >>> unknownAsNaN(float("nan"))
+    'NaN'
+    >>> unknownAsNaN(-10.5)
+    -10.5
+    """
+    if math.isnan(value):
+        return "NaN"
+    return value
+
+
+def formatInfoValue(value):
+    """
+    Format a value the way "rrdtool info" prints it.
+
+    >>> formatInfoValue("AVERAGE")
+    '"AVERAGE"'
+    >>> formatInfoValue(300)
+    '300'
+    >>> formatInfoValue(0.5)
+    '5.0000000000e-01'
+    >>> formatInfoValue(None)
+    'NaN'
+    """
+    if value is None:
+        return "NaN"
+    elif isinstance(value, basestring):
+        return '"%s"' % value
+    elif isinstance(value, float):
+        return "%0.10e" % value
+    return "%d" % value
+
+
+class BinaryNode(Node):
+    """
+    A base class. Not used directly.
+    """
+    @property
+    def attributes(self):
+        return self.getAttributes()
+
+    def getAttribute(self, attrName):
+        """
+        """
+        return self.attributes[attrName]
+
+
+class DSNode(BinaryNode):
+    """
+    A data source: its ds_def_t entry together with its pdp_prep_t entry.
+    """
+    def __init__(self, index, layout, defData, prepData):
+        self.index = index
+        self.name = cString(defData[:format.DS_NAM_SIZE])
+        self.type = cString(
+            defData[format.DS_NAM_SIZE:format.DS_NAM_SIZE + format.DST_SIZE])
+        self.par = layout.unpackUnivals(
+            defData, layout.dsParOffset, format.DS_COUNT_PARAMS)
+        self.last_ds = cString(prepData[:format.LAST_DS_LEN])
+        self.scratch = layout.unpackUnivals(
+            prepData, layout.pdpScratchOffset, format.PDP_COUNT_PARAMS)
+
+    @property
+    def minimal_heartbeat(self):
+        return self.par[format.DS_mrhb_cnt]
+
+    @property
+    def min(self):
+        return self.par[format.DS_min_val]
+
+    @property
+    def max(self):
+        return self.par[format.DS_max_val]
+
+    @property
+    def value(self):
+        return self.scratch[format.PDP_val]
+
+    @property
+    def unknown_sec(self):
+        return self.scratch[format.PDP_unkn_sec_cnt]
+
+    def packPrep(self, layout):
+        """
+        Return this data source's pdp_prep_t entry as bytes.
+        """
+        lastDS = self.last_ds[:format.LAST_DS_LEN - 1]
+        lastDS += "\x00" * (layout.pdpScratchOffset - len(lastDS))
+        return lastDS + layout.packUnivals(
+            self.scratch, format.PDP_COUNT_PARAMS)
+
+    def getAttributes(self):
+        return {
+            "name": self.name,
+            "type": self.type,
+            "minimal_heartbeat": self.minimal_heartbeat,
+            "min": unknownAsNaN(self.min),
+            "max": unknownAsNaN(self.max),
+            "last_ds": self.last_ds,
+            "value": self.value,
+            "unknown_sec": self.unknown_sec,
+            }
+
+
+class CDPPrepDSNode(BinaryNode):
+    """
+    The consolidation state of one data source within one RRA.
+    """
+    def __init__(self, layout, data):
+        self.scratch = layout.unpackUnivals(
+            data, 0, format.CDP_COUNT_PARAMS)
+
+    def pack(self, layout):
+        return layout.packUnivals(self.scratch, format.CDP_COUNT_PARAMS)
+
+    def getAttributes(self):
+        return {
+            "primary_value": self.scratch[format.CDP_primary_val],
+            "secondary_value": self.scratch[format.CDP_secondary_val],
+            "value": self.scratch[format.CDP_val],
+            "unknown_datapoints": self.scratch[format.CDP_unkn_pdp_cnt],
+            }
+
+
+class CDPPrepNode(BinaryNode):
+    """
+    The cdp_prep_t entries of one RRA, one per data source.
+    """
+    def __init__(self):
+        self.ds = []
+
+    def getAttributes(self):
+        return {}
+
+
+class RRANode(BinaryNode):
+    """
+    An archive: its rra_def_t entry, its cdp_prep_t entries and its rra_ptr_t.
+    """
+    def __init__(self, index, layout, defData):
+        self.index = index
+        self.cf = cString(defData[:format.CF_NAM_SIZE])
+        self.rows = layout.unpackLong(defData, layout.rowCntOffset)
+        self.pdp_per_row = layout.unpackLong(defData, layout.pdpCntOffset)
+        self.par = layout.unpackUnivals(
+            defData, layout.rraParOffset, self.countParams())
+        self.cdp_prep = CDPPrepNode()
+        self.cur_row = None
+        # the file offset of the first row of this archive
+        self.offset = None
+        self.database = None
+
+    def countParams(self):
+        """
+        The par entries that this RRA's consolidation function stores as
+        unsigned longs.
+        """
+        return format.rraCountParams(self.cf)
+
+    @property
+    def xff(self):
+        return self.par[format.RRA_cdp_xff_val]
+
+    def getAttributes(self):
+        attributes = {
+            "cf": self.cf,
+            "rows": self.rows,
+            "pdp_per_row": self.pdp_per_row,
+            "database": self.database,
+            }
+        if self.cf in ["AVERAGE", "MIN", "MAX", "LAST"]:
+            attributes["xff"] = self.xff
+        elif self.cf == "HWPREDICT":
+            attributes["alpha"] = self.par[format.RRA_hw_alpha]
+            attributes["beta"] = self.par[format.RRA_hw_beta]
+            attributes["rra_num"] = self.par[format.RRA_dependent_rra_idx]
+        elif self.cf in ["SEASONAL", "DEVSEASONAL"]:
+            attributes["gamma"] = self.par[format.RRA_seasonal_gamma]
+            attributes["rra_num"] = self.par[format.RRA_dependent_rra_idx]
+            attributes["seasonal_period"] = self.rows
+        elif self.cf == "FAILURES":
+            attributes["threshold"] = self.par[format.RRA_failure_threshold]
+            attributes["window_length"] = self.par[format.RRA_window_len]
+            attributes["rra_num"] = self.par[format.RRA_dependent_rra_idx]
+        else:
+            attributes["rra_num"] = self.par[format.RRA_dependent_rra_idx]
+        return attributes
+
+
+class DatabaseView(object):
+    """
+    Read-only access to the rows of one RRA through a memory map of the file.
+    Nothing is read or copied until a row is asked for.
+
+    Rows are indexed in chronological order (0 is the oldest row), which
+    means the ring buffer is rotated by the RRA's cur_row pointer. Since a
+    rotated block cannot be expressed as a single contiguous view, the
+    segments() and arrays() methods return the older and the newer part of
+    the ring as two views; concatenating them gives the rows oldest first.
+
+    The pointer is the one read with the header, so rows written by later
+    updates show up in place but the rotation is not adjusted for them.
+    """
+    def __init__(self, rrdFile, rra):
+        self.rrdFile = rrdFile
+        self.rra = rra
+        self.width = len(rrdFile.ds)
+        self.rowSize = self.width * format.VALUE_SIZE
+        self.rowFormat = "%s%sd" % (rrdFile.layout.byteOrder, self.width)
+
+    def __repr__(self):
+        return "<%s of %s rows x %s ds>" % (
+            self.__class__.__name__, self.rra.rows, self.width)
+
+    def __len__(self):
+        return self.rra.rows
+
+    def getPhysicalRow(self, index):
+        rows = self.rra.rows
+        if index < 0:
+            index += rows
+        if not 0 <= index < rows:
+            raise IndexError("row index out of range")
+        return (self.rra.cur_row + 1 + index) % rows
+
+    def __getitem__(self, index):
+        offset = self.rra.offset + self.getPhysicalRow(index) * self.rowSize
+        return struct.unpack_from(self.rowFormat, self.rrdFile.mapping, offset)
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+    def getTime(self, index):
+        if index < 0:
+            index += len(self)
+        start, interval = self.rrdFile.rowTimes(self.rra.index)
+        return start + index * interval
+
+    def items(self):
+        """
+        Yield (time, values) tuples, oldest first.
+        """
+        time, interval = self.rrdFile.rowTimes(self.rra.index)
+        for values in self:
+            yield time, values
+            time += interval
+
+    def getValues(self, first, last):
+        """
+        Return the values of the rows first to last (exclusive, in
+        chronological order) as a flat array of doubles in host byte order.
+        The values are copied out of the memory map a segment at a time,
+        without creating a Python float per value.
+        """
+        values = array("d")
+        if first >= last:
+            return values
+        rows = self.rra.rows
+        physical = self.getPhysicalRow(first)
+        count = last - first
+        mapping = self.rrdFile.mapping
+        while count:
+            run = min(count, rows - physical)
+            start = self.rra.offset + physical * self.rowSize
+            values.fromstring(mapping[start:start + run * self.rowSize])
+            count -= run
+            physical = 0
+        if self.rrdFile.layout.byteOrder != nativeByteOrder:
+            values.byteswap()
+        return values
+
+    def getSplit(self):
+        """
+        The number of rows in the newer segment, i.e. the physical position
+        of the oldest row.
+        """
+        return (self.rra.cur_row + 1) % self.rra.rows
+
+    def segments(self):
+        """
+        Return the raw bytes of the older and the newer rows as two zero-copy
+        buffers over the memory map.
+        """
+        split = self.getSplit()
+        mapping = self.rrdFile.mapping
+        older = buffer(mapping, self.rra.offset + split * self.rowSize,
+                       (self.rra.rows - split) * self.rowSize)
+        newer = buffer(mapping, self.rra.offset, split * self.rowSize)
+        return older, newer
+
+    def arrays(self):
+        """
+        Return the older and the newer rows as two read-only NumPy arrays of
+        shape (rows, ds) that share memory with the memory map.
+        """
+        if numpy is None:
+            raise ImportError("NumPy is required for array access.")
+        dtype = numpy.dtype(self.rrdFile.layout.byteOrder + "f8")
+        split = self.getSplit()
+        mapping = self.rrdFile.mapping
+        older = numpy.frombuffer(
+            mapping, dtype, (self.rra.rows - split) * self.width,
+            self.rra.offset + split * self.rowSize)
+        newer = numpy.frombuffer(
+            mapping, dtype, split * self.width, self.rra.offset)
+        return older.reshape(-1, self.width), newer.reshape(-1, self.width)
+
+
+class RRDFile(BinaryNode):
+    """
+    The top-level node: the stat_head_t and live_head_t entries of a file,
+    with the data sources and archives as children.
+
+    Only the header is read when the object is created; the file is memory
+    mapped the first time one of the DatabaseView objects (the "database"
+    attribute of each RRA) is accessed.
+    """
+    def __init__(self, filename, fh=None):
+        self.filename = filename
+        self.ds = []
+        self.rra = []
+        self._mapping = None
+        if fh is None:
+            self.read()
+        else:
+            self.readHeader(fh)
+
+    @property
+    def mapping(self):
+        if self._mapping is None:
+            fh = open(self.filename, "rb")
+            try:
+                self._mapping = mmap.mmap(
+                    fh.fileno(), 0, access=mmap.ACCESS_READ)
+            finally:
+                fh.close()
+        return self._mapping
+
+    def close(self):
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
+
+    def read(self):
+        fh = open(self.filename, "rb")
+        try:
+            self.readHeader(fh)
+        finally:
+            fh.close()
+
+    def readHeader(self, fh):
+        # a page holds the whole header of most files
+        data = fh.read(HEADER_READ_SIZE)
+        self.layout = layout = format.detectLayout(data)
+        if len(data) < layout.statHeadSize:
+            raise FormatError("The RRD header is truncated.")
+        self.version = cString(data[len(format.RRD_COOKIE) + 1:])
+        dsCount = layout.unpackLong(data, layout.dsCntOffset)
+        rraCount = layout.unpackLong(data, layout.rraCntOffset)
+        self.step = layout.unpackLong(data, layout.pdpStepOffset)
+        self.headerSize = layout.headerSize(self.version, dsCount, rraCount)
+        if len(data) < self.headerSize:
+            data += fh.read(self.headerSize - len(data))
+        if len(data) < self.headerSize:
+            raise FormatError("The RRD header is truncated.")
+
+        dsDefs = []
+        offset = layout.statHeadSize
+        for index in xrange(dsCount):
+            dsDefs.append(data[offset:offset + layout.dsDefSize])
+            offset += layout.dsDefSize
+        for index in xrange(rraCount):
+            self.rra.append(
+                RRANode(index, layout, data[offset:offset + layout.rraDefSize]))
+            offset += layout.rraDefSize
+
+        self.liveHeadOffset = offset
+        self.lastupdate = layout.unpackLong(data, offset)
+        self.lastupdateUsec = 0
+        if self.version >= format.VERSION3:
+            self.lastupdateUsec = layout.unpackLong(
+                data, offset + layout.longSize)
+        offset += layout.liveHeadSize(self.version)
+
+        for index, dsDef in enumerate(dsDefs):
+            self.ds.append(DSNode(index, layout, dsDef,
+                                  data[offset:offset + layout.pdpPrepSize]))
+            offset += layout.pdpPrepSize
+        for rra in self.rra:
+            for index in xrange(dsCount):
+                rra.cdp_prep.ds.append(CDPPrepDSNode(
+                    layout, data[offset:offset + layout.cdpPrepSize]))
+                offset += layout.cdpPrepSize
+
+        rowOffset = self.headerSize
+        for rra in self.rra:
+            rra.cur_row = layout.unpackLong(data, offset)
+            rra.offset = rowOffset
+            rra.database = DatabaseView(self, rra)
+            offset += layout.rraPtrSize
+            rowOffset += rra.rows * dsCount * format.VALUE_SIZE
+
+    def packState(self):
+        """
+        Return the part of the header that changes on update as bytes: the
+        live_head_t, pdp_prep_t, cdp_prep_t and rra_ptr_t entries, which sit
+        next to each other starting at liveHeadOffset.
+        """
+        layout = self.layout
+        chunks = [layout.packLong(self.lastupdate)]
+        if self.version >= format.VERSION3:
+            chunks.append(layout.packLong(self.lastupdateUsec))
+        for ds in self.ds:
+            chunks.append(ds.packPrep(layout))
+        for rra in self.rra:
+            for ds in rra.cdp_prep.ds:
+                chunks.append(ds.pack(layout))
+        for rra in self.rra:
+            chunks.append(layout.packLong(rra.cur_row))
+        return "".join(chunks)
+
+    def getAttributes(self):
+        return {
+            "version": int(self.version),
+            "step": self.step,
+            "lastupdate": self.lastupdate,
+            }
+
+    def getInfo(self, filename=None):
+        """
+        Return the header as the (key, value) pairs "rrdtool info" prints,
+        in the same order and with the same keys. Unknown values are given
+        as None, as the rrdtool Python bindings do.
+        """
+        def value(number):
+            if math.isnan(number):
+                return None
+            return number
+
+        info = [
+            ("filename", filename or self.filename),
+            ("rrd_version", self.version),
+            ("step", self.step),
+            ("last_update", self.lastupdate),
+            ("header_size", self.headerSize),
+            ]
+        for ds in self.ds:
+            prefix = "ds[%s]." % ds.name
+            info.append((prefix + "index", ds.index))
+            info.append((prefix + "type", ds.type))
+            if ds.type != "COMPUTE":
+                info.append((prefix + "minimal_heartbeat",
+                             ds.minimal_heartbeat))
+                info.append((prefix + "min", value(ds.min)))
+                info.append((prefix + "max", value(ds.max)))
+            info.append((prefix + "last_ds", ds.last_ds))
+            info.append((prefix + "value", value(ds.value)))
+            info.append((prefix + "unknown_sec", ds.unknown_sec))
+        for index, rra in enumerate(self.rra):
+            prefix = "rra[%s]." % index
+            info.append((prefix + "cf", rra.cf))
+            info.append((prefix + "rows", rra.rows))
+            info.append((prefix + "cur_row", rra.cur_row))
+            info.append((prefix + "pdp_per_row", rra.pdp_per_row))
+            par = rra.par
+            if rra.cf in ["HWPREDICT", "MHWPREDICT"]:
+                info.append((prefix + "alpha", value(par[format.RRA_hw_alpha])))
+                info.append((prefix + "beta", value(par[format.RRA_hw_beta])))
+            elif rra.cf in ["SEASONAL", "DEVSEASONAL"]:
+                info.append((prefix + "gamma",
+                             value(par[format.RRA_seasonal_gamma])))
+                if self.version >= format.VERSION4:
+                    info.append((prefix + "smoothing_window", value(
+                        par[format.RRA_seasonal_smoothing_window])))
+            elif rra.cf == "FAILURES":
+                info.append((prefix + "delta_pos",
+                             value(par[format.RRA_delta_pos])))
+                info.append((prefix + "delta_neg",
+                             value(par[format.RRA_delta_neg])))
+                info.append((prefix + "failure_threshold",
+                             par[format.RRA_failure_threshold]))
+                info.append((prefix + "window_length",
+                             par[format.RRA_window_len]))
+            elif rra.cf != "DEVPREDICT":
+                info.append((prefix + "xff", value(rra.xff)))
+            for dsIndex, cdp in enumerate(rra.cdp_prep.ds):
+                cdpPrefix = "%scdp_prep[%s]." % (prefix, dsIndex)
+                scratch = cdp.scratch
+                if rra.cf in ["HWPREDICT", "MHWPREDICT"]:
+                    info.append((cdpPrefix + "intercept",
+                                 value(scratch[format.CDP_hw_intercept])))
+                    info.append((cdpPrefix + "slope",
+                                 value(scratch[format.CDP_hw_slope])))
+                    info.append((cdpPrefix + "NaN_count",
+                                 scratch[format.CDP_null_count]))
+                elif rra.cf == "SEASONAL":
+                    info.append((cdpPrefix + "seasonal",
+                                 value(scratch[format.CDP_hw_seasonal])))
+                elif rra.cf == "DEVSEASONAL":
+                    info.append((cdpPrefix + "deviation", value(
+                        scratch[format.CDP_seasonal_deviation])))
+                elif rra.cf not in ["DEVPREDICT", "FAILURES"]:
+                    info.append((cdpPrefix + "value",
+                                 value(scratch[format.CDP_val])))
+                    info.append((cdpPrefix + "unknown_datapoints",
+                                 scratch[format.CDP_unkn_pdp_cnt]))
+        return info
+
+    def rowTimes(self, index):
+        """
+        Return the timestamp of the oldest row of an RRA and the number of
+        seconds between rows.
+        """
+        rra = self.rra[index]
+        interval = rra.pdp_per_row * self.step
+        newest = self.lastupdate - self.lastupdate % interval
+        return newest - (rra.rows - 1) * interval, interval
+
+    def rows(self, index):
+        """
+        Yield the (time, values) rows of an RRA, oldest first.
+        """
+        return self.rra[index].database.items()
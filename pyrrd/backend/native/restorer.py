@@ -0,0 +1,265 @@
+"""
+An in-process implementation of "rrdtool restore" for the native backend.
+
+The XML dump is read with iterparse and each element is dropped once it has
+been handled, so memory use does not grow with the number of rows. The
+definitions and consolidation state (which are small) are collected as they
+come; the rows are packed into a spool file as they are parsed, since the
+header that goes in front of them can only be written once the number of
+archives is known. Like rrdtool, the restored archives start with cur_row
+pointing at their last row, i.e. the rows are stored oldest first.
+"""
+import shutil
+import struct
+import tempfile
+from cStringIO import StringIO
+
+from pyrrd.backend.native import creator, format
+from pyrrd.backend.native.reader import RRDFile
+from pyrrd.exceptions import CreateError, RestoreError
+from pyrrd.util import iterparse
+
+
+# the <params> children and the rra_def_t par entries they are stored in
+RRA_PARAMS = {
+    "xff": format.RRA_cdp_xff_val,
+    "hw_alpha": format.RRA_hw_alpha,
+    "hw_beta": format.RRA_hw_beta,
+    "dependent_rra_idx": format.RRA_dependent_rra_idx,
+    "seasonal_gamma": format.RRA_seasonal_gamma,
+    "seasonal_smoothing_window": format.RRA_seasonal_smoothing_window,
+    "seasonal_smooth_idx": format.RRA_seasonal_smooth_idx,
+    "delta_pos": format.RRA_delta_pos,
+    "delta_neg": format.RRA_delta_neg,
+    "window_len": format.RRA_window_len,
+    "failure_threshold": format.RRA_failure_threshold,
+    }
+# the <cdp_prep><ds> children and the cdp_prep_t scratch entries they are
+# stored in
+CDP_PREP_VALUES = {
+    "primary_value": format.CDP_primary_val,
+    "secondary_value": format.CDP_secondary_val,
+    "value": format.CDP_val,
+    "unknown_datapoints": format.CDP_unkn_pdp_cnt,
+    "intercept": format.CDP_hw_intercept,
+    "last_intercept": format.CDP_hw_last_intercept,
+    "slope": format.CDP_hw_slope,
+    "last_slope": format.CDP_hw_last_slope,
+    "nan_count": format.CDP_null_count,
+    "last_nan_count": format.CDP_last_null_count,
+    "seasonal": format.CDP_hw_seasonal,
+    "last_seasonal": format.CDP_hw_last_seasonal,
+    "deviation": format.CDP_seasonal_deviation,
+    "last_deviation": format.CDP_hw_last_seasonal,
+    "init_flag": format.CDP_init_seasonal,
+    }
+
+
+def parseNumber(text, isCount=False):
+    """
+    >>> parseNumber(" 5.0000000000e-01 ")
+    0.5
+    >>> parseNumber("NaN")
+    nan
+    >>> parseNumber("24", isCount=True)
+    24
+    """
+    try:
+        if isCount:
+            return int(text)
+        return float(text)
+    except (TypeError, ValueError):
+        raise RestoreError("invalid number '%s' in the dump" % text)
+
+
+class Restorer(object):
+    """
+    Collects what is needed to write a binary file from the events of an
+    iterparse of an XML dump.
+    """
+    def __init__(self, layout):
+        self.layout = layout
+        self.version = format.VERSION3
+        self.step = None
+        self.lastupdate = None
+        self.dss = []
+        # the pdp_prep_t of each data source: (last_ds, value, unknown_sec)
+        self.pdpPreps = []
+        self.rras = []
+        # the cdp_prep_t scratch of each RRA, one list per data source
+        self.cdpPreps = []
+        self.spool = tempfile.TemporaryFile()
+        self.current = None
+        self.rowCount = 0
+
+    def parse(self, source):
+        path = []
+        parent = None
+        for event, element in iterparse(source, events=("start", "end")):
+            if event == "start":
+                path.append(element.tag)
+                if len(path) == 3 and path[1:] == ["rra", "database"]:
+                    parent = element
+                continue
+            self.handle(path[1:], element)
+            path.pop()
+            if path[1:] == ["rra", "database"]:
+                # the row has been packed; let go of it
+                parent.clear()
+            elif len(path) <= 2:
+                element.clear()
+
+    def handle(self, path, element):
+        text = (element.text or "").strip()
+        if path in [["version"], ["step"], ["lastupdate"]]:
+            if path[0] == "version":
+                if text in format.VERSIONS:
+                    self.version = text
+            elif path[0] == "step":
+                self.step = parseNumber(text, True)
+            else:
+                self.lastupdate = parseNumber(text, True)
+        elif path[:1] == ["ds"] and len(path) == 2:
+            if path[1] == "cdef":
+                raise RestoreError("COMPUTE data sources can't be restored")
+            self.current = self.current or {}
+            self.current[path[1]] = text
+        elif path == ["ds"]:
+            self.addDS(self.current or {})
+            self.current = None
+        elif path[:1] == ["rra"]:
+            self.handleRRA(path[1:], element, text)
+
+    def addDS(self, values):
+        try:
+            ds = creator.DSDefinition(
+                values["name"], values["type"],
+                values["minimal_heartbeat"], values["min"], values["max"])
+            ds.validate()
+            lastDS = values["last_ds"]
+            if lastDS == "UNKN":
+                lastDS = "U"
+            self.pdpPreps.append((
+                lastDS, parseNumber(values["value"]),
+                parseNumber(values["unknown_sec"], True)))
+        except KeyError, error:
+            raise RestoreError("<ds> without <%s>" % error.args[0])
+        except CreateError, error:
+            raise RestoreError(error.args[0])
+        self.dss.append(ds)
+
+    def handleRRA(self, path, element, text):
+        if path == ["cf"]:
+            self.rras.append(creator.RRADefinition(text, 0.0, 1, 0))
+            self.cdpPreps.append([])
+            self.rowCount = 0
+        elif path == ["pdp_per_row"]:
+            self.rras[-1].steps = parseNumber(text, True)
+        elif len(path) == 2 and path[0] == "params" or path == ["xff"]:
+            rra = self.rras[-1]
+            name = path[-1]
+            if name not in RRA_PARAMS:
+                return
+            index = RRA_PARAMS[name]
+            value = parseNumber(
+                text, index in format.rraCountParams(rra.cf))
+            if index == format.RRA_cdp_xff_val:
+                rra.xff = value
+            else:
+                rra.params[index] = value
+        elif path == ["cdp_prep", "ds"]:
+            self.cdpPreps[-1].append(self.current or {})
+            self.current = None
+        elif len(path) == 3 and path[:2] == ["cdp_prep", "ds"]:
+            self.current = self.current or {}
+            self.current[path[2]] = text
+        elif path == ["database", "row"]:
+            self.addRow(element)
+        elif path == []:
+            self.rras[-1].rows = self.rowCount
+            try:
+                self.rras[-1].validate()
+            except CreateError, error:
+                raise RestoreError(error.args[0])
+
+    def addRow(self, element):
+        values = [parseNumber((v.text or "").strip()) for v in element]
+        if len(values) != len(self.dss):
+            raise RestoreError("a row has %s values for %s data sources" % (
+                len(values), len(self.dss)))
+        self.spool.write(struct.pack(
+            "%s%sd" % (self.layout.byteOrder, len(values)), *values))
+        self.rowCount += 1
+
+    def packCDPPrep(self, rra, values):
+        """
+        Return the scratch entries of one cdp_prep_t.
+        """
+        layout = self.layout
+        if "history" in values:
+            # FAILURES keeps its violation history as bytes instead
+            history = "".join([chr(int(flag)) for flag in values["history"]])
+            return layout.unpackUnivals(
+                creator.pad(history, layout.cdpPrepSize), 0,
+                format.CDP_COUNT_PARAMS)
+        scratch = [0.0] * format.MAX_PAR
+        for index in format.CDP_COUNT_PARAMS:
+            scratch[index] = 0
+        for name, text in values.items():
+            if name in CDP_PREP_VALUES:
+                index = CDP_PREP_VALUES[name]
+                scratch[index] = parseNumber(
+                    text, index in format.CDP_COUNT_PARAMS)
+        return scratch
+
+    def write(self, filename):
+        if self.step is None or self.lastupdate is None:
+            raise RestoreError("the dump has no <step> or <lastupdate>")
+        if not self.dss or not self.rras:
+            raise RestoreError("the dump has no data sources or no RRAs")
+        layout = self.layout
+        definitions = creator.packDefinitions(
+            layout, self.step, self.dss, self.rras, self.version)
+        headerSize = layout.headerSize(
+            self.version, len(self.dss), len(self.rras))
+        rrd = RRDFile(filename, StringIO(creator.pad(definitions, headerSize)))
+        rrd.lastupdate = self.lastupdate
+        for ds, (lastDS, value, unknownSeconds) in zip(rrd.ds, self.pdpPreps):
+            ds.last_ds = lastDS
+            ds.scratch[format.PDP_val] = value
+            ds.scratch[format.PDP_unkn_sec_cnt] = unknownSeconds
+        for rra, definition, cdpPreps in zip(
+            rrd.rra, self.rras, self.cdpPreps):
+            rra.cur_row = rra.rows - 1
+            if len(cdpPreps) != len(rrd.ds):
+                raise RestoreError(
+                    "an RRA's cdp_prep has %s entries for %s data sources" % (
+                    len(cdpPreps), len(rrd.ds)))
+            for cdp, values in zip(rra.cdp_prep.ds, cdpPreps):
+                cdp.scratch = self.packCDPPrep(definition, values)
+
+        fh = open(filename, "wb")
+        try:
+            fh.write(definitions + rrd.packState())
+            self.spool.seek(0)
+            shutil.copyfileobj(self.spool, fh)
+        finally:
+            fh.close()
+            self.spool.close()
+
+
+def restore(source, filename, layout=None):
+    """
+    Write the file described by an XML dump (a file name or file object).
+    The file is written in the layout of this host unless another is given.
+    """
+    restorer = Restorer(layout or format.nativeLayout())
+    try:
+        restorer.parse(source)
+    except SyntaxError, error:
+        restorer.spool.close()
+        raise RestoreError("the dump is not valid XML: %s" % error)
+    except RestoreError:
+        restorer.spool.close()
+        raise
+    restorer.write(filename)
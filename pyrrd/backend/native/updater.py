@@ -0,0 +1,466 @@
+"""
+An in-process implementation of "rrdtool update" for the native backend.
+
+The Updater class follows rrd_update.c: each reading is turned into a primary
+data point (PDP) according to the data source type, heartbeat and limits;
+completed PDPs are consolidated into each RRA's cdp_prep with its
+consolidation function and xff; completed consolidated data points are
+written to the RRA's rows. All changes are kept in memory until write() is
+called, which writes the changed header state with a single write and each
+run of changed rows with one more.
+
+Only the GAUGE, COUNTER, DERIVE and ABSOLUTE data source types and the
+AVERAGE, MIN, MAX and LAST consolidation functions are handled; isSupported()
+tells whether a file can be updated here.
+"""
+import math
+import struct
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from pyrrd.backend.native import format
+from pyrrd.backend.native.reader import RRDFile
+from pyrrd.exceptions import UpdateError
+
+
+NaN = float("nan")
+SUPPORTED_DS_TYPES = ["GAUGE", "COUNTER", "DERIVE", "ABSOLUTE"]
+SUPPORTED_CFS = ["AVERAGE", "MIN", "MAX", "LAST"]
+
+
+def isSupported(rrd):
+    for ds in rrd.ds:
+        if ds.type not in SUPPORTED_DS_TYPES:
+            return False
+    for rra in rrd.rra:
+        if rra.cf not in SUPPORTED_CFS:
+            return False
+    return True
+
+
+def parseTime(timestamp):
+    """
+    Split an update time into whole seconds and microseconds.
+
+    >>> parseTime("920805600")
+    (920805600, 0)
+    >>> parseTime("920805600.25")
+    (920805600, 250000)
+    """
+    if timestamp.upper() == "N":
+        now = time.time()
+    else:
+        try:
+            now = float(timestamp)
+        except ValueError:
+            raise UpdateError("unknown update time '%s'" % timestamp)
+    seconds = int(math.floor(now))
+    return seconds, int(round((now - seconds) * 1e6))
+
+
+def parseArguments(data):
+    """
+    Separate the --template option from the readings in a list of update
+    arguments, as built by prepareObject.
+
+    >>> parseArguments(["--template", "ds1:ds0", "1000:1:2"])
+    (['ds1', 'ds0'], ['1000:1:2'])
+    >>> parseArguments("1000:1 1001:2")
+    (None, ['1000:1', '1001:2'])
+    """
+    if isinstance(data, basestring):
+        data = data.split()
+    template = None
+    readings = []
+    data = iter(data)
+    for arg in data:
+        if arg in ("--template", "-t"):
+            template = data.next().split(":")
+        elif arg.startswith("--template="):
+            template = arg.split("=", 1)[1].split(":")
+        else:
+            readings.append(arg)
+    return template, readings
+
+
+def counterDifference(new, old, dsType):
+    """
+    Return new - old, adjusting COUNTER values for 32 and 64 bit wraps.
+
+    >>> counterDifference("12357", "12345", "COUNTER")
+    12
+    >>> counterDifference("5", "4294967290", "COUNTER")
+    11
+    >>> counterDifference("5", "10", "DERIVE")
+    -5
+    """
+    try:
+        difference = int(new) - int(old)
+    except ValueError:
+        if dsType == "COUNTER":
+            raise UpdateError("not a simple unsigned integer: '%s'" % new)
+        try:
+            difference = float(new) - float(old)
+        except ValueError:
+            raise UpdateError("not a simple signed integer: '%s'" % new)
+    if dsType == "COUNTER":
+        if difference < 0:
+            difference += 2 ** 32
+        if difference < 0:
+            difference += 2 ** 64 - 2 ** 32
+    return difference
+
+
+class Updater(object):
+    """
+    Apply readings to an RRDFile. The file object passed to write() must be
+    the one the RRDFile header was read from, opened for writing.
+    """
+    def __init__(self, rrd):
+        self.rrd = rrd
+        self.dsNames = [ds.name for ds in rrd.ds]
+        # changed rows per RRA, keyed by physical row number
+        self.changedRows = [{} for rra in rrd.rra]
+
+    def parse(self, reading, template=None):
+        """
+        Return the time of a "time:value:value..." reading and its values
+        ordered like the file's data sources.
+        """
+        parts = reading.split(":")
+        seconds, usec = parseTime(parts[0])
+        values = parts[1:]
+        names = template or self.dsNames
+        if len(values) != len(names):
+            raise UpdateError(
+                "expected %s data source readings (got %s) from %s" % (
+                len(names), len(values), reading))
+        if template:
+            byName = dict(zip(template, values))
+            for name in template:
+                if name not in self.dsNames:
+                    raise UpdateError("unknown DS name '%s'" % name)
+            values = [byName.get(name, "U") for name in self.dsNames]
+        return seconds, usec, values
+
+    def run(self, readings, template=None):
+        for reading in readings:
+            seconds, usec, values = self.parse(reading, template)
+            self.apply(seconds, usec, values)
+
+    def apply(self, seconds, usec, values):
+        rrd = self.rrd
+        step = rrd.step
+        interval = (seconds + usec / 1e6) - (
+            rrd.lastupdate + rrd.lastupdateUsec / 1e6)
+        if interval <= 0:
+            raise UpdateError(
+                "illegal attempt to update using time %s when last update "
+                "time is %s (minimum one second step)" % (
+                seconds, rrd.lastupdate))
+
+        procPDPStart = rrd.lastupdate - rrd.lastupdate % step
+        occuPDPStart = seconds - seconds % step
+        if occuPDPStart > procPDPStart:
+            preInterval = (occuPDPStart - rrd.lastupdate
+                           - rrd.lastupdateUsec / 1e6)
+            postInterval = seconds - occuPDPStart + usec / 1e6
+        else:
+            preInterval = interval
+            postInterval = 0.0
+        elapsed = (occuPDPStart - procPDPStart) // step
+
+        newPDPs = self.updatePDPPrep(values, interval)
+        if elapsed == 0:
+            self.simpleUpdate(newPDPs, interval)
+        else:
+            pdps = self.processPDPs(newPDPs, interval, preInterval,
+                                    postInterval, occuPDPStart - procPDPStart)
+            self.updateCDPPreps(pdps, elapsed, procPDPStart // step)
+        rrd.lastupdate = seconds
+        rrd.lastupdateUsec = usec
+
+    def updatePDPPrep(self, values, interval):
+        """
+        Work out the amount each reading adds to the current PDP (NaN for
+        unknown) and remember the readings in last_ds.
+        """
+        newPDPs = []
+        for ds, value in zip(self.rrd.ds, values):
+            pdp = NaN
+            if value != "U" and ds.minimal_heartbeat >= interval:
+                if ds.type in ("COUNTER", "DERIVE"):
+                    if ds.last_ds != "U":
+                        pdp = float(counterDifference(
+                            value, ds.last_ds, ds.type))
+                else:
+                    try:
+                        number = float(value)
+                    except ValueError:
+                        raise UpdateError(
+                            "conversion of '%s' to float not complete" % value)
+                    if ds.type == "GAUGE":
+                        pdp = number * interval
+                    else:
+                        pdp = number
+                if not math.isnan(pdp):
+                    rate = pdp / interval
+                    if ((not math.isnan(ds.min) and rate < ds.min) or
+                        (not math.isnan(ds.max) and rate > ds.max)):
+                        pdp = NaN
+            newPDPs.append(pdp)
+        # only touch the file state once every reading has been accepted
+        for ds, value in zip(self.rrd.ds, values):
+            ds.last_ds = str(value[:format.LAST_DS_LEN - 1])
+        return newPDPs
+
+    def simpleUpdate(self, newPDPs, interval):
+        """
+        The update did not cross a PDP boundary; just accumulate.
+        """
+        for ds, pdp in zip(self.rrd.ds, newPDPs):
+            scratch = ds.scratch
+            if math.isnan(pdp):
+                scratch[format.PDP_unkn_sec_cnt] += int(math.floor(interval))
+            elif math.isnan(scratch[format.PDP_val]):
+                scratch[format.PDP_val] = pdp
+            else:
+                scratch[format.PDP_val] += pdp
+
+    def processPDPs(self, newPDPs, interval, preInterval, postInterval,
+                    elapsedSeconds):
+        """
+        Finish the PDPs the update completed and start the next ones. Return
+        the rate for the completed PDPs of each data source.
+        """
+        pdps = []
+        for ds, pdp in zip(self.rrd.ds, newPDPs):
+            scratch = ds.scratch
+            preUnknown = 0.0
+            if math.isnan(pdp):
+                preUnknown = preInterval
+            else:
+                if math.isnan(scratch[format.PDP_val]):
+                    scratch[format.PDP_val] = 0.0
+                scratch[format.PDP_val] += pdp / interval * preInterval
+
+            unknownSeconds = scratch[format.PDP_unkn_sec_cnt]
+            if (interval > ds.minimal_heartbeat or
+                self.rrd.step / 2.0 < unknownSeconds):
+                pdps.append(NaN)
+            else:
+                pdps.append(divide(scratch[format.PDP_val],
+                    elapsedSeconds - unknownSeconds - preUnknown))
+
+            if math.isnan(pdp):
+                scratch[format.PDP_unkn_sec_cnt] = int(
+                    math.floor(postInterval))
+                scratch[format.PDP_val] = NaN
+            else:
+                scratch[format.PDP_unkn_sec_cnt] = 0
+                scratch[format.PDP_val] = pdp / interval * postInterval
+        return pdps
+
+    def updateCDPPreps(self, pdps, elapsed, procPDPCount):
+        for rra in self.rrd.rra:
+            pdpCount = rra.pdp_per_row
+            startOffset = pdpCount - procPDPCount % pdpCount
+            if startOffset <= elapsed:
+                stepCount = (elapsed - startOffset) // pdpCount + 1
+            else:
+                stepCount = 0
+            for cdp, pdp in zip(rra.cdp_prep.ds, pdps):
+                if pdpCount > 1:
+                    self.consolidate(rra, cdp.scratch, pdp, elapsed,
+                                     startOffset, stepCount)
+                else:
+                    cdp.scratch[format.CDP_primary_val] = pdp
+                    cdp.scratch[format.CDP_secondary_val] = pdp
+            if stepCount:
+                self.writeRows(rra, stepCount)
+
+    def consolidate(self, rra, scratch, pdp, elapsed, startOffset, stepCount):
+        cf = rra.cf
+        pdpCount = rra.pdp_per_row
+        if not stepCount:
+            if math.isnan(pdp):
+                scratch[format.CDP_unkn_pdp_cnt] += elapsed
+            else:
+                scratch[format.CDP_val] = self.accumulate(
+                    cf, scratch[format.CDP_val], pdp, elapsed)
+            return
+
+        # at least one consolidated value is complete: CDP_primary_val is
+        # written to the first row and CDP_secondary_val fills in the rest
+        if math.isnan(pdp):
+            scratch[format.CDP_unkn_pdp_cnt] += startOffset
+            scratch[format.CDP_secondary_val] = NaN
+        else:
+            scratch[format.CDP_secondary_val] = pdp
+        if scratch[format.CDP_unkn_pdp_cnt] > pdpCount * rra.xff:
+            scratch[format.CDP_primary_val] = NaN
+        else:
+            scratch[format.CDP_primary_val] = self.finish(
+                cf, scratch, pdp, startOffset, pdpCount)
+
+        # start on the next consolidated value
+        intoNext = (elapsed - startOffset) % pdpCount
+        if math.isnan(pdp):
+            scratch[format.CDP_unkn_pdp_cnt] = intoNext
+        else:
+            scratch[format.CDP_unkn_pdp_cnt] = 0
+        scratch[format.CDP_val] = self.carryOver(cf, pdp, intoNext)
+
+    def accumulate(self, cf, cdp, pdp, count):
+        if math.isnan(cdp):
+            if cf == "AVERAGE":
+                return pdp * count
+            return pdp
+        if cf == "AVERAGE":
+            return cdp + pdp * count
+        elif cf == "MIN":
+            return min(cdp, pdp)
+        elif cf == "MAX":
+            return max(cdp, pdp)
+        return pdp
+
+    def finish(self, cf, scratch, pdp, startOffset, pdpCount):
+        cdp = scratch[format.CDP_val]
+        if cf == "AVERAGE":
+            cdp = ifNaN(cdp, 0.0)
+            return divide(cdp + ifNaN(pdp, 0.0) * startOffset,
+                pdpCount - scratch[format.CDP_unkn_pdp_cnt])
+        elif cf == "MAX":
+            return max(ifNaN(cdp, -float("inf")), ifNaN(pdp, -float("inf")))
+        elif cf == "MIN":
+            return min(ifNaN(cdp, float("inf")), ifNaN(pdp, float("inf")))
+        return pdp
+
+    def carryOver(self, cf, pdp, intoNext):
+        # as rrdtool's initialize_carry_over: an unknown primary value starts
+        # the next consolidated value from the CF's initial value
+        if intoNext == 0 or math.isnan(pdp):
+            return {"AVERAGE": 0.0, "MAX": -float("inf"),
+                    "MIN": float("inf")}.get(cf, NaN)
+        if cf == "AVERAGE":
+            return pdp * intoNext
+        return pdp
+
+    def writeRows(self, rra, stepCount):
+        """
+        Advance the RRA's pointer by stepCount rows, recording the values to
+        write. Rows that would be overwritten again within this update are
+        skipped.
+        """
+        rows = self.changedRows[rra.index]
+        index = format.CDP_primary_val
+        if stepCount > rra.rows:
+            rra.cur_row = (rra.cur_row + stepCount - rra.rows) % rra.rows
+            stepCount = rra.rows
+            index = format.CDP_secondary_val
+        for count in xrange(stepCount):
+            rra.cur_row = (rra.cur_row + 1) % rra.rows
+            rows[rra.cur_row] = tuple(
+                [ds.scratch[index] for ds in rra.cdp_prep.ds])
+            index = format.CDP_secondary_val
+
+    def write(self, fh):
+        rrd = self.rrd
+        fh.seek(rrd.liveHeadOffset)
+        fh.write(rrd.packState())
+        rowSize = len(rrd.ds) * format.VALUE_SIZE
+        for rra, rows in zip(rrd.rra, self.changedRows):
+            for first, values in contiguous(rows):
+                fh.seek(rra.offset + first * rowSize)
+                fh.write(struct.pack(
+                    "%s%sd" % (rrd.layout.byteOrder, len(values)), *values))
+            rows.clear()
+        fh.flush()
+
+
+def divide(numerator, denominator):
+    """
+    Divide the way C does with doubles, without raising on zero.
+
+    >>> divide(1.0, 4)
+    0.25
+    >>> divide(0.0, 0.0)
+    nan
+    >>> divide(-1.0, 0)
+    -inf
+    """
+    if denominator:
+        return numerator / float(denominator)
+    if numerator == 0 or math.isnan(numerator):
+        return NaN
+    return math.copysign(float("inf"), numerator)
+
+
+def ifNaN(value, default):
+    if math.isnan(value):
+        return default
+    return value
+
+
+def contiguous(rows):
+    """
+    Group a dict of row number -> values into runs of adjacent rows, yielding
+    the first row number of each run and the values of all its rows.
+
+    >>> list(contiguous({0: (1.0,), 1: (2.0,), 5: (3.0,)}))
+    [(0, [1.0, 2.0]), (5, [3.0])]
+    """
+    first = last = None
+    values = []
+    for row in sorted(rows):
+        if last is not None and row != last + 1:
+            yield first, values
+            first = None
+        if first is None:
+            first = row
+            values = []
+        values.extend(rows[row])
+        last = row
+    if first is not None:
+        yield first, values
+
+
+def lock(fh):
+    """
+    Take the same kind of lock rrdtool takes before it updates a file.
+    """
+    if fcntl is None:
+        return
+    try:
+        fcntl.lockf(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        raise UpdateError("could not lock RRD")
+
+
+def update(filename, data):
+    """
+    Apply a list of update arguments to a file with a single open. Return
+    False, without touching the file, if the file uses features that are
+    not supported here.
+    """
+    template, readings = parseArguments(data)
+    fh = open(filename, "r+b")
+    try:
+        lock(fh)
+        rrd = RRDFile(filename, fh)
+        if not isSupported(rrd):
+            return False
+        updater = Updater(rrd)
+        try:
+            updater.run(readings, template)
+        finally:
+            # like rrdtool, keep the readings that were applied before an
+            # error
+            updater.write(fh)
+    finally:
+        fh.close()
+    return True
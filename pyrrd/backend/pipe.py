@@ -0,0 +1,356 @@
+"""
+Run rrdtool commands through a long-running "rrdtool -" process.
+
+In this mode rrdtool reads one command per line from its standard input and
+answers each one with the command's output followed by a line starting with
+"OK" (or a single line starting with "ERROR:"), so a single process can
+serve any number of commands without a fork and exec for each. A pool of
+such processes, with the commands for each file kept on one of them, lets
+several threads run commands in parallel.
+"""
+import itertools
+import multiprocessing
+import os
+import Queue
+from subprocess import Popen, PIPE
+import sys
+import threading
+import zlib
+
+from pyrrd.exceptions import ExternalCommandError, QueueFullError
+
+
+# "rrdtool -" reads each command with fgets into a buffer of this many bytes
+# (MAX_LENGTH in rrd_tool.c); a longer line would be read as two commands
+MAX_LINE_LENGTH = 10000
+
+class RRDToolPipe(object):
+    """
+    A persistent "rrdtool -" process. The process is started on the first
+    command and restarted after it dies; commands from several threads are
+    run one after the other.
+
+    Relative file names are resolved by rrdtool in its own working directory,
+    so the process is restarted if that of this process has changed.
+    """
+    def __init__(self, command=None):
+        if command is None:
+            command = ["rrdtool", "-"]
+        self.command = command
+        self.process = None
+        self.cwd = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        devnull = open(os.devnull, "w")
+        try:
+            self.process = Popen(
+                self.command, stdin=PIPE, stdout=PIPE, stderr=devnull,
+                close_fds=(sys.platform != "win32"))
+        except OSError, error:
+            raise ExternalCommandError("Could not run '%s': %s" % (
+                " ".join(self.command), error.strerror))
+        finally:
+            devnull.close()
+        self.cwd = os.getcwd()
+
+    def stop(self):
+        process = self.process
+        self.process = None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+        except IOError:
+            pass
+        if process.poll() is None:
+            try:
+                process.terminate()
+            except OSError:
+                pass
+        process.wait()
+        process.stdout.close()
+
+    close = stop
+
+    def isAlive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def execute(self, command, args=""):
+        """
+        Run one command and return its output. An ERROR answer is raised as
+        an ExternalCommandError with rrdtool's message.
+        """
+        line = ("%s %s" % (command, args)).strip()
+        if isinstance(line, unicode):
+            line = line.encode("utf-8")
+        if "\n" in line or "\r" in line:
+            raise ExternalCommandError(
+                "Commands for rrdtool can't contain line breaks.")
+        if len(line) + 1 >= MAX_LINE_LENGTH:
+            raise ExternalCommandError(
+                "'%s' is too long for rrdtool's pipe mode (%s bytes)." % (
+                command, len(line)))
+        self.lock.acquire()
+        try:
+            if self.isAlive() and self.cwd != os.getcwd():
+                self.stop()
+            if not self.isAlive():
+                self.start()
+            return self.communicate(command, line)
+        finally:
+            self.lock.release()
+
+    def communicate(self, command, line):
+        try:
+            self.process.stdin.write(line + "\n")
+            self.process.stdin.flush()
+        except IOError:
+            self.stop()
+            raise ExternalCommandError(
+                "rrdtool exited before '%s' could be sent." % command)
+        output = []
+        while True:
+            response = self.process.stdout.readline()
+            if not response:
+                self.stop()
+                raise ExternalCommandError(
+                    "rrdtool exited while running '%s'." % command)
+            if response.startswith("ERROR"):
+                raise ExternalCommandError(response.strip())
+            if response.rstrip("\n") == "OK" or response.startswith("OK "):
+                return "".join(output)
+            output.append(response)
+
+
+class Job(object):
+    """
+    A command waiting for a worker, and then its output or error. A job
+    can be cancelled until a worker has started it; the callbacks are run
+    (in the worker's thread) with the job once it has finished or has been
+    cancelled.
+    """
+    def __init__(self, command, args):
+        self.command = command
+        self.args = args
+        self.output = None
+        self.error = None
+        self.started = False
+        self.cancelled = False
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def start(self):
+        """
+        Mark the job as started; returns False if it has been cancelled.
+        """
+        self.lock.acquire()
+        try:
+            self.started = not self.cancelled
+            return self.started
+        finally:
+            self.lock.release()
+
+    def cancel(self):
+        self.lock.acquire()
+        try:
+            if self.started or self.done.isSet():
+                return self.cancelled
+            self.cancelled = True
+        finally:
+            self.lock.release()
+        self.finish(error=ExternalCommandError(
+            "'%s' was cancelled" % self.command))
+        return True
+
+    def finish(self, output=None, error=None):
+        self.lock.acquire()
+        try:
+            self.output = output
+            self.error = error
+            self.done.set()
+            callbacks = self.callbacks
+            self.callbacks = []
+        finally:
+            self.lock.release()
+        for callback in callbacks:
+            callback(self)
+
+    def addCallback(self, callback):
+        self.lock.acquire()
+        try:
+            if not self.done.isSet():
+                self.callbacks.append(callback)
+                return
+        finally:
+            self.lock.release()
+        callback(self)
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        if not self.done.isSet():
+            raise ExternalCommandError(
+                "'%s' did not finish in %s seconds" % (self.command, timeout))
+        if self.error is not None:
+            raise self.error
+        return self.output
+
+
+class Worker(object):
+    """
+    A thread that runs the jobs of one queue through its own rrdtool
+    process. While idle it checks that the process is still running every
+    checkInterval seconds and starts a new one if it has died.
+    """
+    def __init__(self, command=None, queueSize=0, checkInterval=5):
+        self.pipe = RRDToolPipe(command)
+        self.queue = Queue.Queue(queueSize)
+        self.checkInterval = checkInterval
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def isAlive(self):
+        return self.thread is not None and self.thread.isAlive()
+
+    def run(self):
+        while True:
+            try:
+                job = self.queue.get(timeout=self.checkInterval)
+            except Queue.Empty:
+                self.check()
+                continue
+            if job is None:
+                break
+            if not job.start():
+                continue
+            try:
+                output = self.pipe.execute(job.command, job.args)
+            except ExternalCommandError, error:
+                job.finish(error=error)
+            except Exception, error:
+                job.finish(error=ExternalCommandError(
+                    "'%s' failed: %s" % (job.command, error)))
+            else:
+                job.finish(output)
+
+    def check(self):
+        """
+        Replace an rrdtool process that has died since its last command.
+        """
+        if self.pipe.process is None or self.pipe.isAlive():
+            return
+        self.pipe.lock.acquire()
+        try:
+            self.pipe.stop()
+            try:
+                self.pipe.start()
+            except ExternalCommandError:
+                # the next command will try again and report the error
+                pass
+        finally:
+            self.pipe.lock.release()
+
+    def stop(self):
+        if self.isAlive():
+            self.queue.put(None)
+            self.thread.join()
+        self.pipe.stop()
+
+
+class RRDToolPool(object):
+    """
+    A pool of workers, each with its own "rrdtool -" process. The commands
+    for a given file always go to the same worker, so they run in the order
+    they were sent while the commands for other files run in parallel.
+    Commands that don't start with a file name (such as xport, whose first
+    argument is an option) are handed to the workers in turn.
+
+    Each worker has a queue of at most queueSize commands (unbounded if
+    zero); when it is full, execute waits for up to putTimeout seconds
+    (forever if None) before giving up with an ExternalCommandError.
+    """
+    def __init__(self, size=None, command=None, queueSize=64,
+                 putTimeout=None, checkInterval=5):
+        if size is None:
+            size = cpuCount()
+        self.putTimeout = putTimeout
+        self.lock = threading.Lock()
+        self.workers = [Worker(command, queueSize, checkInterval)
+                        for index in xrange(max(size, 1))]
+        self.counter = itertools.count()
+        for worker in self.workers:
+            worker.start()
+
+    def getWorker(self, key):
+        """
+        Pick the worker for a file name; the choice is stable across runs.
+        The name is made absolute first, so that every name for the file
+        picks the same worker.
+        """
+        key = os.path.abspath(key)
+        index = (zlib.crc32(key) & 0xffffffff) % len(self.workers)
+        return self.workers[index]
+
+    def submit(self, command, args="", block=True):
+        """
+        Queue a command and return its Job; job.wait() returns the output.
+        Unless block is set, a QueueFullError is raised straight away if the
+        worker's queue is full.
+        """
+        if isinstance(args, unicode):
+            args = args.encode("utf-8")
+        key = (args.split() or [""])[0]
+        if key.startswith("-"):
+            worker = self.workers[self.counter.next() % len(self.workers)]
+        else:
+            worker = self.getWorker(key)
+        if not worker.isAlive():
+            self.checkHealth()
+        job = Job(command, args)
+        try:
+            worker.queue.put(job, block, self.putTimeout)
+        except Queue.Full:
+            raise QueueFullError(
+                "the queue for '%s' is full; '%s' was not run" % (
+                key, command))
+        return job
+
+    def execute(self, command, args=""):
+        return self.submit(command, args).wait()
+
+    def checkHealth(self):
+        """
+        Restart any worker thread that has stopped and any rrdtool process
+        that has died. Returns the number of workers that were restarted.
+        """
+        restarted = 0
+        self.lock.acquire()
+        try:
+            for worker in self.workers:
+                if not worker.isAlive():
+                    worker.start()
+                    restarted += 1
+                worker.check()
+        finally:
+            self.lock.release()
+        return restarted
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            for worker in self.workers:
+                worker.stop()
+        finally:
+            self.lock.release()
+
+
+def cpuCount():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
@@ -0,0 +1,392 @@
+"""
+A backend that sends its writes to the RRD caching daemon, rrdcached, over
+its text protocol instead of writing the files itself. The daemon collects
+the updates for each file in memory and writes them out in large batches,
+so far fewer disk operations are needed for the same data.
+
+The daemon is found at the address in this module's "address" attribute or,
+if that is not set, in the RRDCACHED_ADDRESS environment variable, as with
+rrdtool itself. Both "unix:/path/to/socket" (or just the path) and
+"host[:port]" addresses are understood::
+
+    >>> from pyrrd.backend import rrdcached
+    >>> from pyrrd.rrd import RRD
+    >>> rrdcached.address = "unix:/var/run/rrdcached.sock" # doctest: +SKIP
+    >>> rrd = RRD(filename, backend=rrdcached) # doctest: +SKIP
+
+The buffered values of an RRD are sent in one round trip (as a BATCH if
+they don't fit on one line), and updateMany sends the values for any number
+of files at once. Files are flushed before they are read; operations the
+protocol does not cover are then handed to the external backend.
+"""
+import os
+import socket
+import threading
+
+from pyrrd.backend import external
+from pyrrd.backend.common import FetchResults, chunkValues
+from pyrrd.backend.native.fetcher import parseQuery
+from pyrrd.exceptions import RRDCachedError
+
+
+DEFAULT_PORT = 42217
+# the longest command line rrdcached accepts
+MAX_LINE_LENGTH = 4096
+
+address = None
+timeout = 30
+_client = None
+_clientLock = threading.Lock()
+
+
+def parseAddress(address):
+    """
+    Return the socket family and address for an rrdcached address.
+
+    >>> parseAddress("unix:/tmp/rrdcached.sock")
+    (1, '/tmp/rrdcached.sock')
+    >>> parseAddress("/tmp/rrdcached.sock")
+    (1, '/tmp/rrdcached.sock')
+    >>> parseAddress("localhost")
+    (2, ('localhost', 42217))
+    >>> parseAddress("127.0.0.1:4000")
+    (2, ('127.0.0.1', 4000))
+    >>> parseAddress("[::1]:4000")
+    (10, ('::1', 4000))
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    if address.startswith("/"):
+        return socket.AF_UNIX, address
+    family = socket.AF_INET
+    if address.startswith("["):
+        host, _, port = address[1:].partition("]")
+        port = port.lstrip(":")
+        family = socket.AF_INET6
+    elif address.count(":") == 1:
+        host, port = address.split(":")
+    else:
+        host, port = address, ""
+    try:
+        port = int(port or DEFAULT_PORT)
+    except ValueError:
+        raise RRDCachedError("invalid rrdcached address '%s'" % address)
+    return family, (host, port)
+
+
+class Client(object):
+    """
+    A connection to rrdcached. The connection is opened on the first command
+    and opened again after it has failed; commands from several threads are
+    sent one after the other.
+    """
+    def __init__(self, address, timeout=None):
+        self.address = address
+        self.family, self.sockaddr = parseAddress(address)
+        self.timeout = timeout
+        self.socket = None
+        self.reader = None
+        self.lock = threading.Lock()
+
+    def isLocal(self):
+        return self.family == socket.AF_UNIX
+
+    def connect(self):
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.sockaddr)
+        except socket.error, error:
+            sock.close()
+            raise RRDCachedError("could not connect to rrdcached at %s: %s" % (
+                self.address, error))
+        self.socket = sock
+        self.reader = sock.makefile("rb")
+
+    def close(self):
+        if self.socket is None:
+            return
+        try:
+            self.reader.close()
+            self.socket.close()
+        finally:
+            self.socket = None
+            self.reader = None
+
+    def readLine(self):
+        line = self.reader.readline()
+        if not line.endswith("\n"):
+            raise socket.error("connection closed by rrdcached")
+        return line.rstrip("\n")
+
+    def readResponse(self):
+        """
+        Read a status line and the lines that come with it. Returns the
+        status, the message and the lines.
+        """
+        status, _, message = self.readLine().partition(" ")
+        try:
+            status = int(status)
+        except ValueError:
+            raise RRDCachedError("unexpected response from rrdcached: %s" % (
+                status + " " + message))
+        lines = [self.readLine() for index in xrange(max(status, 0))]
+        return status, message, lines
+
+    def send(self, lines, responses):
+        self.lock.acquire()
+        try:
+            if self.socket is None:
+                self.connect()
+            try:
+                self.socket.sendall("".join([line + "\n" for line in lines]))
+                return [self.readResponse() for index in xrange(responses)]
+            except socket.error, error:
+                self.close()
+                raise RRDCachedError("lost the connection to rrdcached: %s" % (
+                    error,))
+        finally:
+            self.lock.release()
+
+    def command(self, command, *args):
+        """
+        Send one command and return the lines of its response (an error
+        response is raised as an RRDCachedError).
+        """
+        line = " ".join((command,) + args)
+        checkLine(line)
+        [(status, message, lines)] = self.send([line], 1)
+        if status < 0:
+            raise RRDCachedError(message)
+        return lines
+
+    def batch(self, lines):
+        """
+        Send a group of commands as a BATCH, in a single write. rrdcached
+        answers all of them at once; the errors are returned as a list of
+        (command number, message) tuples, counting from 1.
+        """
+        for line in lines:
+            checkLine(line)
+        responses = self.send(["BATCH"] + lines + ["."], 2)
+        (status, message, ignored), (count, message, errors) = responses
+        if status < 0:
+            raise RRDCachedError(message)
+        results = []
+        for error in errors:
+            number, _, message = error.partition(" ")
+            results.append((int(number), message))
+        return results
+
+
+def checkLine(line):
+    if "\n" in line:
+        raise RRDCachedError("commands for rrdcached can't contain newlines")
+    if len(line) >= MAX_LINE_LENGTH:
+        raise RRDCachedError("the command is too long for rrdcached")
+
+
+def getAddress():
+    result = address or os.environ.get("RRDCACHED_ADDRESS")
+    if not result:
+        raise RRDCachedError(
+            "set rrdcached.address or RRDCACHED_ADDRESS to use rrdcached")
+    return result
+
+
+def getClient():
+    """
+    Return the connection shared by this module, making a new one if the
+    address has changed.
+    """
+    global _client
+    _clientLock.acquire()
+    try:
+        current = getAddress()
+        if _client is None or _client.address != current:
+            if _client is not None:
+                _client.close()
+            _client = Client(current, timeout)
+        return _client
+    finally:
+        _clientLock.release()
+
+
+def getPath(client, filename):
+    """
+    A daemon on this host is given absolute paths, since its working
+    directory is not ours; a remote daemon gets the name as it is. Either
+    way, it is sent in UTF-8.
+    """
+    [filename] = toStrings([filename])
+    if client.isLocal():
+        filename = os.path.abspath(filename)
+    return filename
+
+
+def toStrings(args):
+    if isinstance(args, basestring):
+        args = args.split()
+    return [unicode(arg).encode("utf-8") for arg in args]
+
+
+def updateMany(updates):
+    """
+    Send the values for several files in one round trip. updates is a list
+    of (filename, values) tuples, where values is a list of "time:value..."
+    strings. An RRDCachedError lists the updates rrdcached rejected.
+    """
+    client = getClient()
+    lines = []
+    for filename, values in updates:
+        prefix = "UPDATE %s" % getPath(client, filename)
+        lines.extend(chunkValues(
+            prefix, toStrings(values), MAX_LINE_LENGTH - 1))
+    if not lines:
+        return
+    if len(lines) == 1:
+        client.command(lines[0])
+        return
+    errors = client.batch(lines)
+    if errors:
+        raise RRDCachedError("; ".join([
+            "%s: %s" % (lines[number - 1].split()[1], message)
+            for number, message in errors]))
+
+
+def create(filename, parameters):
+    """
+    Have rrdcached create the file (this needs rrdcached 1.5 or later).
+    """
+    args = []
+    options = {"--start": "-b", "--step": "-s", "--no-overwrite": "-O"}
+    for arg in toStrings(parameters):
+        args.append(options.get(arg, arg))
+    client = getClient()
+    client.command("CREATE", getPath(client, filename), *args)
+
+
+def update(filename, data, debug=False):
+    """
+    Queue the values in rrdcached. Templates are not part of the protocol,
+    so updates that use one are written by rrdtool once the file has been
+    flushed.
+    """
+    data = toStrings(data)
+    if "--template" in data or "-t" in data:
+        flush(filename)
+        external.update(filename, data, debug)
+        return
+    updateMany([(filename, data)])
+
+
+def flush(filename):
+    """
+    Write the values rrdcached holds for a file to disk.
+    """
+    client = getClient()
+    client.command("FLUSH", getPath(client, filename))
+
+
+def flushAll():
+    getClient().command("FLUSHALL")
+
+
+def fetch(filename, query):
+    """
+    Fetch through rrdcached, which includes the values it has not written
+    yet. The results can be indexed with any of the return styles ("ds",
+    "time" or "columns").
+    """
+    cf, resolution, start, end = parseQuery(toStrings(query))
+    if resolution is not None:
+        # not part of the FETCH command
+        flush(filename)
+        return external.fetch(filename, query)
+    client = getClient()
+    args = [getPath(client, filename), cf or "AVERAGE"]
+    if start is not None or end is not None:
+        args.append(start or "end-1d")
+    if end is not None:
+        args.append(end)
+    return parseFetch(client.command("FETCH", *args))
+
+
+def iterFetch(filename, query):
+    """
+    Flush the file and stream its rows from "rrdtool fetch".
+    """
+    flush(filename)
+    return external.iterFetch(filename, query)
+
+
+def parseFetch(lines):
+    """
+    Turn the response to a FETCH into FetchResults.
+
+    >>> results = parseFetch(["FlushVersion: 1", "Start: 0", "End: 600",
+    ...     "Step: 300", "DSCount: 2", "DSName: a b",
+    ...     "       300: 1.0000000000e+00 nan",
+    ...     "       600: 2.0000000000e+00 3.0000000000e+00"])
+    >>> results.dsNames, list(results.times)
+    (('a', 'b'), [300, 600])
+    >>> results["time"][600]
+    {'a': 2.0, 'b': 3.0}
+    """
+    header = {}
+    rows = []
+    for line in lines:
+        key, _, value = line.partition(":")
+        if key.strip().isdigit():
+            rows.append((int(key), [float(datum) for datum in value.split()]))
+        else:
+            header[key] = value.strip()
+    try:
+        names = header["DSName"].split()
+        start, end, step = [int(header[key])
+                            for key in ["Start", "End", "Step"]]
+    except (KeyError, ValueError):
+        raise RRDCachedError("unexpected FETCH response from rrdcached")
+    return FetchResults.fromRows(names, rows, start, end, step)
+
+
+def dump(filename, outfile="", parameters=""):
+    flush(filename)
+    return external.dump(filename, outfile, parameters)
+
+
+def load(filename, includeData=False):
+    flush(filename)
+    return external.load(filename, includeData)
+
+
+def loadHeader(filename):
+    """
+    The header is only up to date once rrdcached has written the values it
+    holds for the file.
+    """
+    flush(filename)
+    return external.loadHeader(filename)
+
+
+def info(filename, obj, **kwargs):
+    return external.info(filename, obj, **kwargs)
+
+
+def graph(filename, parameters):
+    """
+    rrdtool itself has the daemon flush the files the graph reads.
+    """
+    external.graph(filename, ["--daemon", getAddress()] + toStrings(
+        parameters))
+
+
+def xport(parameters):
+    """
+    As with graph, rrdtool has the daemon flush the files it reads.
+    """
+    return external.xport(["--daemon", getAddress()] + toStrings(parameters))
+
+
+def prepareObject(function, obj):
+    return external.prepareObject(function, obj)
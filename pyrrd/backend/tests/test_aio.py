@@ -0,0 +1,212 @@
+import math
+import threading
+from unittest import TestCase
+
+from pyrrd.backend import aio, external, rrdcached
+from pyrrd.backend.pipe import RRDToolPool
+from pyrrd.backend.tests.test_pipe import FAKE_RRDTOOL
+from pyrrd.exceptions import (
+    ExternalCommandError, PartialUpdateError, UpdateError)
+from pyrrd.rrd import RRD
+
+
+class FakeLoopFuture(object):
+    """
+    Just enough of an asyncio future for wrapFuture.
+    """
+    def __init__(self):
+        self.state = None
+        self.value = None
+        self.callbacks = []
+
+    def cancelled(self):
+        return self.state == "cancelled"
+
+    def cancel(self):
+        self.state = "cancelled"
+        for callback in self.callbacks:
+            callback(self)
+
+    def set_result(self, value):
+        self.state, self.value = "result", value
+
+    def set_exception(self, error):
+        self.state, self.value = "exception", error
+
+    def add_done_callback(self, callback):
+        self.callbacks.append(callback)
+
+
+class FakeLoop(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def create_future(self):
+        return FakeLoopFuture()
+
+    def call_soon_threadsafe(self, callback, *args):
+        self.calls.append((callback, args))
+
+    def runCalls(self):
+        for callback, args in self.calls:
+            callback(*args)
+
+
+class AIOTestCase(TestCase):
+
+    def setUp(self):
+        self.pool = RRDToolPool(2, FAKE_RRDTOOL)
+        self.executor = aio.Executor(self.pool, limit=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_submit(self):
+        future = self.executor.submit("echo", "a.rrd")
+        self.assertEqual(future.result(5), "a.rrd\n")
+        self.assertTrue(future.done())
+
+    def test_error(self):
+        future = self.executor.submit("fail", "a.rrd")
+        self.assertTrue(isinstance(future.exception(5), ExternalCommandError))
+        self.assertRaises(ExternalCommandError, future.result)
+
+    def test_fetch(self):
+        future = aio.fetch("a.rrd", "AVERAGE", executor=self.executor)
+        results = future.result(5)
+        self.assertEqual(results["ds"]["speed"][1], (920805000, 0.04))
+        future = aio.fetch("a.rrd", "AVERAGE", returnStyle="time",
+                           executor=self.executor)
+        self.assertTrue(math.isnan(future.result(5)[920805300]["speed"]))
+
+    def test_limit(self):
+        futures = [self.executor.submit("sleep", "%s.rrd 0.05" % index)
+                   for index in xrange(5)]
+        self.assertEqual(self.executor.running, 2)
+        self.assertEqual(len(self.executor.pending), 3)
+        for future in futures:
+            future.result(5)
+        self.assertEqual(self.executor.running, 0)
+
+    def test_cancel(self):
+        first = self.executor.submit("sleep", "a.rrd 0.1")
+        self.executor.submit("sleep", "a.rrd 0.1")
+        # queued behind the first two, on the same worker
+        third = self.executor.submit("echo", "a.rrd")
+        self.assertTrue(third.cancel())
+        self.assertTrue(third.cancelled())
+        self.assertRaises(aio.CancelledError, third.result)
+        first.result(5)
+        self.assertFalse(first.cancel())
+
+    def test_cancelQueued(self):
+        self.executor.submit("sleep", "a.rrd 0.1")
+        second = self.executor.submit("echo", "a.rrd")
+        # handed to the pool but not started yet
+        self.assertTrue(second.running())
+        self.assertTrue(second.cancel())
+        self.assertRaises(aio.CancelledError, second.result, 5)
+
+    def test_wrapFuture(self):
+        loop = FakeLoop()
+        future = self.executor.submit("echo", "a.rrd")
+        loopFuture = aio.wrapFuture(future, loop)
+        future.result(5)
+        loop.runCalls()
+        self.assertEqual((loopFuture.state, loopFuture.value),
+                         ("result", "a.rrd\n"))
+
+    def test_wrapFutureCancel(self):
+        loop = FakeLoop()
+        self.executor.submit("sleep", "a.rrd 0.1")
+        future = self.executor.submit("echo", "a.rrd")
+        aio.wrapFuture(future, loop).cancel()
+        self.assertTrue(future.cancelled())
+
+    def test_rrdMethods(self):
+        rrd = RRD("a.rrd")
+        self.assertEqual(rrd.aupdate(executor=self.executor), None)
+        rrd.bufferValue("920804700", "12345")
+        future = rrd.aupdate(executor=self.executor)
+        self.assertEqual(future.result(5), "")
+        self.assertEqual(rrd.values, [])
+        future = rrd.afetch(returnStyle="ds", executor=self.executor)
+        self.assertEqual(future.result(5)["speed"][1], (920805000, 0.04))
+
+    def waitForCallbacks(self, future):
+        # the RRD's own callback on the future runs before this one
+        done = threading.Event()
+        future.add_done_callback(lambda future: done.set())
+        done.wait(5)
+
+    def test_aupdateFailure(self):
+        rrd = RRD("a.rrd")
+        rrd.bufferValue("920804700", "bad")
+        future = rrd.aupdate(executor=self.executor)
+        rrd.bufferValue("920805000", "2")
+        self.waitForCallbacks(future)
+        self.assertTrue(isinstance(future.exception(), ExternalCommandError))
+        # kept, ahead of the value buffered since
+        self.assertEqual(list(rrd.values),
+                         [("920804700", u"bad"), (920805000, u"2")])
+        self.assertEqual(rrd.lastWritten, None)
+
+    def test_aupdatePartialFailure(self):
+        rrd = RRD("a.rrd")
+        for index in xrange(10):
+            rrd.bufferValue(920804700 + 300 * index,
+                            index == 7 and "bad" or index)
+        external.MAX_PIPE_LINE, old = 100, external.MAX_PIPE_LINE
+        try:
+            future = rrd.aupdate(executor=self.executor)
+            self.waitForCallbacks(future)
+        finally:
+            external.MAX_PIPE_LINE = old
+        self.assertTrue(isinstance(future.exception(), PartialUpdateError))
+        # only the readings from the failed command on are kept
+        self.assertEqual([time for time, values in rrd.values],
+                         [920804700 + 300 * index for index in xrange(6, 10)])
+        self.assertEqual(rrd.lastWritten, 920804700 + 300 * 5)
+        # without the bad reading, the rest are written by the retry
+        rrd.values = rrd.values.select([0, 2, 3])
+        future = rrd.aupdate(executor=self.executor)
+        self.waitForCallbacks(future)
+        self.assertEqual(future.result(), "")
+        self.assertEqual(len(rrd.values), 0)
+        self.assertEqual(rrd.lastWritten, 920804700 + 300 * 9)
+
+    def test_aupdateOutOfOrder(self):
+        rrd = RRD("a.rrd", outOfOrder="drop")
+        rrd.lastWritten = 920804700
+        for seconds in [920804700, 920805000, 920805000]:
+            rrd.bufferValue(seconds, 1)
+        future = rrd.aupdate(executor=self.executor)
+        self.waitForCallbacks(future)
+        self.assertEqual(future.result(), "")
+        self.assertEqual(rrd.lastWritten, 920805000)
+        self.assertEqual(len(rrd.values), 0)
+        rrd.bufferValue(920805000, 2)
+        self.assertRaises(UpdateError, rrd.aupdate, executor=self.executor,
+                          outOfOrder="error")
+
+    def test_aupdateOtherBackend(self):
+        rrd = RRD("a.rrd", backend=rrdcached)
+        rrd.bufferValue(920804700, 1)
+        self.assertRaises(UpdateError, rrd.aupdate, executor=self.executor)
+        self.assertEqual(len(rrd.values), 1)
+
+    def test_chunkedUpdate(self):
+        values = ["%s:%s" % (920804700 + 300 * index, index)
+                  for index in xrange(10)]
+        external.MAX_PIPE_LINE, old = 100, external.MAX_PIPE_LINE
+        try:
+            future = aio.update("a.rrd", values, executor=self.executor)
+            self.assertEqual(future.result(5), "")
+            values[7] = "bad"
+            future = aio.update("a.rrd", values, executor=self.executor)
+            error = future.exception(5)
+        finally:
+            external.MAX_PIPE_LINE = old
+        self.assertTrue(isinstance(error, PartialUpdateError))
+        self.assertEqual((error.chunk, error.written), (1, 6))
@@ -0,0 +1,67 @@
+import math
+from unittest import TestCase, skipIf
+
+from pyrrd.backend import common, external
+from pyrrd.backend.common import FetchResults
+from pyrrd.util import NaN
+
+
+fetchOutput = """                           speed           temp
+
+920804700: nan 1.0000000000e+01
+920805000: 4.0000000000e-02 -nan
+920805300: 2.0000000000e-02 1.2000000000e+01
+"""
+
+
+class FetchResultsTestCase(TestCase):
+
+    def setUp(self):
+        self.results = external.parseFetch(fetchOutput)
+
+    def test_parse(self):
+        results = self.results
+        self.assertEquals(results.dsNames, ("speed", "temp"))
+        self.assertEquals(list(results.times),
+                          [920804700, 920805000, 920805300])
+        self.assertEquals((results.start, results.end, results.step),
+                          (920804400, 920805300, 300))
+        speed, temp = results.columns
+        self.assertTrue(math.isnan(speed[0]))
+        self.assertEquals(list(speed[1:]), [0.04, 0.02])
+        self.assertTrue(math.isnan(temp[1]))
+
+    def test_returnStyles(self):
+        times, columns = self.results["columns"]
+        self.assertTrue(columns["temp"] is self.results.columns[1])
+        self.assertEquals(self.results["ds"]["speed"][1], (920805000, 0.04))
+        self.assertEquals(self.results["time"][920805300],
+                          {"speed": 0.02, "temp": 12.0})
+        self.assertRaises(KeyError, self.results.__getitem__, "rows")
+
+    def test_unknownValues(self):
+        # as the external backend has always returned them
+        (time, unknown), known = self.results["ds"]["speed"][:2]
+        self.assertTrue(isinstance(unknown, NaN))
+        self.assertTrue(math.isnan(unknown))
+        self.assertEquals(known, (920805000, 0.04))
+        self.assertTrue(isinstance(
+            self.results["time"][920805000]["temp"], NaN))
+        self.assertFalse(isinstance(self.results.columns[0][0], NaN))
+
+    @skipIf(common.numpy is None, "NumPy is not installed")
+    def test_values(self):
+        values = self.results.values
+        self.assertEquals(values.shape, (3, 2))
+        self.assertEquals(values.dtype, common.numpy.float64)
+        self.assertEquals(values[2, 1], 12.0)
+        self.assertTrue(math.isnan(values[1, 1]))
+        self.assertEquals(FetchResults.fromRows(["a"], []).values.shape,
+                          (0, 1))
+
+    def test_valuesWithoutNumPy(self):
+        numpy, common.numpy = common.numpy, None
+        try:
+            self.assertTrue(self.results.values is self.results.columns)
+        finally:
+            common.numpy = numpy
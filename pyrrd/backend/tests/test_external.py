@@ -1,10 +1,17 @@
 from cStringIO import StringIO
 import os
+from subprocess import Popen, PIPE
 import sys
 import tempfile
 from unittest import TestCase
 
-from pyrrd.exceptions import ExternalCommandError
+from pyrrd.backend import external
+from pyrrd.backend.common import parseFetchOutput
+from pyrrd.backend.external import iterOutput, parseXport, prepareObject
+from pyrrd.backend.pipe import RRDToolPool
+from pyrrd.backend.tests.test_pipe import FAKE_RRDTOOL
+from pyrrd.exceptions import ExternalCommandError, PartialUpdateError
+from pyrrd.graph import CDEF, DEF, XPORT, Xport
 from pyrrd.rrd import DataSource, RRA, RRD
 
 
@@ -68,3 +75,195 @@ class ExternalBackendTestCase(TestCase):
             else:
                 self.assertEquals(obtained.strip(), expected.strip())
         sys.stdout = originalStdout
+
+
+class IterOutputTestCase(TestCase):
+
+    def start(self, script):
+        return Popen([sys.executable, "-c", script], stdout=PIPE, stderr=PIPE)
+
+    def test_lines(self):
+        process = self.start("print '   speed'; print; "
+                             "print '920804700: 1'; print '920805000: nan'")
+        rows = parseFetchOutput(iterOutput(process))
+        self.assertEquals(rows.dsNames, ("speed",))
+        self.assertEquals(repr(list(rows)),
+                          "[(920804700, (1.0,)), (920805000, (nan,))]")
+        self.assertEquals(process.returncode, 0)
+
+    def test_error(self):
+        process = self.start(
+            "import sys; print 'a'; sys.stderr.write('ERROR: no file\\n')")
+        lines = iterOutput(process)
+        self.assertEquals(lines.next(), "a\n")
+        try:
+            lines.next()
+        except ExternalCommandError, error:
+            self.assertEquals(str(error), "ERROR: no file")
+        else:
+            self.fail("no error")
+
+    def test_abandoned(self):
+        process = self.start("while 1: print 'a'")
+        lines = iterOutput(process)
+        lines.next()
+        lines.close()
+        self.assertNotEquals(process.returncode, None)
+
+
+
+class LoadTestCase(TestCase):
+
+    def setUp(self):
+        self.processes = []
+        self.spawn = external.spawn
+        external.spawn = self.start
+
+    def tearDown(self):
+        external.spawn = self.spawn
+
+    def start(self, args):
+        # an endless dump, which is not valid XML
+        process = Popen([sys.executable, "-c", "while 1: print '<rrd><'"],
+                        stdout=PIPE, stderr=PIPE)
+        self.processes.append(process)
+        return process
+
+    def test_invalidDump(self):
+        self.assertRaises(ExternalCommandError, external.load, "a.rrd")
+        self.assertNotEquals(self.processes[0].returncode, None)
+
+    def test_otherError(self):
+        def parse(stream, includeData):
+            raise ValueError("no")
+        external.parse, old = parse, external.parse
+        try:
+            self.assertRaises(ValueError, external.load, "a.rrd")
+        finally:
+            external.parse = old
+        self.assertNotEquals(self.processes[0].returncode, None)
+
+
+class XportTestCase(TestCase):
+
+    def test_prepareObject(self):
+        xport = Xport(start=920804400, end=920808000, maxrows=10)
+        xport.data.extend([
+            DEF(rrdfile="a.rrd", vname="a", dsName="speed"),
+            DEF(rrdfile="b.rrd", vname="b", dsName="speed"),
+            CDEF(vname="total", rpn="a,b,+"),
+            XPORT("a"), XPORT("total", legend="a and b")])
+        (parameters,) = prepareObject("xport", xport)
+        self.assertEquals(parameters, [
+            "--start", "920804400", "--end", "920808000", "--maxrows", "10",
+            "DEF:a=a.rrd:speed:AVERAGE", "DEF:b=b.rrd:speed:AVERAGE",
+            "CDEF:total=a,b,+", "XPORT:a", 'XPORT:total:"a and b"'])
+
+    def test_longCommand(self):
+        # too long for the pipe, so rrdtool is run on its own
+        spawned = []
+        output = ("<xport><meta><start>600</start><step>300</step>"
+                  "<end>900</end><legend><entry>a and b</entry></legend>"
+                  "</meta><data><row><v>1.0</v></row></data></xport>")
+
+        def spawn(args):
+            spawned.append(args)
+            return Popen([sys.executable, "-c",
+                          "import sys; sys.stdout.write(%r)" % output],
+                         stdout=PIPE, stderr=PIPE)
+
+        xport = Xport(start=600, end=900)
+        for index in xrange(400):
+            xport.data.append(DEF(rrdfile="/var/lib/rrd/%03d.rrd" % index,
+                                  vname="v%s" % index, dsName="speed"))
+        xport.data.append(XPORT("v0", legend="a and b"))
+        external.spawn, old = spawn, external.spawn
+        try:
+            results = xport.fetch()
+        finally:
+            external.spawn = old
+        self.assertEquals(results.dsNames, ("a and b",))
+        [args] = spawned
+        self.assertEquals(args[:4], ["rrdtool", "xport", "--start", "600"])
+        self.assertEquals(len(args), 407)
+        self.assertEquals(args[-1], "XPORT:v0:a and b")
+
+    def test_parseWithoutTimes(self):
+        results = parseXport(
+            "<xport><meta><start>600</start><step>300</step><end>1200</end>"
+            "<legend><entry>a</entry><entry /></legend></meta><data>"
+            "<row><v>1.0</v><v>2.0</v></row><row><v>3.0</v><v>NaN</v></row>"
+            "</data></xport>")
+        self.assertEquals(results.dsNames, ("a", ""))
+        self.assertEquals(list(results.times), [900, 1200])
+        self.assertEquals(list(results.columns[0]), [1.0, 3.0])
+
+    def test_parseNoRows(self):
+        results = parseXport(
+            "<xport><meta><start>600</start><step>300</step><end>600</end>"
+            "<legend><entry>a</entry></legend></meta><data /></xport>")
+        self.assertEquals(results.dsNames, ("a",))
+        self.assertEquals(len(results.times), 0)
+        self.assertEquals(len(results.columns[0]), 0)
+
+
+class ChunkedUpdateTestCase(TestCase):
+
+    def setUp(self):
+        self.pool = RRDToolPool(1, FAKE_RRDTOOL)
+        self.pool.submit = self.recordSubmit(self.pool.submit)
+        self.commands = []
+        self.old = external._pool, external.MAX_PIPE_LINE
+        external._pool, external.MAX_PIPE_LINE = self.pool, 100
+
+    def tearDown(self):
+        external._pool, external.MAX_PIPE_LINE = self.old
+        self.pool.close()
+
+    def recordSubmit(self, submit):
+        def record(command, args="", block=True):
+            self.commands.append("%s %s" % (command, args))
+            return submit(command, args, block)
+        return record
+
+    def test_chunks(self):
+        values = ["%s:%s" % (920804700 + 300 * index, index)
+                  for index in xrange(10)]
+        external.update("a.rrd", ["--template", "speed"] + values)
+        self.assertEquals(len(self.commands), 2)
+        sent = []
+        for command in self.commands:
+            self.assertTrue(len("rrdtool %s" % command) <= 98)
+            self.assertTrue(
+                command.startswith("update a.rrd --template speed "))
+            sent.extend(command.split()[4:])
+        self.assertEquals(sent, values)
+
+    def test_shortUpdate(self):
+        external.update("a.rrd", "920804700:1 920805000:2")
+        self.assertEquals(self.commands,
+                          ["update a.rrd 920804700:1 920805000:2"])
+
+    def test_partialFailure(self):
+        values = ["%s:%s" % (920804700 + 300 * index, index)
+                  for index in xrange(10)]
+        values[7] = "bad"
+        try:
+            external.update("a.rrd", values)
+        except PartialUpdateError, error:
+            self.assertEquals(error.chunk, 1)
+            self.assertEquals(error.written, 6)
+            self.assertEquals(error.time, "920806500")
+            self.assertTrue(str(error).startswith("ERROR: bad value"))
+        else:
+            self.fail("the update should have failed")
+        # the chunks after the failed one are not sent
+        self.assertEquals(len(self.commands), 2)
+
+    def test_maxCommandLength(self):
+        self.assertEquals(external.maxCommandLength(), 98)
+        external.pipeMode = False
+        try:
+            self.assertTrue(0 < external.maxCommandLength() < 131072)
+        finally:
+            external.pipeMode = True
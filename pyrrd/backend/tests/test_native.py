@@ -0,0 +1,801 @@
+from cStringIO import StringIO
+import math
+import os
+import struct
+import tempfile
+from unittest import TestCase, skipIf
+
+from pyrrd.backend import native
+from pyrrd.backend.native import creator, fetcher, format
+from pyrrd.backend.native.reader import RRDFile, numpy
+from pyrrd.backend.native.updater import Updater
+from pyrrd.exceptions import (
+    CreateError, FetchError, FormatError, RestoreError, UpdateError)
+from pyrrd.node import RRDXMLNode
+from pyrrd.rrd import DataSource, RRA, RRD
+from pyrrd.testing import binary, dump
+from pyrrd.util import XML
+
+
+NaN = float("nan")
+
+
+class NativeBaseTestCase(TestCase):
+
+    def writeFile(self, data):
+        rrdfile = tempfile.NamedTemporaryFile()
+        rrdfile.write(data)
+        rrdfile.flush()
+        return rrdfile
+
+    def resetFile(self, rrdfile, start):
+        """
+        Put a file back into the state "rrdtool create --start <start>" would
+        leave it in.
+        """
+        rrd = RRDFile(rrdfile.name)
+        rrd.lastupdate = start
+        rrd.lastupdateUsec = 0
+        for ds in rrd.ds:
+            ds.last_ds = "U"
+            ds.scratch[format.PDP_val] = 0.0
+            ds.scratch[format.PDP_unkn_sec_cnt] = start % rrd.step
+        for rra in rrd.rra:
+            rra.cur_row = rra.rows - 1
+            for cdp in rra.cdp_prep.ds:
+                cdp.scratch = [NaN] * format.MAX_PAR
+                cdp.scratch[format.CDP_unkn_pdp_cnt] = (
+                    start % (rrd.step * rra.pdp_per_row)) // rrd.step
+                cdp.scratch[format.CDP_null_count] = 0
+                cdp.scratch[format.CDP_last_null_count] = 0
+        rrdfile.seek(rrd.liveHeadOffset)
+        rrdfile.write(rrd.packState())
+        rrdfile.write(struct.pack("<d", NaN) * (
+            sum([rra.rows for rra in rrd.rra]) * len(rrd.ds)))
+        rrdfile.flush()
+        return rrdfile
+
+    def makeFile(self, layout, version=format.VERSION3, start=920804400):
+        """
+        Write a new file with one COUNTER and one 24-row AVERAGE archive,
+        as a host with the given layout would.
+        """
+        dss = [creator.DSDefinition("speed", "COUNTER", 600, "U", "U")]
+        rras = [creator.RRADefinition("AVERAGE", 0.5, 1, 24)]
+        for definition in dss + rras:
+            definition.validate()
+        definitions = creator.packDefinitions(layout, 300, dss, rras, version)
+        headerSize = layout.headerSize(version, len(dss), len(rras))
+        rrd = RRDFile(None, StringIO(creator.pad(definitions, headerSize)))
+        creator.initialize(rrd, start)
+        return self.writeFile(
+            definitions + rrd.packState() + layout.packDouble(NaN) * 24)
+
+    def assertRows(self, obtained, expected):
+        self.assertEquals(len(obtained), len(expected))
+        for (time, value), (expectedTime, expectedValue) in zip(
+            obtained, expected):
+            self.assertEquals(time, expectedTime)
+            if math.isnan(expectedValue):
+                self.assertTrue(math.isnan(value))
+            else:
+                self.assertAlmostEquals(value, expectedValue)
+
+
+class RRDFileTestCase(NativeBaseTestCase):
+
+    def setUp(self):
+        self.rrdfile = self.writeFile(binary.simpleRRD01)
+        self.rrd = RRDFile(self.rrdfile.name)
+
+    def test_header(self):
+        self.assertEquals(self.rrd.version, "0003")
+        self.assertEquals(self.rrd.step, 300)
+        self.assertEquals(self.rrd.lastupdate, 920806100)
+        self.assertEquals(self.rrd.headerSize, 544)
+        self.assertEquals(self.rrd.layout.longSize, 4)
+        self.assertEquals(self.rrd.layout.doubleAlign, 4)
+
+    def test_ds(self):
+        self.assertEquals(len(self.rrd.ds), 1)
+        ds = self.rrd.ds[0]
+        self.assertEquals(ds.name, "speed")
+        self.assertEquals(ds.type, "COUNTER")
+        self.assertEquals(ds.minimal_heartbeat, 600)
+        self.assertTrue(math.isnan(ds.min))
+        self.assertTrue(math.isnan(ds.max))
+        self.assertEquals(ds.last_ds, "12364")
+        self.assertAlmostEquals(ds.value, 0.4)
+        self.assertEquals(ds.unknown_sec, 0)
+
+    def test_rra(self):
+        self.assertEquals(len(self.rrd.rra), 1)
+        rra = self.rrd.rra[0]
+        self.assertEquals(rra.cf, "AVERAGE")
+        self.assertEquals(rra.rows, 24)
+        self.assertEquals(rra.pdp_per_row, 1)
+        self.assertEquals(rra.xff, 0.5)
+        self.assertEquals(rra.cur_row, 4)
+        self.assertEquals(rra.offset, 544)
+
+    def test_cdpPrep(self):
+        ds = self.rrd.rra[0].cdp_prep.ds
+        self.assertEquals(len(ds), 1)
+        attributes = ds[0].attributes
+        self.assertAlmostEquals(attributes["primary_value"], 0.002)
+        self.assertTrue(math.isnan(attributes["value"]))
+        self.assertEquals(attributes["unknown_datapoints"], 0)
+
+    def test_rows(self):
+        rows = list(self.rrd.rows(0))
+        self.assertEquals(len(rows), 24)
+        self.assertEquals(rows[0][0], 920805900 - 23 * 300)
+        self.assertEquals(rows[-1][0], 920805900)
+        self.assertAlmostEquals(rows[-1][1][0], 0.002)
+        self.assertTrue(math.isnan(rows[-2][1][0]))
+
+    def test_multipleDataSources(self):
+        rrdfile = self.writeFile(binary.simpleRRD02)
+        rrd = RRDFile(rrdfile.name)
+        self.assertEquals([ds.name for ds in rrd.ds], ["speed", "velocity"])
+        self.assertEquals([ds.minimal_heartbeat for ds in rrd.ds], [600, 300])
+        self.assertEquals(len(rrd.rra[0].cdp_prep.ds), 2)
+        self.assertEquals(rrd.headerSize, 856)
+        for time, values in rrd.rows(0):
+            self.assertEquals(len(values), 2)
+
+    def test_badCookie(self):
+        rrdfile = self.writeFile("XRD\x00" + binary.simpleRRD01[4:])
+        self.assertRaises(FormatError, RRDFile, rrdfile.name)
+
+    def test_truncated(self):
+        rrdfile = self.writeFile(binary.simpleRRD01[:300])
+        self.assertRaises(FormatError, RRDFile, rrdfile.name)
+
+
+class DatabaseViewTestCase(NativeBaseTestCase):
+
+    def setUp(self):
+        self.rrdfile = self.writeFile(binary.simpleRRD01)
+        self.rrd = RRDFile(self.rrdfile.name)
+        self.database = self.rrd.rra[0].database
+
+    def tearDown(self):
+        self.rrd.close()
+
+    def test_lazyMapping(self):
+        rrd = RRDFile(self.rrdfile.name)
+        self.assertEquals(rrd._mapping, None)
+        rrd.rra[0].database[0]
+        self.assertNotEquals(rrd._mapping, None)
+        rrd.close()
+
+    def test_indexing(self):
+        self.assertEquals(len(self.database), 24)
+        self.assertAlmostEquals(self.database[-1][0], 0.002)
+        self.assertAlmostEquals(self.database[23][0], 0.002)
+        self.assertTrue(math.isnan(self.database[0][0]))
+        self.assertRaises(IndexError, self.database.__getitem__, 24)
+        self.assertEquals(self.database.getTime(-1), 920805900)
+        self.assertEquals(self.database.getTime(0), 920805900 - 23 * 300)
+
+    def test_segments(self):
+        older, newer = self.database.segments()
+        self.assertEquals(len(older), 19 * 8)
+        self.assertEquals(len(newer), 5 * 8)
+        values = struct.unpack("<24d", str(older) + str(newer))
+        self.assertAlmostEquals(values[-1], 0.002)
+        self.assertEquals(len([x for x in values if not math.isnan(x)]), 1)
+
+    @skipIf(numpy is None, "NumPy is not installed")
+    def test_arrays(self):
+        older, newer = self.database.arrays()
+        self.assertEquals(older.shape, (19, 1))
+        self.assertEquals(newer.shape, (5, 1))
+        self.assertFalse(older.flags.writeable)
+        self.assertAlmostEquals(newer[-1, 0], 0.002)
+
+
+# The readings and results of the rrdtool tutorial: a COUNTER with a 600
+# second heartbeat, starting at 920804400, fetched with a 300 second
+# resolution.
+tutorialUpdates = [
+    "920804700:12345", "920805000:12357", "920805300:12363",
+    "920805600:12363", "920805900:12363", "920806200:12373",
+    "920806500:12383", "920806800:12393", "920807100:12399",
+    "920807400:12405", "920807700:12411", "920808000:12415",
+    "920808300:12420", "920808600:12422", "920808900:12423"]
+tutorialResults = [
+    (920804700, NaN), (920805000, 0.04), (920805300, 0.02),
+    (920805600, 0.0), (920805900, 0.0), (920806200, 0.0333333333),
+    (920806500, 0.0333333333), (920806800, 0.0333333333),
+    (920807100, 0.02), (920807400, 0.02), (920807700, 0.02),
+    (920808000, 0.0133333333), (920808300, 0.0166666667),
+    (920808600, 0.0066666667), (920808900, 0.0033333333)]
+
+
+class UpdaterTestCase(NativeBaseTestCase):
+
+    def setUp(self):
+        self.rrdfile = self.resetFile(
+            self.writeFile(binary.simpleRRD01), 920804400)
+
+    def test_tutorial(self):
+        native.update(self.rrdfile.name, tutorialUpdates[:4])
+        native.update(self.rrdfile.name, " ".join(tutorialUpdates[4:]))
+        rrd = RRDFile(self.rrdfile.name)
+        self.assertEquals(rrd.lastupdate, 920808900)
+        self.assertEquals(rrd.ds[0].last_ds, "12423")
+        self.assertEquals(rrd.rra[0].cur_row, 14)
+        rows = [(time, values[0]) for time, values in rrd.rows(0)]
+        self.assertRows(rows[-15:], tutorialResults)
+        for time, value in rows[:-15]:
+            self.assertTrue(math.isnan(value))
+
+    def test_consolidation(self):
+        expected = {
+            "AVERAGE": [0.0186666667, 0.0233333333],
+            "MIN": [0.0, 0.0133333333],
+            "MAX": [0.04, 0.0333333333],
+            "LAST": [0.0333333333, 0.0133333333],
+            }
+        for cf, values in expected.items():
+            rrd = RRDFile(self.rrdfile.name)
+            rra = rrd.rra[0]
+            rra.cf = cf
+            rra.pdp_per_row = 6
+            updater = Updater(rrd)
+            updater.run(tutorialUpdates)
+            rows = updater.changedRows[0]
+            self.assertEquals(sorted(rows.keys()), [0, 1])
+            self.assertAlmostEquals(rows[0][0], values[0])
+            self.assertAlmostEquals(rows[1][0], values[1])
+
+    def test_xff(self):
+        rrd = RRDFile(self.rrdfile.name)
+        rra = rrd.rra[0]
+        rra.pdp_per_row = 6
+        rra.par[format.RRA_cdp_xff_val] = 0.1
+        updater = Updater(rrd)
+        updater.run(tutorialUpdates)
+        self.assertTrue(math.isnan(updater.changedRows[0][0][0]))
+        self.assertAlmostEquals(updater.changedRows[0][1][0], 0.0233333333)
+
+    def test_unknownCarryOver(self):
+        expected = {"AVERAGE": 0.0, "MIN": float("inf"),
+                    "MAX": -float("inf")}
+        for cf in ["AVERAGE", "MIN", "MAX", "LAST"]:
+            rrd = RRDFile(self.rrdfile.name)
+            rra = rrd.rra[0]
+            rra.cf = cf
+            rra.pdp_per_row = 4
+            scratch = rra.cdp_prep.ds[0].scratch
+            Updater(rrd).consolidate(rra, scratch, float("nan"), 5, 2, 1)
+            self.assertEquals(scratch[format.CDP_unkn_pdp_cnt], 3)
+            if cf in expected:
+                self.assertEquals(scratch[format.CDP_val], expected[cf])
+            else:
+                self.assertTrue(math.isnan(scratch[format.CDP_val]))
+
+    def test_heartbeat(self):
+        native.update(self.rrdfile.name, ["920804700:1", "920805000:2",
+                                          "920806000:3", "920806200:4"])
+        rrd = RRDFile(self.rrdfile.name)
+        values = [values[0] for time, values in rrd.rows(0)][-6:]
+        self.assertAlmostEquals(values[1], 1 / 300.0)
+        for value in values[2:5]:
+            self.assertTrue(math.isnan(value))
+
+    def test_gaugeLimits(self):
+        rrd = RRDFile(self.rrdfile.name)
+        ds = rrd.ds[0]
+        ds.type = "GAUGE"
+        ds.par[format.DS_max_val] = 10.0
+        updater = Updater(rrd)
+        updater.run(["920804700:5", "920805000:50", "920805300:7"])
+        rows = updater.changedRows[0]
+        self.assertAlmostEquals(rows[0][0], 5.0)
+        self.assertTrue(math.isnan(rows[1][0]))
+        self.assertAlmostEquals(rows[2][0], 7.0)
+
+    def test_counterWrap(self):
+        native.update(self.rrdfile.name, [
+            "920804700:4294967000", "920805000:4294967296", "920805300:4"])
+        rrd = RRDFile(self.rrdfile.name)
+        values = [values[0] for time, values in rrd.rows(0)]
+        self.assertAlmostEquals(values[-2], 296 / 300.0)
+        self.assertAlmostEquals(values[-1], 4 / 300.0)
+
+    def test_template(self):
+        rrdfile = self.resetFile(self.writeFile(binary.simpleRRD02), 920804400)
+        native.update(rrdfile.name, [
+            "--template", "velocity:speed", "920804700:10:100",
+            "920805000:40:400"])
+        rrd = RRDFile(rrdfile.name)
+        self.assertEquals(rrd.ds[0].last_ds, "400")
+        self.assertEquals(rrd.ds[1].last_ds, "40")
+        self.assertEquals(list(rrd.rows(0))[-1][1], (1.0, 0.1))
+
+    def test_illegalTime(self):
+        self.assertRaises(UpdateError, native.update, self.rrdfile.name,
+                          ["920804700:12345", "920804700:12357"])
+        # the first reading was kept, as rrdtool does
+        rrd = RRDFile(self.rrdfile.name)
+        self.assertEquals(rrd.lastupdate, 920804700)
+        self.assertEquals(rrd.ds[0].last_ds, "12345")
+
+    def test_wrongReadingCount(self):
+        self.assertRaises(UpdateError, native.update, self.rrdfile.name,
+                          ["920804700:1:2"])
+
+    def test_bufferedUpdate(self):
+        rrd = RRD(self.rrdfile.name, backend=native)
+        for reading in tutorialUpdates:
+            rrd.bufferValue(*reading.split(":"))
+        rrd.update()
+        self.assertEquals(rrd.values, [])
+        self.assertEquals(RRDFile(self.rrdfile.name).lastupdate, 920808900)
+
+
+class FetchTestCase(NativeBaseTestCase):
+
+    def setUp(self):
+        self.rrdfile = self.resetFile(
+            self.writeFile(binary.simpleRRD01), 920804400)
+        native.update(self.rrdfile.name, tutorialUpdates)
+
+    def fetch(self, *query):
+        return native.fetch(self.rrdfile.name, list(query))
+
+    def test_columns(self):
+        times, columns = self.fetch(
+            "AVERAGE", "--start", "920804400", "--end", "920809200")["columns"]
+        self.assertEquals(list(times), range(920804700, 920809800, 300))
+        self.assertEquals(columns.keys(), ["speed"])
+        values = columns["speed"]
+        self.assertEquals(len(values), len(times))
+        self.assertRows(zip(times, values), tutorialResults + [
+            (920809200, NaN), (920809500, NaN)])
+        # rows after the last update are unknown
+        self.assertTrue(math.isnan(values[-1]))
+
+    def test_returnStyles(self):
+        results = self.fetch(
+            "AVERAGE", "--start", "920806500", "--end", "920807100")
+        self.assertEquals(results.step, 300)
+        self.assertEquals(results["ds"]["speed"][0][0], 920806800)
+        self.assertAlmostEquals(results["ds"]["speed"][0][1], 0.0333333333)
+        self.assertEquals(sorted(results["time"].keys()),
+                          [920806800, 920807100, 920807400])
+        self.assertAlmostEquals(results["time"][920807100]["speed"], 0.02)
+
+    def test_alignment(self):
+        results = self.fetch(
+            "AVERAGE", "--start", "920806550", "--end", "start+10min")
+        self.assertEquals(results.start, 920806500)
+        self.assertEquals(results.end, 920807400)
+        self.assertEquals(list(results.times),
+                          [920806800, 920807100, 920807400])
+
+    def test_outsideArchive(self):
+        times, columns = self.fetch(
+            "AVERAGE", "--start", "920790000", "--end", "920790600")["columns"]
+        self.assertEquals(len(times), 3)
+        self.assertTrue(all([math.isnan(value) for value in columns["speed"]]))
+
+    def assertSameRows(self, rows, results):
+        expected = zip(results.times, *results.columns)
+        self.assertEquals(len(rows), len(expected))
+        for (time, values), row in zip(rows, expected):
+            self.assertEquals(time, row[0])
+            self.assertEquals(repr(values), repr(row[1:]))
+
+    def test_iterRows(self):
+        rrd = RRDFile(self.rrdfile.name)
+        for start, end in [("920790000", "920810000"),
+                           ("920806500", "920807100"),
+                           ("920790000", "920790600")]:
+            results = fetcher.fetch(rrd, "AVERAGE", None, start, end)
+            for chunkSize in [1, 4, 4096]:
+                rows = list(fetcher.iterRows(
+                    rrd, "AVERAGE", None, start, end, chunkSize))
+                self.assertSameRows(rows, results)
+
+    def test_iterFetch(self):
+        query = ["AVERAGE", "--start", "920804400", "--end", "920809200"]
+        rows = native.iterFetch(self.rrdfile.name, query)
+        self.assertEquals(rows.dsNames, ("speed",))
+        self.assertSameRows(list(rows), self.fetch(*query))
+        rrd = RRD(self.rrdfile.name, mode="r", backend=native)
+        rows = rrd.iterfetch(start=920804400, end=920809200)
+        self.assertRows([(time, values[0]) for time, values in rows],
+                        tutorialResults + [(920809200, NaN), (920809500, NaN)])
+
+    def test_errors(self):
+        self.assertRaises(FetchError, self.fetch, "MAX")
+        self.assertRaises(FetchError, self.fetch, "AVERAGE",
+                          "--start", "920809200", "--end", "920804400")
+
+    def test_selectRRA(self):
+        rrd = RRDFile(self.rrdfile.name)
+        rrd.rra.append(RRDFile(self.rrdfile.name).rra[0])
+        rrd.rra[1].pdp_per_row = 12
+        rrd.rra[1].rows = 100
+        # only the coarser archive reaches back far enough
+        self.assertEquals(fetcher.selectRRA(
+            rrd, "AVERAGE", 300, 920800000, 920808000), 1)
+        self.assertEquals(fetcher.selectRRA(
+            rrd, "AVERAGE", 300, 920807000, 920808000), 0)
+        self.assertEquals(fetcher.selectRRA(
+            rrd, "AVERAGE", 3600, 920807000, 920808000), 1)
+
+    def test_selectRRAPastLastUpdate(self):
+        # an end after the last update, such as "now", doesn't stop the
+        # resolution from choosing the archive
+        rrd = RRDFile(self.rrdfile.name)
+        rrd.rra.append(RRDFile(self.rrdfile.name).rra[0])
+        rrd.rra[0].rows = 600
+        rrd.rra[1].pdp_per_row = 6
+        rrd.rra[1].rows = 700
+        end = rrd.lastupdate + 3600
+        self.assertEquals(fetcher.selectRRA(
+            rrd, "AVERAGE", 1800, end - 86400, end), 1)
+        self.assertEquals(fetcher.selectRRA(
+            rrd, "AVERAGE", 300, end - 86400, end), 0)
+
+
+class LayoutTestCase(NativeBaseTestCase):
+
+    layouts = [
+        # i386, ARM (EABI), amd64
+        ("<", 4, 4), ("<", 4, 8), ("<", 8, 8),
+        # the same on big-endian hosts (PowerPC, SPARC, ...)
+        (">", 4, 4), (">", 4, 8), (">", 8, 8),
+        ]
+
+    def test_detection(self):
+        for byteOrder, longSize, doubleAlign in self.layouts:
+            for version in format.VERSIONS:
+                layout = format.Layout(byteOrder, longSize, doubleAlign)
+                rrdfile = self.makeFile(layout, version)
+                rrd = RRDFile(rrdfile.name)
+                self.assertEquals(
+                    (rrd.layout.byteOrder, rrd.layout.longSize,
+                     rrd.layout.doubleAlign),
+                    (byteOrder, longSize, doubleAlign))
+                self.assertEquals(rrd.version, version)
+                self.assertEquals(rrd.headerSize,
+                                  layout.headerSize(version, 1, 1))
+                self.assertEquals(rrd.step, 300)
+                self.assertEquals(rrd.lastupdate, 920804400)
+                self.assertEquals(rrd.ds[0].name, "speed")
+                self.assertEquals(rrd.ds[0].minimal_heartbeat, 600)
+                self.assertEquals(rrd.rra[0].rows, 24)
+                self.assertEquals(rrd.rra[0].xff, 0.5)
+                self.assertEquals(rrd.rra[0].cur_row, 23)
+
+    def test_updateAndFetch(self):
+        for byteOrder, longSize, doubleAlign in self.layouts:
+            for version in [format.VERSION1, format.VERSION3]:
+                layout = format.Layout(byteOrder, longSize, doubleAlign)
+                rrdfile = self.makeFile(layout, version)
+                native.update(rrdfile.name, tutorialUpdates)
+                self.assertEquals(RRDFile(rrdfile.name).lastupdate, 920808900)
+                results = native.fetch(rrdfile.name, [
+                    "AVERAGE", "--start", "920804400", "--end", "920808900"])
+                self.assertRows(
+                    results["ds"]["speed"][:15], tutorialResults)
+
+    def test_unsupportedVersion(self):
+        rrdfile = self.makeFile(format.nativeLayout())
+        rrdfile.seek(4)
+        rrdfile.write("0005")
+        rrdfile.flush()
+        self.assertRaises(FormatError, RRDFile, rrdfile.name)
+
+
+class CreateTestCase(NativeBaseTestCase):
+
+    def setUp(self):
+        self.rrdfile = tempfile.NamedTemporaryFile()
+
+    def createRRD(self, start=920804400, **kwargs):
+        dss = [DataSource(dsName="speed", dsType="COUNTER", heartbeat=600),
+               DataSource(dsName="temp", dsType="GAUGE", heartbeat=600,
+                          minval=-40, maxval=60)]
+        rras = [RRA(cf="AVERAGE", xff=0.5, steps=1, rows=24),
+                RRA(cf="MAX", xff=0.5, steps=6, rows=10)]
+        rrd = RRD(self.rrdfile.name, ds=dss, rra=rras, start=start,
+                  backend=native, **kwargs)
+        rrd.create()
+        return RRDFile(self.rrdfile.name)
+
+    def test_header(self):
+        rrd = self.createRRD()
+        self.assertEquals(rrd.version, format.VERSION3)
+        self.assertEquals(rrd.step, 300)
+        self.assertEquals(rrd.lastupdate, 920804400)
+        self.assertEquals([(ds.name, ds.type) for ds in rrd.ds],
+                          [("speed", "COUNTER"), ("temp", "GAUGE")])
+        self.assertEquals(rrd.ds[1].minimal_heartbeat, 600)
+        self.assertEquals((rrd.ds[1].min, rrd.ds[1].max), (-40.0, 60.0))
+        self.assertTrue(math.isnan(rrd.ds[0].max))
+        self.assertEquals(rrd.ds[0].last_ds, "U")
+        self.assertEquals([(rra.cf, rra.pdp_per_row, rra.rows, rra.xff)
+                           for rra in rrd.rra],
+                          [("AVERAGE", 1, 24, 0.5), ("MAX", 6, 10, 0.5)])
+        self.assertEquals([rra.cur_row for rra in rrd.rra], [23, 9])
+        self.assertEquals(
+            rrd.rra[1].cdp_prep.ds[0].scratch[format.CDP_unkn_pdp_cnt], 0)
+
+    def test_rows(self):
+        rrd = self.createRRD()
+        size = rrd.headerSize + (24 + 10) * 2 * format.VALUE_SIZE
+        self.assertEquals(len(open(self.rrdfile.name, "rb").read()), size)
+        for rra in rrd.rra:
+            for values in rra.database:
+                self.assertTrue(all([math.isnan(value) for value in values]))
+
+    def test_unalignedStart(self):
+        # 100 seconds into a step and two steps into a six-step row
+        rrd = self.createRRD(start=920805100)
+        self.assertEquals(rrd.ds[0].unknown_sec, 100)
+        self.assertEquals(
+            rrd.rra[1].cdp_prep.ds[0].scratch[format.CDP_unkn_pdp_cnt], 2)
+
+    def test_step(self):
+        rrd = self.createRRD(step=60)
+        self.assertEquals(rrd.step, 60)
+
+    def test_tutorial(self):
+        native.create(self.rrdfile.name, "--start 920804400 "
+                      "DS:speed:COUNTER:600:U:U RRA:AVERAGE:0.5:1:24")
+        native.update(self.rrdfile.name, tutorialUpdates)
+        results = native.fetch(self.rrdfile.name, [
+            "AVERAGE", "--start", "920804400", "--end", "920808900"])
+        self.assertRows(results["ds"]["speed"][:15], tutorialResults)
+
+    def test_preallocate(self):
+        native.create(self.rrdfile.name, [
+            "--start", "920804400", "DS:speed:COUNTER:600:U:U",
+            "RRA:AVERAGE:0.5:1:24"], preallocate=True)
+        rrd = RRDFile(self.rrdfile.name)
+        self.assertEquals(len(open(self.rrdfile.name, "rb").read()),
+                          rrd.headerSize + 24 * format.VALUE_SIZE)
+
+    def test_preallocateFromRRD(self):
+        dss = [DataSource(dsName="speed", dsType="GAUGE", heartbeat=600)]
+        rras = [RRA(cf="AVERAGE", xff=0.5, steps=1, rows=24)]
+        rrd = RRD(self.rrdfile.name, ds=dss, rra=rras, backend=native)
+        rrd.create(preallocate=True)
+        self.assertEquals(len(open(self.rrdfile.name, "rb").read()),
+                          RRDFile(self.rrdfile.name).headerSize +
+                          24 * format.VALUE_SIZE)
+        rrd = RRD(self.rrdfile.name, ds=dss, rra=rras)
+        self.assertRaises(CreateError, rrd.create, preallocate=True)
+
+    def test_noOverwrite(self):
+        parameters = ["--start", "920804400", "DS:speed:COUNTER:600:U:U",
+                      "RRA:AVERAGE:0.5:1:24"]
+        native.create(self.rrdfile.name, parameters)
+        before = open(self.rrdfile.name, "rb").read()
+        for option in ["--no-overwrite", "-O"]:
+            self.assertRaises(CreateError, native.create, self.rrdfile.name,
+                              [option, "--step", "60"] + parameters)
+        self.assertEquals(open(self.rrdfile.name, "rb").read(), before)
+        os.unlink(self.rrdfile.name)
+        native.create(self.rrdfile.name, ["-O"] + parameters)
+        self.assertEquals(RRDFile(self.rrdfile.name).step, 300)
+
+    def test_unsupported(self):
+        self.assertFalse(creator.create(self.rrdfile.name, [
+            "DS:speed:COMPUTE:temp,2,*", "RRA:AVERAGE:0.5:1:24"]))
+        self.assertFalse(creator.create(self.rrdfile.name, [
+            "DS:speed:GAUGE:600:U:U", "RRA:HWPREDICT:1440:0.1:0.0035:288"]))
+
+    def test_errors(self):
+        for parameters in [
+            "RRA:AVERAGE:0.5:1:24",
+            "DS:speed:GAUGE:600:U:U",
+            "DS:speed:GAUGE:0:U:U RRA:AVERAGE:0.5:1:24",
+            "DS:speed:GAUGE:600:10:5 RRA:AVERAGE:0.5:1:24",
+            "DS:speed:GAUGE:600:U:U DS:speed:GAUGE:600:U:U "
+                "RRA:AVERAGE:0.5:1:24",
+            "DS:speed:GAUGE:600:U:U RRA:AVERAGE:1.5:1:24",
+            "DS:speed:GAUGE:600:U:U RRA:AVERAGE:0.5:1",
+            "--step 0 DS:speed:GAUGE:600:U:U RRA:AVERAGE:0.5:1:24",
+            ]:
+            self.assertRaises(
+                CreateError, native.create, self.rrdfile.name, parameters)
+
+
+class InfoTestCase(NativeBaseTestCase):
+
+    def setUp(self):
+        self.rrdfile = self.writeFile(binary.simpleRRD01)
+
+    def test_rawData(self):
+        info = native.info(self.rrdfile.name, rawData=True)
+        self.assertEquals(info["filename"], self.rrdfile.name)
+        self.assertEquals(info["rrd_version"], "0003")
+        self.assertEquals(info["step"], 300)
+        self.assertEquals(info["last_update"], 920806100)
+        self.assertEquals(info["header_size"], 544)
+        self.assertEquals(info["ds[speed].type"], "COUNTER")
+        self.assertEquals(info["ds[speed].minimal_heartbeat"], 600)
+        self.assertEquals(info["ds[speed].min"], None)
+        self.assertEquals(info["ds[speed].last_ds"], "12364")
+        self.assertAlmostEquals(info["ds[speed].value"], 0.4)
+        self.assertEquals(info["rra[0].cf"], "AVERAGE")
+        self.assertEquals(info["rra[0].cur_row"], 4)
+        self.assertEquals(info["rra[0].xff"], 0.5)
+        self.assertEquals(info["rra[0].cdp_prep[0].value"], None)
+        self.assertEquals(info["rra[0].cdp_prep[0].unknown_datapoints"], 0)
+        self.assertEquals(len(info), 20)
+
+    def test_stream(self):
+        stream = StringIO()
+        rrd = RRD(self.rrdfile.name, mode="r", backend=native)
+        self.assertEquals(rrd.info(stream=stream), None)
+        lines = stream.getvalue().splitlines()
+        self.assertEquals(lines[0], 'filename = "%s"' % self.rrdfile.name)
+        self.assertEquals(lines[1], 'rrd_version = "0003"')
+        self.assertTrue("ds[speed].min = NaN" in lines)
+        self.assertTrue("ds[speed].value = 4.0000000000e-01" in lines)
+        self.assertEquals(lines[-1], "rra[0].cdp_prep[0].unknown_datapoints = 0")
+
+    def test_holtWinters(self):
+        rrd = RRDFile(self.rrdfile.name)
+        rra = rrd.rra[0]
+        rra.cf = "HWPREDICT"
+        rra.par[format.RRA_hw_alpha] = 0.1
+        rra.par[format.RRA_hw_beta] = 0.0035
+        rra.cdp_prep.ds[0].scratch[format.CDP_hw_intercept] = 2.5
+        info = dict(rrd.getInfo())
+        self.assertEquals(info["rra[0].alpha"], 0.1)
+        self.assertEquals(info["rra[0].beta"], 0.0035)
+        self.assertEquals(info["rra[0].cdp_prep[0].intercept"], 2.5)
+        self.assertFalse("rra[0].xff" in info)
+        self.assertFalse("rra[0].cdp_prep[0].value" in info)
+
+
+class DumpTestCase(NativeBaseTestCase):
+
+    def setUp(self):
+        self.rrdfile = self.resetFile(
+            self.writeFile(binary.simpleRRD01), 920804400)
+        native.update(self.rrdfile.name, tutorialUpdates)
+
+    def test_dump(self):
+        tree = XML(native.dump(self.rrdfile.name))
+        self.assertEquals([node.tag for node in tree],
+                          ["version", "step", "lastupdate", "ds", "rra"])
+        self.assertEquals(tree.findtext("version").strip(), "0003")
+        self.assertEquals(tree.findtext("lastupdate").strip(), "920808900")
+        self.assertEquals(tree.findtext("ds/name").strip(), "speed")
+        self.assertEquals(tree.findtext("ds/last_ds").strip(), "12423")
+        self.assertEquals(tree.findtext("rra/params/xff").strip(),
+                          "5.0000000000e-01")
+        self.assertEquals(
+            [node.tag for node in tree.find("rra/cdp_prep/ds")],
+            ["primary_value", "secondary_value", "value",
+             "unknown_datapoints"])
+        rows = tree.findall("rra/database/row")
+        self.assertEquals(len(rows), 24)
+        values = [float(row.findtext("v")) for row in rows]
+        times = range(920808900 - 23 * 300, 920809200, 300)
+        self.assertRows(zip(times, values)[-15:], tutorialResults)
+
+    def test_rowComments(self):
+        lines = native.dump(self.rrdfile.name).splitlines()
+        rows = [line for line in lines if "<row>" in line]
+        self.assertTrue(rows[-1].strip().startswith("<!-- "))
+        self.assertTrue(" / 920808900 --> <row><v> " in rows[-1])
+
+    def test_xmlNode(self):
+        node = RRDXMLNode(XML(native.dump(self.rrdfile.name)))
+        self.assertEquals(node.attributes["lastupdate"], 920808900)
+        self.assertEquals(node.ds[0].attributes["last_ds"], 12423)
+        self.assertEquals(node.rra[0].attributes["xff"], 0.5)
+
+    def test_outfile(self):
+        xmlfile = tempfile.NamedTemporaryFile()
+        self.assertEquals(native.dump(self.rrdfile.name, xmlfile.name), None)
+        self.assertEquals(open(xmlfile.name).read().strip(),
+                          native.dump(self.rrdfile.name))
+        stream = StringIO()
+        native.dump(self.rrdfile.name, stream)
+        self.assertEquals(stream.getvalue().strip(),
+                          native.dump(self.rrdfile.name))
+
+    def test_iterDump(self):
+        chunks = native.iterDump(self.rrdfile.name)
+        self.assertEquals(chunks.next(),
+                          '<?xml version="1.0" encoding="utf-8"?>\n')
+        rows = [chunk for chunk in chunks if "<row>" in chunk]
+        self.assertEquals(len(rows), 24)
+
+
+class RestoreTestCase(NativeBaseTestCase):
+
+    def setUp(self):
+        self.rrdfile = self.resetFile(
+            self.writeFile(binary.simpleRRD01), 920804400)
+        native.update(self.rrdfile.name, tutorialUpdates)
+        self.restored = tempfile.NamedTemporaryFile()
+
+    def test_roundTrip(self):
+        xml = native.dump(self.rrdfile.name)
+        native.restore(StringIO(xml), self.restored.name)
+        self.assertEquals(native.dump(self.restored.name), xml)
+        rrd = RRDFile(self.restored.name)
+        self.assertEquals(rrd.layout.longSize, format.nativeLayout().longSize)
+        self.assertEquals(rrd.rra[0].cur_row, 23)
+        self.assertEquals(rrd.ds[0].last_ds, "12423")
+
+    def test_layout(self):
+        xmlfile = tempfile.NamedTemporaryFile()
+        native.dump(self.rrdfile.name, xmlfile.name)
+        layout = format.Layout(">", 8, 8)
+        native.restore(xmlfile.name, self.restored.name, layout)
+        rrd = RRDFile(self.restored.name)
+        self.assertEquals(rrd.layout.byteOrder, ">")
+        self.assertEquals(rrd.layout.longSize, 8)
+        results = native.fetch(self.restored.name, [
+            "AVERAGE", "--start", "920804400", "--end", "920808900"])
+        self.assertRows(results["ds"]["speed"][:15], tutorialResults)
+        # and the restored file can be updated further
+        native.update(self.restored.name, ["920809200:12425"])
+        self.assertEquals(RRDFile(self.restored.name).lastupdate, 920809200)
+
+    def test_dumpFixture(self):
+        native.restore(StringIO(dump.simpleDump01), self.restored.name)
+        rrd = RRDFile(self.restored.name)
+        self.assertEquals(rrd.lastupdate, 920804400)
+        self.assertEquals([(rra.pdp_per_row, rra.rows) for rra in rrd.rra],
+                          [(1, 24), (6, 10)])
+        self.assertEquals(rrd.ds[0].last_ds, "U")
+
+    def test_xffOutsideParams(self):
+        # older dumps have the xff straight under <rra>
+        xml = native.dump(self.rrdfile.name)
+        xml = xml.replace("<params>", "").replace("</params>", "")
+        native.restore(StringIO(xml), self.restored.name)
+        self.assertEquals(RRDFile(self.restored.name).rra[0].xff, 0.5)
+
+    def test_errors(self):
+        xml = native.dump(self.rrdfile.name)
+        for broken in [
+            xml[:len(xml) // 2],
+            xml.replace("<v> NaN </v>", "<v> NaN </v><v> 1 </v>", 1),
+            xml.replace("<v> NaN </v>", "<v> x </v>", 1),
+            xml.replace("<name> speed </name>", ""),
+            xml.replace("<rra>", "<skipped>").replace("</rra>", "</skipped>"),
+            ]:
+            self.assertRaises(RestoreError, native.restore,
+                              StringIO(broken), self.restored.name)
+
+
+class NativeBackendTestCase(NativeBaseTestCase):
+
+    def setUp(self):
+        self.rrdfile = self.writeFile(binary.simpleRRD02)
+
+    def test_readMode(self):
+        rrd = RRD(self.rrdfile.name, mode="r", backend=native)
+        self.assertEquals(rrd.version, 3)
+        self.assertEquals(rrd.step, 300)
+        self.assertEquals(rrd.lastupdate, 920805600)
+        self.assertEquals([ds.name for ds in rrd.ds], ["speed", "velocity"])
+        self.assertEquals(rrd.ds[1].last_ds, "724")
+        self.assertEquals(len(rrd.rra), 1)
+        self.assertEquals(rrd.rra[0].cf, "AVERAGE")
+        self.assertEquals(rrd.rra[0].pdp_per_row, 1)
+        self.assertEquals(rrd.rra[0].xff, 0.5)
+        self.assertEquals(len(rrd.rra[0].ds), 2)
+
+    def test_readModeDatabase(self):
+        rrd = RRD(self.rrdfile.name, mode="r", backend=native)
+        database = rrd.rra[0].database
+        self.assertEquals(len(database), 24)
+        self.assertEquals(len(database[0]), 2)
@@ -0,0 +1,176 @@
+import os
+import sys
+import tempfile
+import threading
+from unittest import TestCase
+
+from pyrrd.backend import external
+from pyrrd.backend.pipe import MAX_LINE_LENGTH, RRDToolPipe, RRDToolPool
+from pyrrd.exceptions import ExternalCommandError
+from pyrrd.testing import fakerrdtool
+
+
+FAKE_RRDTOOL = [sys.executable, os.path.abspath(
+    os.path.splitext(fakerrdtool.__file__)[0] + ".py")]
+
+
+class RRDToolPipeTestCase(TestCase):
+
+    def setUp(self):
+        self.pipe = RRDToolPipe(FAKE_RRDTOOL)
+
+    def tearDown(self):
+        self.pipe.close()
+
+    def test_execute(self):
+        self.assertEqual(self.pipe.execute("echo", "one two"), "one two\n")
+        self.assertEqual(self.pipe.execute("update", "a.rrd N:1"), "")
+        self.assertTrue(self.pipe.isAlive())
+
+    def test_reusesProcess(self):
+        self.pipe.execute("update")
+        process = self.pipe.process
+        self.pipe.execute("update")
+        self.assertTrue(self.pipe.process is process)
+
+    def test_error(self):
+        self.assertRaises(ExternalCommandError, self.pipe.execute, "fail")
+        try:
+            self.pipe.execute("fail", "no such file")
+        except ExternalCommandError, error:
+            self.assertEqual(str(error), "ERROR: no such file")
+        # the process is still usable after an error
+        self.assertEqual(self.pipe.execute("echo", "x"), "x\n")
+
+    def test_restartAfterCrash(self):
+        self.pipe.execute("update")
+        self.assertRaises(ExternalCommandError, self.pipe.execute, "crash")
+        self.assertFalse(self.pipe.isAlive())
+        self.assertEqual(self.pipe.execute("echo", "back"), "back\n")
+
+    def test_lineBreaks(self):
+        self.assertRaises(
+            ExternalCommandError, self.pipe.execute, "update", "a\nfail")
+
+    def test_longLine(self):
+        self.assertRaises(ExternalCommandError, self.pipe.execute, "echo",
+                          "x" * (MAX_LINE_LENGTH - 6))
+        # the process is still in step with the commands
+        longest = "x" * (MAX_LINE_LENGTH - 7)
+        self.assertEqual(self.pipe.execute("echo", longest), longest + "\n")
+        self.assertEqual(self.pipe.execute("echo", "one"), "one\n")
+
+    def test_missingExecutable(self):
+        pipe = RRDToolPipe(["/nonexistent/rrdtool", "-"])
+        self.assertRaises(ExternalCommandError, pipe.execute, "update")
+
+    def test_followsWorkingDirectory(self):
+        cwd = os.getcwd()
+        directory = os.path.realpath(tempfile.mkdtemp())
+        try:
+            self.pipe.execute("update")
+            os.chdir(directory)
+            self.assertEqual(self.pipe.execute("pwd"), directory + "\n")
+        finally:
+            os.chdir(cwd)
+            os.rmdir(directory)
+
+
+class RRDToolPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.pool = RRDToolPool(3, FAKE_RRDTOOL, queueSize=4)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_affinity(self):
+        worker = self.pool.getWorker("a.rrd")
+        self.assertTrue(self.pool.getWorker("a.rrd") is worker)
+        for name in ["./a.rrd", os.path.join(os.getcwd(), "a.rrd")]:
+            self.assertTrue(self.pool.getWorker(name) is worker)
+        self.pool.execute("update", "a.rrd N:1")
+        self.pool.execute("update", "a.rrd N:2")
+        self.assertTrue(worker.pipe.isAlive())
+        others = [w for w in self.pool.workers if w is not worker]
+        self.assertEqual([w.pipe.process for w in others], [None, None])
+
+    def test_roundRobin(self):
+        # xport starts with an option, not a file name
+        for index in xrange(3):
+            self.pool.execute("xport", "--start 600 DEF:a=a.rrd:speed:AVERAGE")
+        self.assertTrue(None not in [
+            worker.pipe.process for worker in self.pool.workers])
+
+    def test_threads(self):
+        results = {}
+
+        def run(name):
+            results[name] = [self.pool.execute("echo", "%s.rrd %s" % (
+                name, index)) for index in xrange(20)]
+
+        threads = [threading.Thread(target=run, args=(name,))
+                   for name in "abcdef"]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for name in "abcdef":
+            self.assertEqual(results[name], [
+                "%s.rrd %s\n" % (name, index) for index in xrange(20)])
+
+    def test_error(self):
+        self.assertRaises(
+            ExternalCommandError, self.pool.execute, "fail", "a.rrd")
+        self.assertEqual(self.pool.execute("echo", "a.rrd"), "a.rrd\n")
+
+    def test_restartAfterCrash(self):
+        worker = self.pool.getWorker("a.rrd")
+        self.pool.execute("update", "a.rrd")
+        self.assertRaises(
+            ExternalCommandError, self.pool.execute, "crash", "a.rrd")
+        self.assertEqual(self.pool.execute("echo", "a.rrd"), "a.rrd\n")
+        # a process that dies while idle is replaced by the health check
+        worker.pipe.process.kill()
+        worker.pipe.process.wait()
+        self.pool.checkHealth()
+        self.assertTrue(worker.pipe.isAlive())
+
+    def test_restartWorker(self):
+        worker = self.pool.getWorker("a.rrd")
+        worker.stop()
+        self.assertFalse(worker.isAlive())
+        self.assertEqual(self.pool.execute("echo", "a.rrd"), "a.rrd\n")
+        self.assertTrue(worker.isAlive())
+
+    def test_boundedQueue(self):
+        pool = RRDToolPool(1, FAKE_RRDTOOL, queueSize=1, putTimeout=0.01)
+        try:
+            worker = pool.workers[0]
+            # stop the worker from taking jobs off the queue
+            worker.stop()
+            worker.start = lambda: None
+            pool.submit("update", "a.rrd")
+            self.assertRaises(
+                ExternalCommandError, pool.submit, "update", "a.rrd")
+        finally:
+            pool.workers = []
+
+
+class ExternalPipeModeTestCase(TestCase):
+
+    def setUp(self):
+        self.oldPool = external._pool
+        external._pool = RRDToolPool(2, FAKE_RRDTOOL)
+
+    def tearDown(self):
+        external._pool.close()
+        external._pool = self.oldPool
+
+    def test_cmd(self):
+        self.assertEqual(external._cmd("echo", "a.rrd"), "a.rrd\n")
+        self.assertTrue(external.getPool() is external._pool)
+
+    def test_cmdError(self):
+        self.assertRaises(
+            ExternalCommandError, external._cmd, "fail", "a.rrd")
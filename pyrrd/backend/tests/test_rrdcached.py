@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pyrrd.backend import native, rrdcached
+from pyrrd.exceptions import RRDCachedError
+from pyrrd.rrd import DataSource, RRA, RRD
+from pyrrd.testing.fakerrdcached import FakeRRDCached
+
+
+tutorialUpdates = [
+    "920804700:12345", "920805000:12357", "920805300:12363",
+    "920805600:12363", "920805900:12363", "920806200:12373",
+    "920806500:12383", "920806800:12393", "920807100:12399",
+    "920807400:12405", "920807700:12411", "920808000:12415",
+    "920808300:12420", "920808600:12422", "920808900:12423"]
+
+
+class RRDCachedTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = FakeRRDCached(os.path.join(self.directory, "sock"))
+        self.server.start()
+        self.oldAddress = rrdcached.address
+        rrdcached.address = "unix:" + self.server.path
+        self.filename = os.path.join(self.directory, "test.rrd")
+        self.rrd = RRD(
+            self.filename, start=920804400, backend=rrdcached,
+            ds=[DataSource(dsName="speed", dsType="COUNTER", heartbeat=600)],
+            rra=[RRA(cf="AVERAGE", xff=0.5, steps=1, rows=24),
+                 RRA(cf="AVERAGE", xff=0.5, steps=6, rows=10)])
+        self.rrd.create()
+
+    def tearDown(self):
+        rrdcached._client.close()
+        rrdcached.address = self.oldAddress
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def test_create(self):
+        self.assertEqual(self.server.commands[0].split()[:2],
+                         ["CREATE", self.filename])
+        self.assertEqual(native.info(self.filename, rawData=True)["step"],
+                         300)
+
+    def test_updateIsCached(self):
+        for update in tutorialUpdates[:3]:
+            self.rrd.bufferValue(*update.split(":"))
+        self.rrd.update()
+        self.assertEqual(self.server.commands[-1],
+                         "UPDATE %s %s" % (self.filename,
+                                           " ".join(tutorialUpdates[:3])))
+        self.assertEqual(self.server.pending[self.filename],
+                         tutorialUpdates[:3])
+        info = native.info(self.filename, rawData=True)
+        self.assertEqual(info["last_update"], 920804400)
+        rrdcached.flush(self.filename)
+        info = native.info(self.filename, rawData=True)
+        self.assertEqual(info["last_update"], 920805300)
+
+    def test_readMode(self):
+        rrdcached.update(self.filename, tutorialUpdates[:3])
+        rrd = RRD(self.filename, mode="r", backend=rrdcached)
+        self.assertEqual(self.server.commands[-1], "FLUSH %s" % self.filename)
+        self.assertEqual(rrd.lastupdate, 920805300)
+        self.assertEqual(rrd.lastWritten, 920805300)
+
+    def test_fetch(self):
+        rrdcached.update(self.filename, tutorialUpdates)
+        results = self.rrd.fetch(start=920804400, end=920809200)
+        self.assertEqual(results["speed"][1], (920805000, 0.04))
+        self.assertEqual(len(results["speed"]), 17)
+        times, columns = self.rrd.fetch(
+            start=920804400, end=920809200, returnStyle="columns")
+        self.assertEqual(times[0], 920804700)
+        self.assertAlmostEqual(columns["speed"][2], 0.02)
+
+    def test_batch(self):
+        rrdcached.MAX_LINE_LENGTH, old = 100, rrdcached.MAX_LINE_LENGTH
+        try:
+            rrdcached.update(self.filename, tutorialUpdates)
+        finally:
+            rrdcached.MAX_LINE_LENGTH = old
+        self.assertTrue("BATCH" in self.server.commands)
+        self.assertEqual(self.server.pending[self.filename], tutorialUpdates)
+
+    def test_updateMany(self):
+        other = os.path.join(self.directory, "other.rrd")
+        shutil.copy(self.filename, other)
+        rrdcached.updateMany([
+            (self.filename, tutorialUpdates[:2]), (other, tutorialUpdates)])
+        self.assertEqual(self.server.commands[-3:], [
+            "BATCH",
+            "UPDATE %s %s" % (self.filename, " ".join(tutorialUpdates[:2])),
+            "UPDATE %s %s" % (other, " ".join(tutorialUpdates))])
+        self.assertEqual(len(self.server.pending[other]), 15)
+
+    def test_unicodeFilename(self):
+        other = os.path.join(self.directory, u"caf\xe9.rrd")
+        shutil.copy(self.filename, other.encode("utf-8"))
+        rrdcached.updateMany([(other, tutorialUpdates[:2])])
+        rrdcached.flush(other)
+        self.assertEqual(self.server.commands[-2],
+                         "UPDATE %s %s" % (other.encode("utf-8"),
+                                           " ".join(tutorialUpdates[:2])))
+
+    def test_errors(self):
+        missing = os.path.join(self.directory, "missing.rrd")
+        self.assertRaises(
+            RRDCachedError, rrdcached.update, missing, ["920804700:1"])
+        try:
+            rrdcached.updateMany([
+                (self.filename, ["920804700:1"]), (missing, ["920804700:1"])])
+        except RRDCachedError, error:
+            self.assertEqual(str(error), "%s: No such file: %s" % (
+                missing, missing))
+        else:
+            self.fail("no error for a missing file")
+
+    def test_noAddress(self):
+        rrdcached.address = None
+        old = os.environ.pop("RRDCACHED_ADDRESS", None)
+        try:
+            self.assertRaises(RRDCachedError, rrdcached.getClient)
+        finally:
+            if old is not None:
+                os.environ["RRDCACHED_ADDRESS"] = old
+
+    def test_reconnect(self):
+        rrdcached.flush(self.filename)
+        rrdcached.getClient().socket.close()
+        self.assertRaises(RRDCachedError, rrdcached.flush, self.filename)
+        rrdcached.flush(self.filename)
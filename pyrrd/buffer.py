@@ -0,0 +1,444 @@
+"""
+The buffer that holds the values of an RRD until they are written.
+
+Readings that are plain numbers are kept compactly: the timestamps in an
+array of longs and the values in one flat array of doubles, a row of
+"width" values (one per DS) per reading, with NaN for unknown. They are only
+turned into rrdtool's "time:value:value" strings when the buffer is read,
+as it is when the values are sent to the backend.
+
+Anything else (a "time:value" string, the time "N", values that are not
+numbers, or a reading with a different number of values) can't be stored
+that way, so the buffer then falls back to holding the (time, values)
+string tuples that RRD.bufferValue has always built.
+
+    >>> buffer = ValueBuffer()
+    >>> buffer.add(920805600, [12363, 1.5])
+    >>> buffer.add("920805900", ["12373", "U"])
+    >>> buffer.isCompact(), len(buffer)
+    (True, 2)
+    >>> list(buffer)
+    [(920805600, u'12363:1.5'), (920805900, u'12373:U')]
+    >>> buffer.add("920806200:12383:2")
+    >>> buffer.isCompact()
+    False
+    >>> buffer[-1]
+    ('920806200:12383:2', u'')
+"""
+from array import array
+import math
+import time
+
+from pyrrd.exceptions import UpdateError
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# integers larger than this are not all exactly representable as doubles
+MAX_EXACT_INTEGER = 2 ** 53
+UNKNOWN = float("nan")
+# what checkOrder can do with readings that are not after the ones before
+POLICIES = ["error", "drop", "last-wins", "sort"]
+
+
+def formatValue(value):
+    """
+    Write a value as rrdtool reads it.
+
+    >>> formatValue(12345.0), formatValue(0.25), formatValue(float("nan"))
+    (u'12345', u'0.25', u'U')
+    >>> formatValue(float("inf")), formatValue(-float("inf"))
+    (u'inf', u'-inf')
+    """
+    if math.isnan(value):
+        return u"U"
+    if math.isinf(value):
+        return unicode(repr(value))
+    if value == int(value) and abs(value) < MAX_EXACT_INTEGER:
+        return u"%d" % value
+    return unicode(repr(value))
+
+
+def toNumber(value):
+    """
+    Return the value as a double, or None if it can't be stored as one
+    without changing what rrdtool would be sent.
+
+    >>> toNumber("12"), toNumber(1.5), toNumber("U"), toNumber("value")
+    (12.0, 1.5, nan, None)
+    >>> toNumber(2 ** 64 - 1)
+    """
+    if isinstance(value, float):
+        return value
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, long)):
+        if abs(value) >= MAX_EXACT_INTEGER:
+            return None
+        return float(value)
+    if not isinstance(value, basestring):
+        return None
+    if value == "U":
+        return UNKNOWN
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    if math.isnan(number) or math.isinf(number):
+        return None
+    if abs(number) >= MAX_EXACT_INTEGER and number == int(number):
+        return None
+    return number
+
+
+def toTime(value):
+    """
+    Return the time as a whole number of seconds, or None if it is
+    something else (such as "N" or a fraction of a second).
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, long)):
+        return value
+    if isinstance(value, float):
+        if value == int(value):
+            return int(value)
+        return None
+    if isinstance(value, basestring) and value.isdigit():
+        return int(value)
+    return None
+
+
+def rowsFromColumns(names, columns, length):
+    """
+    Arrange a dict of columns as rows in the order of names, with unknown
+    values for the names it doesn't have.
+
+    >>> rowsFromColumns(["a", "b"], {"c": [1, 2]}, 2)
+    Traceback (most recent call last):
+    ValueError: there are no data sources named c
+    """
+    unknown = set(columns) - set(names)
+    if unknown:
+        raise ValueError("there are no data sources named %s" % ", ".join(
+            sorted(unknown)))
+    if numpy is not None:
+        rows = numpy.empty((length, len(names)))
+        rows.fill(UNKNOWN)
+        for index, name in enumerate(names):
+            if name in columns:
+                rows[:, index] = columns[name]
+        return rows
+    filler = [UNKNOWN] * length
+    return zip(*[columns.get(name, filler) for name in names])
+
+
+def rowWidth(rows):
+    """
+    The number of values in each row (1 for a flat sequence of values).
+
+    >>> rowWidth([[1, 2], [3, 4]]), rowWidth([1, 2, 3]), rowWidth([])
+    (2, 1, 0)
+    """
+    if not len(rows):
+        return 0
+    if numpy is not None:
+        rows = numpy.asarray(rows)
+        if rows.ndim == 1:
+            return 1
+        return rows.shape[-1]
+    if isinstance(rows[0], (list, tuple, array)):
+        return len(rows[0])
+    return 1
+
+
+def firstOutOfOrder(times, after=None):
+    """
+    Return the index of the first time that is not later than the one
+    before it (or than after, for the first), or None if they all are.
+
+    >>> firstOutOfOrder([1, 2, 4, 3]), firstOutOfOrder([1, 2], after=1)
+    (3, 0)
+    >>> firstOutOfOrder([1, 2, 3], after=0)
+    """
+    if not len(times):
+        return None
+    if after is not None and times[0] <= after:
+        return 0
+    if numpy is not None:
+        steps = numpy.flatnonzero(numpy.diff(numpy.asarray(times)) <= 0)
+        if len(steps):
+            return int(steps[0]) + 1
+        return None
+    for index in xrange(1, len(times)):
+        if times[index] <= times[index - 1]:
+            return index
+    return None
+
+
+def checkOrder(buffer, after=None, policy="error"):
+    """
+    Check, in one pass, that the time of each reading in the buffer is
+    later than the one before it and than after (the last time written to
+    the file), since rrdtool rejects the whole update otherwise. Returns
+    the buffer to write, which depends on the policy for the readings that
+    are not:
+
+    * "error" raises an UpdateError for the first of them;
+    * "drop" leaves them out;
+    * "last-wins" leaves them out, except that a reading with the same time
+      as the one before replaces it;
+    * "sort" puts the readings in order of time first, then keeps the last
+      of those with the same time and leaves out those not after "after".
+
+    Readings without a time (such as "N") are left as they are.
+
+    >>> buffer = ValueBuffer()
+    >>> for seconds, value in [(300, 1), (600, 2), (600, 3), (450, 4)]:
+    ...     buffer.add(seconds, [value])
+    >>> checkOrder(buffer, policy="drop")
+    [(300, u'1'), (600, u'2')]
+    >>> checkOrder(buffer, policy="last-wins")
+    [(300, u'1'), (600, u'3')]
+    >>> checkOrder(buffer, after=300, policy="sort")
+    [(450, u'4'), (600, u'3')]
+    >>> checkOrder(buffer)
+    Traceback (most recent call last):
+    UpdateError: the time 600 (at index 2) is not after the one before it
+    """
+    if policy not in POLICIES:
+        raise ValueError("the policy must be one of %s" % ", ".join(POLICIES))
+    times = buffer.seconds()
+    order = range(len(times))
+    reordered = False
+    if policy == "sort":
+        if firstOutOfOrder([seconds for seconds in times
+                            if seconds is not None]) is not None:
+            # readings without a time ("N" is now) go last
+            order.sort(key=lambda index: (times[index] is None, times[index]))
+            reordered = True
+        policy = "last-wins"
+    kept = []
+    last = after
+    # where in kept the reading with the time "last" is
+    position = None
+    for index in order:
+        seconds = times[index]
+        if seconds is None:
+            kept.append(index)
+        elif last is None or seconds > last:
+            position = len(kept)
+            kept.append(index)
+            last = seconds
+        elif policy == "error":
+            if position is None:
+                raise UpdateError("the time %s (at index %s) is not after "
+                                  "the last update, at %s" % (
+                                  formatValue(seconds), index,
+                                  formatValue(after)))
+            raise UpdateError("the time %s (at index %s) is not after the "
+                              "one before it" % (formatValue(seconds), index))
+        elif (policy == "last-wins" and seconds == last and
+                position is not None):
+            kept[position] = index
+    if len(kept) == len(times) and not reordered:
+        return buffer
+    return buffer.select(kept)
+
+
+class ValueBuffer(object):
+    """
+    Buffered readings; iterating over it gives the (time, values) tuples
+    that the backends' prepareObject expect.
+    """
+    def __init__(self, values=None):
+        self.clear()
+        if values:
+            self.raw = list(values)
+
+    def clear(self):
+        self.times = array("l")
+        self.data = array("d")
+        self.width = None
+        # the readings as string tuples, once they can't be stored compactly
+        self.raw = None
+        # when the first of the readings was added
+        self.started = None
+
+    def isCompact(self):
+        return self.raw is None
+
+    def size(self):
+        """
+        The number of bytes the readings take up: that of the arrays or, for
+        string tuples, of the strings.
+        """
+        if self.raw is None:
+            return (len(self.times) * self.times.itemsize +
+                    len(self.data) * self.data.itemsize)
+        return sum([len(unicode(timeOrData)) + len(values) + 1
+                    for timeOrData, values in self.raw])
+
+    def age(self):
+        """
+        The number of seconds since the oldest of the readings was added.
+        """
+        if self.started is None:
+            return 0.0
+        return time.time() - self.started
+
+    def add(self, timeOrData, values=()):
+        if self.started is None:
+            self.started = time.time()
+        if self.raw is None:
+            seconds = toTime(timeOrData)
+            numbers = [toNumber(value) for value in values]
+            if (seconds is not None and numbers and None not in numbers and
+                    self.width in (None, len(numbers))):
+                self.width = len(numbers)
+                self.times.append(seconds)
+                self.data.extend(numbers)
+                return
+            self.raw = list(self)
+        self.raw.append((timeOrData, u":".join([
+            isinstance(value, float) and formatValue(value) or unicode(value)
+            for value in values])))
+
+    def extend(self, times, rows):
+        """
+        Add a reading for each time, with the values in the matching row of
+        rows (a 2-D array or a sequence of sequences). With NumPy and a
+        compact buffer, the arrays are copied in one go rather than reading
+        by reading.
+        """
+        if numpy is None:
+            if len(times) != len(rows):
+                raise ValueError(
+                    "there must be a row of values for each time")
+            if rowWidth(rows) == 1 and not isinstance(
+                    rows[0], (list, tuple, array)):
+                rows = [(value,) for value in rows]
+            for seconds, values in zip(times, rows):
+                self.add(seconds, [float(value) for value in values])
+            return
+        times = numpy.asarray(times)
+        rows = numpy.asarray(rows, dtype=numpy.float64)
+        if rows.ndim == 1:
+            rows = rows.reshape(-1, 1)
+        if rows.ndim != 2 or rows.shape[0] != len(times):
+            raise ValueError("there must be a row of values for each time")
+        if not len(times):
+            return
+        if times.dtype.kind == "f":
+            if (times != numpy.floor(times)).any():
+                raise ValueError("the times must be whole seconds")
+        elif times.dtype.kind not in "iu":
+            raise ValueError("the times must be numbers")
+        if self.raw is not None or self.width not in (None, rows.shape[1]):
+            for seconds, values in zip(times.tolist(), rows.tolist()):
+                self.add(seconds, values)
+            return
+        if self.started is None:
+            self.started = time.time()
+        self.width = rows.shape[1]
+        self.times.fromstring(times.astype(numpy.dtype("l")).tostring())
+        self.data.fromstring(numpy.ascontiguousarray(rows).tostring())
+
+    def merge(self, other):
+        """
+        Add the readings of another buffer after these.
+        """
+        if not len(other):
+            return
+        if (self.raw is None and other.raw is None and
+                self.width in (None, other.width)):
+            self.width = other.width
+            self.times.extend(other.times)
+            self.data.extend(other.data)
+        else:
+            if self.raw is None:
+                self.raw = list(self)
+            self.raw.extend(other)
+        if self.started is None or other.started < self.started:
+            self.started = other.started
+
+    def select(self, indexes):
+        """
+        A new buffer with just the readings at the indexes, in their order.
+        """
+        selected = ValueBuffer()
+        selected.started = self.started
+        if self.raw is not None:
+            selected.raw = [self.raw[index] for index in indexes]
+            return selected
+        selected.width = self.width
+        for index in indexes:
+            selected.times.append(self.times[index])
+            start = index * self.width
+            selected.data.extend(self.data[start:start + self.width])
+        return selected
+
+    def seconds(self):
+        """
+        The time of each reading, in seconds, or None for those that don't
+        give one (such as "N").
+        """
+        if self.raw is None:
+            return self.times.tolist()
+        result = []
+        for timeOrData, values in self.raw:
+            try:
+                result.append(float(unicode(timeOrData).split(":")[0]))
+            except ValueError:
+                result.append(None)
+        return result
+
+    def lastTime(self):
+        """
+        The time of the last reading, in seconds, or None if it doesn't give
+        one (such as "N").
+        """
+        if self.raw is None:
+            return float(self.times[-1])
+        try:
+            return float(unicode(self.raw[-1][0]).split(":")[0])
+        except ValueError:
+            return None
+
+    def row(self, index):
+        start = index * self.width
+        return self.times[index], u":".join([
+            formatValue(value)
+            for value in self.data[start:start + self.width]])
+
+    def __len__(self):
+        if self.raw is None:
+            return len(self.times)
+        return len(self.raw)
+
+    def __iter__(self):
+        if self.raw is not None:
+            return iter(self.raw)
+        return (self.row(index) for index in xrange(len(self.times)))
+
+    def __getitem__(self, index):
+        if self.raw is not None:
+            return self.raw[index]
+        if index < 0:
+            index += len(self.times)
+        if not 0 <= index < len(self.times):
+            raise IndexError("buffer index out of range")
+        return self.row(index)
+
+    def __eq__(self, other):
+        if isinstance(other, ValueBuffer):
+            other = list(other)
+        return list(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
@@ -4,3 +4,44 @@ class PyRRDError(Exception):
 
 class ExternalCommandError(PyRRDError):
     pass
+
+
+class FormatError(PyRRDError):
+    pass
+
+
+class UpdateError(PyRRDError):
+    pass
+
+
+class FetchError(PyRRDError):
+    pass
+
+
+class CreateError(PyRRDError):
+    pass
+
+
+class RestoreError(PyRRDError):
+    pass
+
+
+class RRDCachedError(PyRRDError):
+    pass
+
+
+class QueueFullError(ExternalCommandError):
+    pass
+
+
+class PartialUpdateError(ExternalCommandError):
+    """
+    An update that was sent in several commands failed part way through:
+    chunk is the index of the command that failed, time the timestamp of
+    its first value and written the number of values already written.
+    """
+    def __init__(self, message, chunk=None, time=None, written=0):
+        super(PartialUpdateError, self).__init__(message)
+        self.chunk = chunk
+        self.time = time
+        self.written = written
@@ -1,7 +1,7 @@
 import os
 import re
 
-from pyrrd.backend import external
+from pyrrd.backend import aio, external
 
 def validateVName(name):
     '''
@@ -266,6 +266,43 @@ class CalculationDefinition(VariableDefinition):
 
 CDEF = CalculationDefinition
 
+class Export(object):
+    '''
+    Names a series for rrdtool xport: the values of a DEF, CDEF or VDEF are
+    exported under the given legend (see Xport).
+
+    >>> def1 = DEF(rrdfile='/home/rrdtool/data/router1.rrd',
+    ...   vname='ds0a', dsName='ds0')
+    >>> Export(defObj=def1, legend='Router 1')
+    XPORT:ds0a:"Router 1"
+    >>> XPORT('ds0a')
+    XPORT:ds0a
+    >>> XPORT()
+    Traceback (most recent call last):
+    Exception: You must provide either a value or a definition object.
+    '''
+    def __init__(self, value=None, defObj=None, legend=''):
+        if not value:
+            if not defObj:
+                raise Exception, "You must provide either a value " + \
+                    "or a definition object."
+            value = defObj.vname
+        self.vname = validateVName(value)
+        self.legend = legend
+        self.abbr = 'XPORT'
+
+    def __repr__(self):
+        '''
+        We override this method for preparing the class's data for
+        use with RRDTool.
+        '''
+        main = self.abbr + ':%s' % self.vname
+        if self.legend:
+            main += ':"%s"' % escapeColons(self.legend)
+        return main
+
+XPORT = Export
+
 class Print(object):
     '''
     Depending on the context, either the value component or the
@@ -850,6 +887,73 @@ class Graph(object):
             print data
         self.backend.graph(*data)
 
+    def awrite(self, executor=None):
+        '''
+        Like write, but without waiting for rrdtool: the graph is queued on
+        the rrdtool processes of pyrrd.backend.aio and a Future is returned.
+        '''
+        data = aio.prepareObject('graph', self)
+        return aio.graph(executor=executor, *data)
+
+
+class Xport(object):
+    '''
+    rrdtool xport fetches the data of any number of DEFs, from any number
+    of RRD files, combines it with CDEFs and VDEFs as a graph would, and
+    returns the series named by the XPORT elements, all in one rrdtool
+    command. The elements go in "data", as they do for a Graph.
+
+    The series come back as FetchResults (see pyrrd.backend.common) with
+    the legends of the XPORTs as the names of the columns, so one fetch()
+    replaces a fetch per file.
+
+    >>> import tempfile
+    >>> from rrd import RRD, RRA, DS
+    >>> filenames = []
+    >>> for speed in [12345, 23456]:
+    ...     tfile = tempfile.NamedTemporaryFile()
+    ...     filenames.append(tfile)
+    ...     my_rrd = RRD(tfile.name, ds=[DS(dsName='speed', dsType='GAUGE',
+    ...         heartbeat=600)], rra=[RRA(cf='AVERAGE', xff=0.5, steps=1,
+    ...         rows=24)], start=920804400)
+    ...     my_rrd.create()
+    ...     for time in range(920804700, 920808000, 300):
+    ...         my_rrd.bufferValue(time, speed)
+    ...     my_rrd.update()
+    >>> def1 = DEF(rrdfile=filenames[0].name, vname='a', dsName='speed')
+    >>> def2 = DEF(rrdfile=filenames[1].name, vname='b', dsName='speed')
+    >>> cdef1 = CDEF(vname='total', rpn='a,b,+')
+    >>> xport = Xport(start=920804400, end=920807700)
+    >>> xport.data.extend([def1, def2, cdef1,
+    ...   XPORT(defObj=def1, legend='a'), XPORT('total', legend='a and b')])
+    >>> results = xport.fetch()
+    >>> results.dsNames
+    ('a', 'a and b')
+    >>> results.columns[1][-1]
+    35801.0
+    '''
+    def __init__(self, start=None, end=None, step=None, maxrows=None,
+        backend=external):
+        self.start = start
+        self.end = end
+        self.step = step
+        self.maxrows = maxrows
+        self.backend = backend
+        self.data = []
+
+    def fetch(self, returnStyle=None, debug=False):
+        '''
+        Return the exported series as FetchResults, or as the part of them
+        for the returnStyle if one is given ("ds", "time" or "columns").
+        '''
+        data = self.backend.prepareObject('xport', self)
+        if debug:
+            print data
+        results = self.backend.xport(*data)
+        if returnStyle is None:
+            return results
+        return results[returnStyle]
+
 
 if __name__ == '__main__':
     import doctest
@@ -1,4 +1,4 @@
-from pyrrd.node import RRDXMLNode
+from pyrrd.node import Node, RRDXMLNode
 
 
 class DSMixin(object):
@@ -183,7 +183,20 @@ class RRDMapper(Mapper, DSMixin):
         for index, rra in enumerate(self.rra):
             rra.printInfo(index)
 
-    def map(self):
+    def loadHeader(self):
+        """
+        Read just the header of the RRD file: the step, last update and the
+        DS and RRA definitions and state. The rows are left on disk and read
+        through each RRA's "database" attribute when they are asked for.
+        This is up to the backend's loadHeader, if it has one; returns None
+        if it doesn't or if the file cannot be read this way.
+        """
+        loadHeader = getattr(self.backend, "loadHeader", None)
+        if not self.filename or loadHeader is None:
+            return None
+        return loadHeader(self.filename)
+
+    def map(self, includeData=False):
         """
         The map method does several things:
             1) if the RRD object (instantiated from this class or a subclass)
@@ -191,16 +204,30 @@ class RRDMapper(Mapper, DSMixin):
                it; there is already an object representation. In this case, the
                majority of this method is skipped.
             2) if the RRD object is in "read" mode, it needs to pull data out
-               of the rrd file; it does this by loading (which dumps to XML and
-               then reads in the XML).
-            3) once the XML has been parsed, it maps the XML to objects.
+               of the rrd file; unless the data is needed as well, it reads
+               only the binary header of the file, if the backend can.
+               Otherwise (or if the header can't be read) it loads the file through the backend,
+               which streams the XML dump into nodes (keeping the values of
+               the rows only if includeData is set), unless the backend
+               reads the file itself and hands back a node directly.
+            3) once the header or XML has been parsed, it maps it to objects.
         """
         if self.mode == "w":
             return
-        # The backend is defined by the subclass of this class, as is the
-        # filename.
-        tree = self.backend.load(self.filename)
-        node = RRDXMLNode(tree)
+        node = None
+        if not includeData:
+            node = self.loadHeader()
+        if node is None:
+            # The backend is defined by the subclass of this class, as is the
+            # filename.
+            if includeData:
+                tree = self.backend.load(self.filename, includeData=True)
+            else:
+                tree = self.backend.load(self.filename)
+            if isinstance(tree, Node):
+                node = tree
+            else:
+                node = RRDXMLNode(tree, includeData)
         super(RRDMapper, self).map(node)
         for subNode in node.ds:
             ds = DSMapper()
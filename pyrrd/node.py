@@ -3,7 +3,20 @@ This module's classes are used to represent RRD data in XML format. The mapper
 module uses this format to establish a relationship between RRD files (and
 their exports) and Python objects.
 """
-class XMLNode(object):
+from array import array
+
+from pyrrd.util import iterparse
+
+
+class Node(object):
+    """
+    A base class for anything the mapper module can map from. Subclasses must
+    provide an "attributes" dict; the RRD-level node also provides "ds" and
+    "rra" lists of child nodes.
+    """
+
+
+class XMLNode(Node):
     """
     A base class. Not used directly.
     """
@@ -57,12 +70,40 @@ class CDPPrepXMLNode(XMLNode):
 
 class DatabaseNode(XMLNode):
     """
-    An object abstraction for the <database> node in the XML RRD export.
-    Currently unimplemented.
+    An object abstraction for the <database> node in the XML RRD export. The
+    values of the rows are kept in one flat array of doubles; indexing or
+    iterating gives each row as a tuple of values.
     """
-    def __init__(self, node):
+    def __init__(self, node=None):
         super(DatabaseNode, self).__init__(node, [])
-        self.row = []
+        self.values = array("d")
+        self.width = 0
+        if node is not None:
+            for row in node.findall("row"):
+                self.addRow(row)
+
+    def addRow(self, row):
+        values = [float(value.text) for value in row.findall("v")]
+        self.width = len(values)
+        self.values.extend(values)
+
+    def __len__(self):
+        if not self.width:
+            return 0
+        return len(self.values) // self.width
+
+    def __getitem__(self, index):
+        count = len(self)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("row index out of range")
+        start = index * self.width
+        return tuple(self.values[start:start + self.width])
+
+    @property
+    def row(self):
+        return list(self)
 
 
 class RRAXMLNode(XMLNode):
@@ -70,18 +111,19 @@ class RRAXMLNode(XMLNode):
     An object abstraction for the <rra> node in the XML RRD export. The <rra>
     nodes are children of the <rrd> node.
     """
-    def __init__(self, tree, attributes, includeData=False):
+    def __init__(self, tree, attributes, includeData=False, database=None):
         super(RRAXMLNode, self).__init__(tree, attributes)
-        self.database = None
+        self.database = database
         xff = self.tree.find('params').find('xff')
         if xff!=None:
             xff = float(xff.text)
             self.attributes["xff"] = xff
 
         self.cdp_prep = CDPPrepXMLNode(self.tree.find("cdp_prep"))
-        if includeData:
-            db = self.tree.get("database")
-            self.database = DatabaseNode(db)
+        if includeData and database is None:
+            self.database = DatabaseNode(self.tree.find("database"))
+        if self.database is not None:
+            self.attributes["database"] = self.database
 
     def getAttribute(self, attrName):
         """
@@ -96,34 +138,40 @@ class RRDXMLNode(XMLNode):
     """
     An object abstraction for the <rrd> node in the XML RRD export. This is the
     top-level node in the XML RRD export.
+
+    The nodes for the data sources and RRAs are made from the tree unless
+    they are given (see parse).
     """
-    def __init__(self, tree, includeData=False):
-        attributes = [
-            ("version", int, 0),
-            ("step", int, 300),
-            ("lastupdate", int, 0),
-            ]
-        super(RRDXMLNode, self).__init__(tree, attributes)
-        dsAttributes = [
-            ("name", str, ""),
-            ("type", str, "GAUGE"),
-            ("minimal_heartbeat", int, 300),
-            ("min", int, "NaN"),
-            ("max", int, "NaN"),
-            ("last_ds", int, 0),
-            ("value", float, 0.0),
-            ("unknown_sec", int, 0),
-            ]
-        rraAttributes = [
-            ("cf", str, "AVERAGE"),
-            ("pdp_per_row", int, 0),
-            ]
-        self.ds = []
-        self.rra = []
-        for ds in self.getDataSources():
-            self.ds.append(DSXMLNode(ds, dsAttributes))
-        for rra in self.getRRAs():
-            self.rra.append(RRAXMLNode(rra, rraAttributes, includeData))
+    rrdAttributes = [
+        ("version", int, 0),
+        ("step", int, 300),
+        ("lastupdate", int, 0),
+        ]
+    dsAttributes = [
+        ("name", str, ""),
+        ("type", str, "GAUGE"),
+        ("minimal_heartbeat", int, 300),
+        ("min", int, "NaN"),
+        ("max", int, "NaN"),
+        ("last_ds", int, 0),
+        ("value", float, 0.0),
+        ("unknown_sec", int, 0),
+        ]
+    rraAttributes = [
+        ("cf", str, "AVERAGE"),
+        ("pdp_per_row", int, 0),
+        ]
+
+    def __init__(self, tree, includeData=False, ds=None, rra=None):
+        super(RRDXMLNode, self).__init__(tree, self.rrdAttributes)
+        if ds is None:
+            ds = [DSXMLNode(node, self.dsAttributes)
+                  for node in self.getDataSources()]
+        if rra is None:
+            rra = [RRAXMLNode(node, self.rraAttributes, includeData)
+                   for node in self.getRRAs()]
+        self.ds = ds
+        self.rra = rra
 
     def getDataSources(self):
         """
@@ -134,3 +182,41 @@ class RRDXMLNode(XMLNode):
         """
         """
         return self.tree.findall("rra")
+
+
+def parse(source, includeData=False):
+    """
+    Build an RRDXMLNode from an XML dump (a file name or a file object)
+    without holding the whole document: the data source and RRA nodes are
+    made as their elements end, and each <row> is dropped as soon as it has
+    been read (its values are kept, in an RRA's DatabaseNode, only if
+    includeData is set).
+    """
+    path = []
+    root = database = rows = None
+    ds = []
+    rra = []
+    for event, element in iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            path.append(element.tag)
+            if path[1:] == ["rra", "database"]:
+                database = element
+                if includeData:
+                    rows = DatabaseNode()
+            continue
+        path.pop()
+        if path[1:] == ["rra", "database"] and element.tag == "row":
+            if rows is not None:
+                rows.addRow(element)
+            database.remove(element)
+        elif len(path) == 1 and element.tag == "ds":
+            ds.append(DSXMLNode(element, RRDXMLNode.dsAttributes))
+        elif len(path) == 1 and element.tag == "rra":
+            rra.append(RRAXMLNode(
+                element, RRDXMLNode.rraAttributes, database=rows))
+            rows = None
+    if root is None:
+        raise SyntaxError("no element found")
+    return RRDXMLNode(root, includeData, ds, rra)
@@ -1,9 +1,21 @@
-import re
 from datetime import datetime
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import heapq
+import re
+import sys
+import threading
+import time
+import zlib
 
 from pyrrd import mapper
 from pyrrd import util
-from pyrrd.backend import external
+from pyrrd.backend import aio, external
+from pyrrd.backend.pipe import cpuCount
+from pyrrd.buffer import (
+    ValueBuffer, checkOrder, firstOutOfOrder, rowWidth, rowsFromColumns)
+from pyrrd.exceptions import (
+    CreateError, PartialUpdateError, PyRRDError, QueueFullError, UpdateError)
 
 
 def validateDSName(name):
@@ -97,7 +109,8 @@ class RRD(mapper.RRDMapper):
     0
     """
     def __init__(self, filename=None, start=None, step=300, ds=None, rra=None,
-                 mode="w", backend=external):
+                 mode="w", backend=external, flushCount=None, flushBytes=None,
+                 flushAge=None, outOfOrder=None):
         super(RRD, self).__init__()
         if filename == None:
             raise ValueError, "You must provide a filename."
@@ -116,11 +129,29 @@ class RRD(mapper.RRDMapper):
         self.step = step
         self.lastupdate = None
         self.mode = mode
+        self.template = None
+        # the write-behind policy (see checkFlush)
+        self.flushCount = flushCount
+        self.flushBytes = flushBytes
+        self.flushAge = flushAge
+        # the Flusher this RRD is registered with, if any
+        self.flusher = None
+        # what update does with readings that rrdtool would reject for
+        # their time (see pyrrd.buffer.checkOrder); None sends them anyway
+        self.outOfOrder = outOfOrder
+        # the time of the last reading in the file, as far as we know
+        self.lastWritten = None
+        # values can be buffered while an update is being written, but only
+        # one update is written at a time, so they reach the file in order
+        self.lock = threading.RLock()
+        self.writeLock = threading.Lock()
         # the backend attribute needs to be defined before the load call, since
         # the load method (super class) expects the backend attribute
         self.backend = backend
         if self.mode == "r":
             self.load()
+            if self.lastupdate is not None:
+                self.lastWritten = float(self.lastupdate)
 
     def bufferValue(self, timeOrData, *values):
         """
@@ -130,6 +161,9 @@ class RRD(mapper.RRDMapper):
         respectively... i.e., in the order that the DSs were added
         to the RRD).
 
+        Numeric readings are kept in arrays rather than as strings until
+        they are sent (see pyrrd.buffer).
+
         >>> my_rrd = RRD('somefile')
         >>> my_rrd.bufferValue('1000000', 'value')
         >>> my_rrd.update(debug=True, dryRun=True)
@@ -161,18 +195,161 @@ class RRD(mapper.RRDMapper):
         ('somefile', ['--template', u'ds0', '1000000:value', '1000001:anothervalue'])
         >>> my_rrd.values = []
         """
-        values = ':'.join([unicode(x) for x in values])
-        self.values.append((timeOrData, values))
-        self.lastupdate = float(unicode(timeOrData).split(":")[0])
+        self.lock.acquire()
+        try:
+            self.values.add(timeOrData, values)
+            # "N" is only given a time when it is written
+            seconds = self.values.lastTime()
+            if seconds is not None:
+                self.lastupdate = seconds
+        finally:
+            self.lock.release()
+        self.buffered(1)
 
     # for backwards compatibility
     bufferValues = bufferValue
 
-    def create(self, debug=False):
+    def bufferArray(self, times, values):
+        """
+        Buffer many readings in one call. times is a sequence (or array) of
+        timestamps, in whole seconds, and values either a 2-D array with a
+        row for each time and a column for each DS, in the order of the DSs,
+        or a dict of DS names and columns (DSs that are left out get unknown
+        values). With NumPy, the checks and the copy into the buffer are
+        done on whole arrays.
+
+        The times must increase, and come after the last one buffered or
+        written; an UpdateError says which one doesn't.
+
+        >>> my_rrd = RRD('somefile', ds=[DS(dsName='a', dsType='GAUGE'),
+        ...     DS(dsName='b', dsType='GAUGE')])
+        >>> my_rrd.bufferArray([1000, 1300], [[1, 2], [3, 4]])
+        >>> my_rrd.bufferArray([1600], {'b': [5]})
+        >>> list(my_rrd.values)
+        [(1000, u'1:2'), (1300, u'3:4'), (1600, u'U:5')]
+        >>> my_rrd.bufferArray([1600], [[1, 2]])
+        Traceback (most recent call last):
+        UpdateError: the time 1600 (at index 0) is not after the one before it
+        """
+        names = [ds.name for ds in self.ds]
+        if isinstance(values, dict):
+            if not names:
+                raise ValueError(
+                    "the RRD's data sources are needed to arrange the columns")
+            values = rowsFromColumns(names, values, len(times))
+        width = rowWidth(values)
+        if names and width and width != len(names):
+            raise ValueError("there are %s values in a row for %s data "
+                             "sources" % (width, len(names)))
+        self.lock.acquire()
+        try:
+            index = firstOutOfOrder(times, self.lastupdate)
+            if index is not None:
+                raise UpdateError("the time %s (at index %s) is not after the "
+                                  "one before it" % (times[index], index))
+            self.values.extend(times, values)
+            if len(times):
+                self.lastupdate = float(times[-1])
+        finally:
+            self.lock.release()
+        self.buffered(len(times))
+
+    def buffered(self, count):
+        """
+        Called once count readings have been buffered, to apply the
+        write-behind policy and tell the Flusher, if there is one (which
+        may make this wait for it to catch up).
+        """
+        self.checkFlush()
+        if self.flusher is not None:
+            self.flusher.buffered(self, count)
+
+    def checkFlush(self):
+        """
+        Write the buffered values if the write-behind policy given to the
+        constructor calls for it: once there are flushCount readings, once
+        they take up flushBytes bytes (see ValueBuffer.size) or once the
+        oldest was buffered flushAge seconds ago. The age is only checked
+        as values are buffered; a Flusher also writes buffers that have
+        gone quiet.
+
+        >>> my_rrd = RRD('somefile', flushCount=2)
+        >>> my_rrd.backend = util.Attributes()
+        >>> my_rrd.backend.prepareObject = external.prepareObject
+        >>> def update(filename, data, debug=False):
+        ...     print filename, data
+        >>> my_rrd.backend.update = update
+        >>> my_rrd.bufferValue(1000, 1)
+        >>> my_rrd.bufferValue(1300, 2)
+        somefile [u'1000:1', u'1300:2']
+        >>> len(my_rrd.values)
+        0
+        """
+        values = self.values
+        if not values:
+            return
+        if ((self.flushCount is not None and
+                len(values) >= self.flushCount) or
+            (self.flushBytes is not None and
+                values.size() >= self.flushBytes) or
+            (self.flushAge is not None and values.age() >= self.flushAge)):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered values now, with the template of the last update.
+        """
+        self.update(template=self.template)
+
+    def close(self):
+        """
+        Write whatever is still buffered. An RRD can also be used in a with
+        statement, which closes it at the end.
+        """
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def getValues(self):
+        return self._values
+
+    def setValues(self, values):
+        if not isinstance(values, ValueBuffer):
+            values = ValueBuffer(values)
+        self._values = values
+
+    # the buffered values (see pyrrd.buffer); a list of (time, values)
+    # tuples can still be assigned
+    values = property(getValues, setValues)
+
+    def create(self, debug=False, preallocate=False):
+        """
+        Create the file. preallocate reserves its disk space before it is
+        written; only the native backend can do that.
+        """
         data = self.backend.prepareObject('create', self)
         if debug:
             print data
-        self.backend.create(*data)
+        if preallocate:
+            if getattr(self.backend, "__name__", None) != (
+                    "pyrrd.backend.native"):
+                raise CreateError(
+                    "only the native backend can preallocate files")
+            self.backend.create(preallocate=True, *data)
+        else:
+            self.backend.create(*data)
+        # the file's last update is its start, which may be an AT-style time
+        # such as "now-1d"; that is read back from the file if it can be
+        try:
+            self.lastWritten = float(self.start)
+        except (TypeError, ValueError):
+            header = self.loadHeader()
+            if header is not None:
+                self.lastWritten = float(header.lastupdate)
 
     # XXX this can be uncommented when we're doing full database imports with
     # the loads method and storing those values in the python objects
@@ -186,19 +363,181 @@ class RRD(mapper.RRDMapper):
     #            self.bufferValue(time, data)
     #        self.update()
 
-    def update(self, debug=False, template=None, dryRun=False):
+    def update(self, debug=False, template=None, dryRun=False,
+               outOfOrder=None):
         """
+        Write the buffered values. Values buffered by other threads while
+        they are being written are kept for the next update; if the write
+        fails, the values that weren't written stay buffered.
+
+        rrdtool rejects a whole update for one reading that isn't later
+        than the one before it or than the last update. With outOfOrder (or
+        the RRD's outOfOrder) set to "error", "drop", "last-wins" or "sort",
+        the buffer is checked first and such readings are raised as an
+        UpdateError, dropped or put in order (see pyrrd.buffer.checkOrder).
+
+        >>> my_rrd = RRD('somefile', start=900)
+        >>> my_rrd.lastWritten = 900.0
+        >>> for seconds in [900, 1200, 1200, 1500]:
+        ...     my_rrd.bufferValue(seconds, seconds / 300)
+        >>> my_rrd.update(outOfOrder='error')
+        Traceback (most recent call last):
+        UpdateError: the time 900 (at index 0) is not after the last update, at 900
+        >>> my_rrd.update(outOfOrder='last-wins', debug=True, dryRun=True)
+        ('somefile', [u'1200:4', u'1500:5'])
+        >>> len(my_rrd.values)
+        4
         """
         # XXX this needs a lot more testing with different data
         # sources and values
         self.template = template
-        if self.values:
-            data = self.backend.prepareObject('update', self)
-            if debug:
-                print data
-            if not dryRun:
+        dropped = 0
+        self.writeLock.acquire()
+        try:
+            self.lock.acquire()
+            try:
+                if not self.values:
+                    return
+                values = self.values
+                dropped = self.checkValues(outOfOrder)
+                try:
+                    if not self.values:
+                        return
+                    data = self.backend.prepareObject('update', self)
+                    if debug:
+                        print data
+                    if dryRun:
+                        return
+                finally:
+                    if dryRun:
+                        # the policy is only shown: the buffer is left as is
+                        self.values = values
+                        dropped = 0
+                values = self.values
+                self.values = []
+            finally:
+                self.lock.release()
+            try:
                 self.backend.update(debug=debug, *data)
+            except:
+                self.restoreValues(values, sys.exc_info()[1])
+                raise
+        finally:
+            self.writeLock.release()
+            if dropped and self.flusher is not None:
+                self.flusher.written(self, dropped)
+        self.wroteValues(values)
+
+    def aupdate(self, template=None, executor=None, outOfOrder=None):
+        """
+        Like update, but without waiting for rrdtool: the buffered values are
+        queued on the rrdtool processes of pyrrd.backend.aio and a Future is
+        returned (or None if there was nothing to send). As with update, the
+        buffer is checked with the outOfOrder policy first, and the values
+        are buffered again if the Future fails or is cancelled.
+
+        The values are written by rrdtool, so this can only be used with the
+        external backend.
+        """
+        if self.backend is not external:
+            name = getattr(self.backend, "__name__", self.backend)
+            raise UpdateError("aupdate writes with rrdtool, so it can't be "
+                              "used with the %s backend" % (name,))
+        self.template = template
+        dropped = 0
+        self.writeLock.acquire()
+        try:
+            self.lock.acquire()
+            try:
+                if not self.values:
+                    return None
+                dropped = self.checkValues(outOfOrder)
+                if not self.values:
+                    return None
+                data = aio.prepareObject('update', self)
+                values = self.values
                 self.values = []
+            finally:
+                self.lock.release()
+            try:
+                future = aio.update(executor=executor, *data)
+            except:
+                self.restoreValues(values)
+                raise
+        finally:
+            self.writeLock.release()
+            if dropped and self.flusher is not None:
+                self.flusher.written(self, dropped)
+
+        def finished(future):
+            if future.cancelled():
+                self.restoreValues(values)
+            elif future.exception() is not None:
+                self.restoreValues(values, future.exception())
+            else:
+                self.wroteValues(values)
+
+        future.add_done_callback(finished)
+        return future
+
+    def checkValues(self, outOfOrder=None):
+        """
+        Apply the out-of-order policy (see update) to the buffer, with the
+        lock held. Returns the number of readings that were dropped.
+        """
+        outOfOrder = outOfOrder or self.outOfOrder
+        if outOfOrder is None:
+            return 0
+        count = len(self.values)
+        self.values = checkOrder(self.values, self.lastWritten, outOfOrder)
+        return count - len(self.values)
+
+    def restoreValues(self, values, error=None):
+        """
+        Buffer again values that could not be written, before any that have
+        been buffered since. Those the backend wrote before error are left
+        out: the first "written" of a PartialUpdateError, and any that are
+        not after the file's last update, read again from its header.
+        """
+        written = 0
+        if isinstance(error, PartialUpdateError):
+            written = min(error.written, len(values))
+        try:
+            header = self.loadHeader()
+        except (EnvironmentError, PyRRDError):
+            header = None
+        lastupdate = None
+        if header is not None:
+            lastupdate = float(header.lastupdate)
+            self.lastWritten = max(self.lastWritten, lastupdate)
+        keep = []
+        done = range(written)
+        for index, seconds in enumerate(values.seconds()[written:], written):
+            if (lastupdate is not None and seconds is not None and
+                    seconds <= lastupdate):
+                done.append(index)
+            else:
+                keep.append(index)
+        if done:
+            self.wroteValues(values.select(done))
+            values = values.select(keep)
+        self.lock.acquire()
+        try:
+            values.merge(self.values)
+            self.values = values
+        finally:
+            self.lock.release()
+
+    def wroteValues(self, values):
+        """
+        Note that the values have been written.
+        """
+        times = [seconds for seconds in values.seconds()
+                 if seconds is not None]
+        if times:
+            self.lastWritten = max(self.lastWritten, max(times))
+        if self.flusher is not None:
+            self.flusher.written(self, len(values))
 
     def fetch(self, cf="AVERAGE", resolution=None, start=None, end=None,
               returnStyle="ds", useBindings=False):
@@ -211,6 +550,16 @@ class RRD(mapper.RRDMapper):
         have a key for every defined DS and a corresponding value that is the
         data associated with that DS at the given time.
 
+        In both, unknown values are pyrrd.util.NaN, a float that is NaN.
+
+        With returnStyle="columns", one gets a (times, dict) tuple instead,
+        where times is an array of the row timestamps and the dict maps each
+        DS name to an array of its values (NaN for unknown). With
+        returnStyle=None, the FetchResults object itself is returned: it
+        has the start, end, step and dsNames of the fetch, and its "values"
+        are all the values as a 2-D NumPy array (rows by DSs) if NumPy is
+        installed.
+
         # XXX add a doctest that creates an RRD with multiple DSs and RRAs
         """
         attributes = util.Attributes()
@@ -223,12 +572,51 @@ class RRD(mapper.RRDMapper):
         if useBindings:
             kwds = {"useBindings": useBindings}
             return self.backend.fetch(*data, **kwds)
-        return self.backend.fetch(*data)[returnStyle]
+        results = self.backend.fetch(*data)
+        if returnStyle is None:
+            return results
+        return results[returnStyle]
+
+    def iterfetch(self, cf="AVERAGE", resolution=None, start=None, end=None):
+        """
+        Like fetch, but the rows are produced one at a time, as
+        (timestamp, values) tuples, while they are read. The values are in
+        the order of the returned object's "dsNames". Only one row is held
+        in memory at a time, so this is the way to export long series.
+        """
+        attributes = util.Attributes()
+        attributes.filename = self.filename
+        attributes.cf = cf
+        attributes.resolution = resolution
+        attributes.start = start
+        attributes.end = end
+        data = self.backend.prepareObject('fetch', attributes)
+        return self.backend.iterFetch(*data)
+
+    def afetch(self, cf="AVERAGE", resolution=None, start=None, end=None,
+               returnStyle="ds", executor=None):
+        """
+        Like fetch, but returns a Future for the results instead of waiting
+        for rrdtool (see pyrrd.backend.aio).
+        """
+        attributes = util.Attributes()
+        attributes.filename = self.filename
+        attributes.cf = cf
+        attributes.resolution = resolution
+        attributes.start = start
+        attributes.end = end
+        data = aio.prepareObject('fetch', attributes)
+        return aio.fetch(returnStyle=returnStyle, executor=executor, *data)
 
     def info(self, useBindings=False, rawData=False, stream=None):
         """
         For this method, the info is rendered to stdout, unless rawData is set
         to True.
+
+        With the native backend, the output is that of "rrdtool info", read
+        straight from the file's header; rawData gives it as a flat dict
+        (e.g. "ds[speed].last_ds", "rra[0].cdp_prep[0].value") and stream
+        can be any file-like object to write the lines to.
         """
         data = self.backend.prepareObject('info', self)
         kwds = {
@@ -299,8 +687,9 @@ class RRD(mapper.RRDMapper):
         #    self.filename = filename
 
         # this re-maps all attributes of this object (self) based on what is
-        # read in from self.filename
-        self.map()
+        # read in from self.filename; unless the data is wanted, only the
+        # file's header is read
+        self.map(includeData)
 
         # XXX add support for loading data from the database XML tag; when this
         # is implemented, we will also need to come up with the best way to
@@ -467,6 +856,306 @@ class Query(object):
     pass
 
 
+class Flusher(object):
+    """
+    Writes the buffered values of many RRDs in the background. Each RRD
+    that is registered is flushed once per interval (its step, unless an
+    interval is given) by a pool of worker threads, at its own offset into
+    the interval, worked out from its file name, so that the writes for many
+    files are spread out rather than all made at the start of each step.
+
+    Once more than maxPending readings are waiting to be written, across
+    all the RRDs, bufferValue and bufferArray start flushing the RRD they
+    were called on (and the largest buffers, if that isn't enough) and wait
+    until the backlog is back under the limit, for up to timeout seconds
+    (forever if None) before raising a QueueFullError.
+
+    An error from a background write is kept in "errors", by file name, and
+    the values stay buffered to be tried again at the next flush.
+
+        >>> flusher = Flusher(workers=4, maxPending=100000)
+        >>> flusher.start()
+        >>> flusher.register(rrd) # doctest: +SKIP
+        >>> flusher.stop()
+    """
+    def __init__(self, interval=None, workers=None, maxPending=None,
+                 timeout=None):
+        if workers is None:
+            workers = cpuCount()
+        self.interval = interval
+        self.workers = workers
+        self.maxPending = maxPending
+        self.timeout = timeout
+        # the number of readings buffered and not yet written
+        self.pending = 0
+        self.errors = {}
+        # (time, sequence number, rrd) for the next flush of each RRD, with
+        # the time also kept in "due"; entries that don't match it are old
+        self.schedule = []
+        self.due = {}
+        self.sequence = 0
+        self.flushing = set()
+        self.condition = threading.Condition()
+        self.pool = None
+        self.thread = None
+        self.stopped = False
+
+    def start(self):
+        self.stopped = False
+        self.pool = ThreadPool(self.workers)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, flush=True):
+        """
+        Stop flushing in the background and, unless flush is False, write
+        what is still buffered.
+        """
+        self.condition.acquire()
+        try:
+            self.stopped = True
+            self.condition.notifyAll()
+            rrds = self.due.keys()
+        finally:
+            self.condition.release()
+        if self.thread is not None:
+            self.thread.join()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        if flush:
+            for rrd in rrds:
+                self.flushOne(rrd)
+
+    def register(self, rrd):
+        self.condition.acquire()
+        try:
+            rrd.flusher = self
+            self.pending += len(rrd.values)
+            self.push(rrd, self.nextDue(rrd, time.time()))
+        finally:
+            self.condition.release()
+
+    def unregister(self, rrd, flush=True):
+        self.condition.acquire()
+        try:
+            if rrd.flusher is not self:
+                return
+            rrd.flusher = None
+            self.due.pop(rrd, None)
+            self.pending = max(0, self.pending - len(rrd.values))
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+        if flush:
+            rrd.flush()
+
+    def getInterval(self, rrd):
+        return self.interval or rrd.step or 300
+
+    def nextDue(self, rrd, now):
+        """
+        The next time at the RRD's offset into its interval.
+
+        >>> flusher = Flusher(interval=300)
+        >>> due = flusher.nextDue(RRD('a.rrd'), 920804700)
+        >>> due % 300 == Flusher().nextDue(RRD('a.rrd'), 920805000) % 300
+        True
+        >>> 920804700 < due <= 920805000
+        True
+        """
+        interval = self.getInterval(rrd)
+        filename = rrd.filename
+        if isinstance(filename, unicode):
+            filename = filename.encode("utf-8")
+        offset = (zlib.crc32(filename) & 0xffffffff) % 1000 * interval / 1000.0
+        due = now - now % interval + offset
+        if due <= now:
+            due += interval
+        return due
+
+    def push(self, rrd, due):
+        self.sequence += 1
+        self.due[rrd] = due
+        heapq.heappush(self.schedule, (due, self.sequence, rrd))
+        self.condition.notifyAll()
+
+    def run(self):
+        self.condition.acquire()
+        try:
+            while not self.stopped:
+                now = time.time()
+                while self.schedule and self.schedule[0][0] <= now:
+                    due, sequence, rrd = heapq.heappop(self.schedule)
+                    if self.due.get(rrd) == due:
+                        self.submit(rrd)
+                wait = None
+                if self.schedule:
+                    wait = self.schedule[0][0] - now
+                self.condition.wait(wait)
+        finally:
+            self.condition.release()
+
+    def submit(self, rrd):
+        """
+        Have a worker flush the RRD, unless one already is.
+        """
+        if rrd in self.flushing or self.stopped:
+            return False
+        self.flushing.add(rrd)
+        self.pool.apply_async(self.flushOne, (rrd,))
+        return True
+
+    def flushOne(self, rrd):
+        error = None
+        try:
+            rrd.flush()
+        except Exception, error:
+            pass
+        self.condition.acquire()
+        try:
+            if error is None:
+                self.errors.pop(rrd.filename, None)
+            else:
+                self.errors[rrd.filename] = error
+            self.flushing.discard(rrd)
+            if rrd.flusher is self and not self.stopped:
+                self.push(rrd, self.nextDue(rrd, time.time()))
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def buffered(self, rrd, count):
+        """
+        Count readings buffered by an RRD, and wait if there are too many.
+        """
+        self.condition.acquire()
+        try:
+            self.pending += count
+            if self.maxPending is None or self.pool is None:
+                return
+            deadline = None
+            if self.timeout is not None:
+                deadline = time.time() + self.timeout
+            while self.pending > self.maxPending and not self.stopped:
+                if not self.flushing and not self.relieve(rrd):
+                    # nothing left to write that would help
+                    return
+                wait = None
+                if deadline is not None:
+                    wait = deadline - time.time()
+                    if wait <= 0:
+                        raise QueueFullError(
+                            "%s values are waiting to be written" % (
+                            self.pending,))
+                self.condition.wait(wait)
+        finally:
+            self.condition.release()
+
+    def relieve(self, rrd):
+        """
+        Start flushing the RRD and then the largest buffers until enough
+        readings are being written to bring the backlog under the limit.
+        Returns whether any flush was started.
+        """
+        excess = self.pending - self.maxPending
+        others = sorted(self.due.keys(), key=lambda other: len(other.values),
+                        reverse=True)
+        started = False
+        for other in [rrd] + others:
+            if excess <= 0:
+                break
+            count = len(other.values)
+            if count and self.submit(other):
+                excess -= count
+                started = True
+        return started
+
+    def written(self, rrd, count):
+        """
+        Count readings an RRD has written.
+        """
+        self.condition.acquire()
+        try:
+            self.pending = max(0, self.pending - count)
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+
+def fetchSpec(item):
+    """
+    Run one of the fetches of fetchMany and return its index with the
+    results or the error. This runs in fetchMany's workers, which may be
+    other processes, in which case the backend is given by its name.
+    """
+    index, backend, (filename, cf, resolution, start, end), returnStyle = item
+    try:
+        if isinstance(backend, basestring):
+            backend = __import__(backend, fromlist=["fetch"])
+        rrd = RRD(filename, backend=backend)
+        results = rrd.fetch(cf or "AVERAGE", resolution, start, end,
+                            returnStyle)
+    except Exception, error:
+        return index, None, error
+    return index, results, None
+
+
+def fetchMany(specs, workers=None, backend=external, returnStyle="ds",
+              ordered=True):
+    """
+    Fetch from many RRD files at once. Each spec is a (filename, cf,
+    resolution, start, end) tuple, where the items after the filename can be
+    left out or None. The fetches run on a pool of workers (one per CPU by
+    default): threads for the backends that wait on rrdtool, and processes
+    for the native backend, which parses the files in Python.
+
+    An iterator of (spec, results, error) tuples is returned, in the order
+    of the specs or, if ordered is False, as the fetches finish. The results
+    are those of RRD.fetch with the returnStyle; a fetch that fails has None
+    for them and its exception as the error, and the others go on.
+
+    >>> list(fetchMany([]))
+    []
+    """
+    specs = list(specs)
+    if workers is None:
+        workers = cpuCount()
+    workers = max(1, min(workers, len(specs)))
+    if getattr(backend, "fetchWorkers", "thread") == "process":
+        poolClass = multiprocessing.Pool
+        backend = backend.__name__
+    else:
+        poolClass = ThreadPool
+    items = []
+    for index, spec in enumerate(specs):
+        if isinstance(spec, basestring):
+            spec = (spec,)
+        spec = (tuple(spec) + (None,) * 4)[:5]
+        items.append((index, backend, spec, returnStyle))
+    return iterOutcomes(poolClass, workers, specs, items, ordered)
+
+
+def iterOutcomes(poolClass, workers, specs, items, ordered):
+    if not items:
+        return
+    pool = poolClass(workers)
+    try:
+        if ordered:
+            outcomes = pool.imap(fetchSpec, items)
+        else:
+            outcomes = pool.imap_unordered(fetchSpec, items)
+        for index, results, error in outcomes:
+            yield specs[index], results, error
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+fetch_many = fetchMany
+
+
 if __name__ == '__main__':
     from doctest import testmod
     testmod()
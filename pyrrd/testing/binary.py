@@ -0,0 +1,82 @@
+"""
+Binary RRD files for the native backend tests, stored as hex so they can live
+in a module like the XML dumps in pyrrd.testing.dump.
+"""
+from binascii import unhexlify
+
+
+def decode(hexData):
+    return unhexlify("".join(hexData.split()))
+
+
+# One data source (speed, COUNTER) and one RRA (AVERAGE, 24 rows), written by
+# a 32-bit little-endian host after two updates.
+simpleRRD01 = decode("""
+5252440030303033000000002f25c0c7432b1f5b01000000010000002c010000
+0000000000000000000000000000000000000000000000000000000000000000
+0000000000000000000000000000000000000000000000000000000000000000
+0000000000000000000000000000000073706565640000000000000000000000
+00000000434f554e544552000000000000000000000000005802000000000000
+000000000000f8ff000000000000f8ff00000000000000000000000000000000
+0000000000000000000000000000000000000000000000000000000000000000
+0000000000000000415645524147450000000000000000000000000018000000
+01000000000000000000e03f0000000000000000000000000000000000000000
+0000000000000000000000000000000000000000000000000000000000000000
+0000000000000000000000000000000000000000d462e2360000000031323336
+3400000000000000000000000000000000000000000000000000000000000000
+000000009a9999999999d93f0000000000000000000000000000000000000000
+0000000000000000000000000000000000000000000000000000000000000000
+000000000000000000000000000000000000f8ff000000000000000000000000
+0000000000000000000000000000000000000000000000000000000000000000
+000000000000000000000000fca9f1d24d62603f000000000000f8ff04000000
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+fca9f1d24d62603f000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+""")
+
+# Two data sources (speed and velocity, both COUNTER) and one RRA (AVERAGE, 24
+# rows), written by a 32-bit little-endian host after one update.
+simpleRRD02 = decode("""
+5252440030303033000000002f25c0c7432b1f5b02000000010000002c010000
+0000000000000000000000000000000000000000000000000000000000000000
+0000000000000000000000000000000000000000000000000000000000000000
+0000000000000000000000000000000073706565640000000000000000000000
+00000000434f554e544552000000000000000000000000005802000000000000
+000000000000f8ff000000000000f8ff00000000000000000000000000000000
+0000000000000000000000000000000000000000000000000000000000000000
+000000000000000076656c6f63697479000000000000000000000000434f554e
+544552000000000000000000000000002c01000000000000000000000000f8ff
+000000000000f8ff000000000000000000000000000000000000000000000000
+0000000000000000000000000000000000000000000000000000000000000000
+4156455241474500000000000000000000000000180000000100000000000000
+0000e03f00000000000000000000000000000000000000000000000000000000
+0000000000000000000000000000000000000000000000000000000000000000
+000000000000000000000000e060e23600000000313233363300000000000000
+0000000000000000000000000000000000000000000000000000000000000000
+0000f8ff00000000000000000000000000000000000000000000000000000000
+0000000000000000000000000000000000000000000000000000000000000000
+0000000037323400000000000000000000000000000000000000000000000000
+000000000000000000000000000000000000f8ff000000000000000000000000
+0000000000000000000000000000000000000000000000000000000000000000
+0000000000000000000000000000000000000000000000000000f8ff00000000
+0000000000000000000000000000000000000000000000000000000000000000
+0000000000000000000000000000000000000000000000000000f8ff00000000
+0000f8ff000000000000f8ff0000000000000000000000000000000000000000
+0000000000000000000000000000000000000000000000000000000000000000
+00000000000000000000f8ff000000000000f8ff03000000000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff000000000000f8ff
+000000000000f8ff000000000000f8ff000000000000f8ff
+""")
@@ -0,0 +1,151 @@
+"""
+A small stand-in for rrdcached for the rrdcached backend tests. It speaks
+enough of the protocol (UPDATE, FLUSH, FLUSHALL, PENDING, CREATE, FETCH,
+BATCH and QUIT) over a Unix socket, holds the updates in memory as the
+daemon does, and writes them with the native backend when a file is
+flushed. Every command line it receives is kept in "commands".
+
+    >>> server = FakeRRDCached(socketPath) # doctest: +SKIP
+    >>> server.start() # doctest: +SKIP
+    >>> server.stop() # doctest: +SKIP
+"""
+import math
+import os
+import SocketServer
+import threading
+
+from pyrrd.backend import native
+from pyrrd.exceptions import PyRRDError
+
+
+class Handler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            line = line.rstrip("\n")
+            self.server.commands.append(line)
+            if line == "QUIT":
+                break
+            if line == "BATCH":
+                self.batch()
+                continue
+            status, message, lines = self.server.run(line)
+            self.respond(status, message, lines)
+
+    def respond(self, status, message, lines=()):
+        self.wfile.write("%s %s\n" % (status, message))
+        for line in lines:
+            self.wfile.write(line + "\n")
+        self.wfile.flush()
+
+    def batch(self):
+        self.respond(0, "Go ahead.  End with dot '.' on its own line.")
+        errors = []
+        number = 0
+        while True:
+            line = self.rfile.readline().rstrip("\n")
+            if line == ".":
+                break
+            number += 1
+            self.server.commands.append(line)
+            status, message, lines = self.server.run(line)
+            if status < 0:
+                errors.append("%s %s" % (number, message))
+        self.respond(len(errors), "errors", errors)
+
+
+class FakeRRDCached(SocketServer.ThreadingMixIn,
+                    SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, path):
+        SocketServer.UnixStreamServer.__init__(self, path, Handler)
+        self.path = path
+        self.commands = []
+        # the values not yet written, by file name
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.serve_forever, kwargs={"poll_interval": 0.01})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def run(self, line):
+        """
+        Run a command and return the status, message and lines to answer.
+        """
+        args = line.split()
+        command = args and args.pop(0).upper()
+        method = getattr(self, "do%s" % str(command).capitalize(), None)
+        if method is None:
+            return -1, "Unknown command: %s" % command, []
+        self.lock.acquire()
+        try:
+            return method(*args)
+        except TypeError:
+            return -1, "Syntax error in %s" % command, []
+        except PyRRDError, error:
+            return -1, str(error), []
+        finally:
+            self.lock.release()
+
+    def doUpdate(self, filename, *values):
+        if not os.path.exists(filename):
+            return -1, "No such file: %s" % filename, []
+        self.pending.setdefault(filename, []).extend(values)
+        return 0, "errors, enqueued %s value(s)." % len(values), []
+
+    def doFlush(self, filename):
+        values = self.pending.pop(filename, [])
+        if values:
+            native.update(filename, values)
+        return 0, "Successfully flushed %s." % filename, []
+
+    def doFlushall(self):
+        for filename in self.pending.keys():
+            self.doFlush(filename)
+        return 0, "Started flush.", []
+
+    def doPending(self, filename):
+        values = self.pending.get(filename, [])
+        return len(values), "updates pending", values
+
+    def doCreate(self, filename, *args):
+        native.create(filename, list(args))
+        return 0, "RRD created OK", []
+
+    def doFetch(self, filename, cf, start=None, end=None):
+        self.doFlush(filename)
+        query = [cf]
+        if start is not None:
+            query.extend(["--start", start])
+        if end is not None:
+            query.extend(["--end", end])
+        results = native.fetch(filename, query)
+        lines = [
+            "FlushVersion: 1",
+            "Start: %s" % results.start,
+            "End: %s" % results.end,
+            "Step: %s" % results.step,
+            "DSCount: %s" % len(results.dsNames),
+            "DSName: %s" % " ".join(results.dsNames)]
+        for index, time in enumerate(results.times):
+            values = [column[index] for column in results.columns]
+            lines.append("%10s:%s" % (time, "".join([
+                math.isnan(value) and " nan" or " %0.10e" % value
+                for value in values])))
+        return len(lines), "Success", lines
@@ -0,0 +1,49 @@
+"""
+A stand-in for "rrdtool -" for the pipe tests: it answers each command the
+way rrdtool's pipe mode does, without touching any files.
+
+    echo <text>     writes <text> and answers OK
+    pwd             writes its working directory and answers OK
+    fetch           writes a fetch result for a "speed" DS and answers OK
+    sleep <f> <s>   waits for <s> seconds and answers OK
+    update <f> <v>  answers ERROR if one of the values is "bad", else OK
+    fail <text>     answers "ERROR: <text>"
+    crash           exits without answering
+    anything else   answers OK
+"""
+import os
+import sys
+import time
+
+
+def main():
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        command, _, args = line.strip().partition(" ")
+        if command == "crash":
+            sys.exit(1)
+        elif command == "fail":
+            sys.stdout.write("ERROR: %s\n" % args)
+        elif command == "update" and [
+                arg for arg in args.split() if arg.split(":")[-1] == "bad"]:
+            sys.stdout.write("ERROR: bad value\n")
+        else:
+            if command == "echo":
+                sys.stdout.write("%s\n" % args)
+            elif command == "pwd":
+                sys.stdout.write("%s\n" % os.getcwd())
+            elif command == "fetch":
+                sys.stdout.write("                speed\n\n"
+                                 "920804700: nan\n"
+                                 "920805000: 4.0000000000e-02\n"
+                                 "920805300: nan\n")
+            elif command == "sleep":
+                time.sleep(float(args.split()[-1]))
+            sys.stdout.write("OK u:0.00 s:0.00 r:0.00\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
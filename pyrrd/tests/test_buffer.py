@@ -0,0 +1,197 @@
+from unittest import TestCase
+
+from pyrrd import buffer as buffermodule
+from pyrrd.buffer import ValueBuffer, checkOrder
+from pyrrd.exceptions import UpdateError
+from pyrrd.rrd import DataSource, RRD
+
+
+class ValueBufferTestCase(TestCase):
+
+    def test_compact(self):
+        buffer = ValueBuffer()
+        for index in xrange(3):
+            buffer.add(920804700 + 300 * index, [index, "U", 0.5])
+        self.assertTrue(buffer.isCompact())
+        self.assertEquals(len(buffer.times), 3)
+        self.assertEquals(len(buffer.data), 9)
+        self.assertEquals(buffer.width, 3)
+        self.assertEquals(buffer[1], (920805000, u"1:U:0.5"))
+        self.assertRaises(IndexError, buffer.__getitem__, 3)
+
+    def test_fallback(self):
+        for time, values in [
+                ("N", ["1"]), (920805000, ["1", "2"]), (920805000, []),
+                (920805000, [2 ** 64 - 1]), (920805000.5, ["1"]),
+                (920805000, ["value"])]:
+            buffer = ValueBuffer()
+            buffer.add(920804700, ["12"])
+            buffer.add(time, values)
+            self.assertFalse(buffer.isCompact())
+            self.assertEquals(list(buffer), [
+                (920804700, u"12"),
+                (time, u":".join([unicode(value) for value in values]))])
+
+    def test_equality(self):
+        buffer = ValueBuffer()
+        self.assertEquals(buffer, [])
+        buffer.add(1000, [1])
+        self.assertEquals(buffer, [(1000, u"1")])
+        self.assertNotEquals(buffer, [])
+        buffer.clear()
+        self.assertFalse(buffer)
+
+
+class CheckOrderTestCase(TestCase):
+
+    def makeBuffer(self, times):
+        buffer = ValueBuffer()
+        for index, seconds in enumerate(times):
+            buffer.add(seconds, [index])
+        return buffer
+
+    def test_inOrder(self):
+        buffer = self.makeBuffer([300, 600, 900])
+        for policy in ["error", "drop", "last-wins", "sort"]:
+            self.assertTrue(checkOrder(buffer, 0, policy) is buffer)
+
+    def test_error(self):
+        buffer = self.makeBuffer([300, 600, 900])
+        try:
+            checkOrder(buffer, 600)
+        except UpdateError, error:
+            self.assertTrue("index 0" in str(error))
+            self.assertTrue("last update" in str(error))
+        else:
+            self.fail("the times should have been rejected")
+        self.assertRaises(UpdateError, checkOrder,
+                          self.makeBuffer([300, 900, 600]))
+        self.assertRaises(ValueError, checkOrder, buffer, policy="first")
+
+    def test_drop(self):
+        buffer = self.makeBuffer([300, 600, 600, 450, 900])
+        self.assertEquals(checkOrder(buffer, 300, "drop"),
+                          [(600, u"1"), (900, u"4")])
+        self.assertTrue(checkOrder(buffer, 300, "drop").isCompact())
+
+    def test_lastWins(self):
+        buffer = self.makeBuffer([300, 300, 600, 600, 600])
+        self.assertEquals(checkOrder(buffer, None, "last-wins"),
+                          [(300, u"1"), (600, u"4")])
+        # the time of the last update can't be written again
+        self.assertEquals(checkOrder(buffer, 300, "last-wins"),
+                          [(600, u"4")])
+
+    def test_sort(self):
+        buffer = self.makeBuffer([900, 300, 600, 300])
+        self.assertEquals(checkOrder(buffer, None, "sort"),
+                          [(300, u"3"), (600, u"2"), (900, u"0")])
+
+    def test_raw(self):
+        buffer = ValueBuffer()
+        buffer.add("600:1")
+        buffer.add("N", ["2"])
+        buffer.add("300:3")
+        self.assertEquals(checkOrder(buffer, None, "drop"),
+                          [("600:1", u""), ("N", u"2")])
+        self.assertEquals(checkOrder(buffer, None, "sort"),
+                          [("300:3", u""), ("600:1", u""), ("N", u"2")])
+
+
+class RRDValuesTestCase(TestCase):
+
+    def test_bufferValue(self):
+        rrd = RRD("somefile")
+        rrd.bufferValue("920804700", "12345", 6)
+        self.assertEquals(rrd.lastupdate, 920804700.0)
+        self.assertTrue(rrd.values.isCompact())
+        rrd.template = None
+        self.assertEquals(rrd.backend.prepareObject("update", rrd),
+                          ("somefile", [u"920804700:12345:6"]))
+
+    def test_now(self):
+        rrd = RRD("somefile")
+        rrd.bufferValue(920804700, 1)
+        rrd.bufferValue("N", 2)
+        # the time of "N" isn't known until it is written
+        self.assertEquals(rrd.lastupdate, 920804700.0)
+        self.assertEquals(rrd.values, [(920804700, u"1"), ("N", u"2")])
+
+    def test_infinity(self):
+        rrd = RRD("somefile")
+        rrd.bufferValue(920804700, float("inf"), -float("inf"))
+        self.assertTrue(rrd.values.isCompact())
+        self.assertEquals(rrd.values, [(920804700, u"inf:-inf")])
+
+    def test_assignment(self):
+        rrd = RRD("somefile")
+        rrd.bufferValue(920804700, 1)
+        rrd.values = []
+        self.assertEquals(len(rrd.values), 0)
+        rrd.bufferValue(920805000, 2)
+        self.assertEquals(rrd.values, [(920805000, u"2")])
+
+
+class BufferArrayTestCase(TestCase):
+
+    def setUp(self):
+        self.rrd = RRD("somefile", ds=[
+            DataSource(dsName="in", dsType="GAUGE"),
+            DataSource(dsName="out", dsType="GAUGE")])
+
+    def test_matrix(self):
+        times = range(920804700, 920804700 + 300 * 1000, 300)
+        self.rrd.bufferArray(times, [[index, index * 0.5]
+                                     for index in xrange(1000)])
+        self.assertTrue(self.rrd.values.isCompact())
+        self.assertEquals(len(self.rrd.values), 1000)
+        self.assertEquals(self.rrd.values[3], (920805600, u"3:1.5"))
+        self.assertEquals(self.rrd.lastupdate, times[-1])
+
+    def test_columns(self):
+        self.rrd.bufferArray([1000, 1300], {"out": [1, 2]})
+        self.assertEquals(list(self.rrd.values),
+                          [(1000, u"U:1"), (1300, u"U:2")])
+        self.assertRaises(ValueError, self.rrd.bufferArray, [1600],
+                          {"speed": [1]})
+
+    def test_afterBufferValue(self):
+        self.rrd.bufferValue(1000, 1, 2)
+        self.rrd.bufferArray([1300, 1600], [[3, 4], [5, 6]])
+        self.assertEquals(len(self.rrd.values), 3)
+        self.assertRaises(UpdateError, self.rrd.bufferArray, [1600], [[1, 2]])
+
+    def test_outOfOrder(self):
+        try:
+            self.rrd.bufferArray([1000, 1300, 1300], [[1, 2]] * 3)
+        except UpdateError, error:
+            self.assertTrue("index 2" in str(error))
+        else:
+            self.fail("the times should have been rejected")
+        self.assertEquals(len(self.rrd.values), 0)
+
+    def test_width(self):
+        self.assertRaises(ValueError, self.rrd.bufferArray, [1000], [[1]])
+        self.assertRaises(ValueError, self.rrd.bufferArray, [1000, 1300],
+                          [[1, 2]])
+
+    def test_wholeSeconds(self):
+        self.assertRaises(ValueError, self.rrd.bufferArray, [1000.5],
+                          [[1, 2]])
+
+    def test_singleDataSource(self):
+        rrd = RRD("somefile", ds=[DataSource(dsName="speed", dsType="GAUGE")])
+        rrd.bufferArray([1000, 1300], [1, float("nan")])
+        self.assertEquals(list(rrd.values), [(1000, u"1"), (1300, u"U")])
+
+    def test_withoutNumPy(self):
+        numpy, buffermodule.numpy = buffermodule.numpy, None
+        try:
+            self.rrd.bufferArray([1000, 1300], {"in": [1, 2]})
+            rrd = RRD("somefile", ds=[DataSource(dsName="speed", dsType="GAUGE")])
+            rrd.bufferArray([1000, 1300], [1, 2])
+        finally:
+            buffermodule.numpy = numpy
+        self.assertEquals(list(self.rrd.values),
+                          [(1000, u"1:U"), (1300, u"2:U")])
+        self.assertEquals(list(rrd.values), [(1000, u"1"), (1300, u"2")])
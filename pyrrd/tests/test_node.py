@@ -1,6 +1,8 @@
+from cStringIO import StringIO
+import math
 from unittest import TestCase
 
-from pyrrd.node import RRDXMLNode
+from pyrrd.node import RRDXMLNode, parse
 from pyrrd.testing import dump
 from pyrrd.util import XML
 
@@ -74,3 +76,49 @@ class RRDXMLNodeTestCase(TestCase):
 
     def test_creationIncludeData(self):
         rrd = RRDXMLNode(self.tree, includeData=True)
+        self.assertEquals(len(rrd.rra[0].database), 24)
+        self.assertEquals(len(rrd.rra[1].database), 10)
+        self.assertTrue(math.isnan(rrd.rra[0].database[-1][0]))
+        self.assertEquals(rrd.rra[0].attributes["database"],
+                          rrd.rra[0].database)
+
+
+class ParseTestCase(TestCase):
+
+    def test_parse(self):
+        rrd = parse(StringIO(dump.simpleDump01))
+        self.assertEquals(rrd.attributes["step"], 300)
+        self.assertEquals(rrd.attributes["lastupdate"], 920804400)
+        self.assertEquals([ds.attributes["name"] for ds in rrd.ds], ["speed"])
+        self.assertEquals([rra.attributes["pdp_per_row"] for rra in rrd.rra],
+                          [1, 6])
+        self.assertEquals(rrd.rra[0].attributes["xff"], 0.5)
+        self.assertEquals(rrd.rra[0].cdp_prep.ds[0].attributes[
+            "unknown_datapoints"], 0)
+        # the rows are dropped as they are read
+        self.assertEquals(rrd.rra[0].database, None)
+        self.assertEquals(len(rrd.tree.find("rra").find("database")), 0)
+
+    def test_parseIncludeData(self):
+        rrd = parse(StringIO(dump.simpleDump01), includeData=True)
+        database = rrd.rra[0].database
+        self.assertEquals(len(database), 24)
+        self.assertEquals(database.width, 1)
+        self.assertEquals(len(database.values), 24)
+        self.assertEquals(len(database.row), 24)
+        self.assertEquals(len(rrd.rra[1].database), 10)
+        self.assertEquals(len(rrd.tree.find("rra").find("database")), 0)
+        self.assertRaises(IndexError, database.__getitem__, 24)
+
+    def test_sameAsTree(self):
+        streamed = parse(StringIO(dump.simpleDump01))
+        loaded = RRDXMLNode(XML(dump.simpleDump01))
+        self.assertEquals(streamed.attributes, loaded.attributes)
+        for streamedNode, loadedNode in zip(
+            streamed.ds + streamed.rra, loaded.ds + loaded.rra):
+            self.assertEquals(repr(streamedNode.attributes),
+                              repr(loadedNode.attributes))
+
+    def test_invalid(self):
+        self.assertRaises(SyntaxError, parse, StringIO("<rrd><step>"))
+        self.assertRaises(SyntaxError, parse, StringIO(""))
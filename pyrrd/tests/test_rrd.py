@@ -1,6 +1,16 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
 from unittest import TestCase
 
-from pyrrd.rrd import DataSource, RRA, RRD
+from pyrrd.backend import external, native
+from pyrrd.exceptions import (
+    ExternalCommandError, PartialUpdateError, QueueFullError, UpdateError)
+from pyrrd.rrd import DataSource, Flusher, RRA, RRD, fetchMany
+from pyrrd.testing import binary, dump
+from pyrrd.util import XML
 
 
 class RRDTestCase(TestCase):
@@ -62,3 +72,413 @@ class RRDTestCase(TestCase):
         self.assertEquals(
             repr(rrd3.rra),
             "[RRA:AVERAGE:0.5:2:24, RRA:AVERAGE:0.5:12:10]")
+
+
+class RRDReadModeTestCase(TestCase):
+
+    def setUp(self):
+        self.rrdfile = tempfile.NamedTemporaryFile()
+        self.rrdfile.write(binary.simpleRRD02)
+        self.rrdfile.flush()
+
+    def test_headerOnly(self):
+        # only the header is read, so no call is made to rrdtool
+        rrd = RRD(self.rrdfile.name, mode="r")
+        self.assertEquals(rrd.step, 300)
+        self.assertEquals(rrd.lastupdate, 920805600)
+        self.assertEquals([ds.name for ds in rrd.ds], ["speed", "velocity"])
+        self.assertEquals(rrd.rra[0].xff, 0.5)
+        self.assertEquals(len(rrd.rra[0].database), 24)
+
+    def test_includeData(self):
+        loaded = []
+
+        class Backend(object):
+            def load(self, filename, includeData=False):
+                loaded.append((filename, includeData))
+                return XML(dump.simpleDump01)
+
+        rrd = RRD(self.rrdfile.name, backend=Backend())
+        rrd.mode = "r"
+        rrd.load(includeData=True)
+        self.assertEquals(loaded, [(self.rrdfile.name, True)])
+        self.assertEquals(rrd.lastupdate, 920804400)
+        self.assertEquals(len(rrd.rra[0].database), 24)
+
+    def test_unreadableHeader(self):
+        rrdfile = tempfile.NamedTemporaryFile()
+        rrdfile.write("not an RRD file")
+        rrdfile.flush()
+        rrd = RRD(rrdfile.name)
+        self.assertEquals(rrd.loadHeader(), None)
+
+    def test_withoutHeaderSupport(self):
+        # a backend without loadHeader always loads the whole file
+        loaded = []
+
+        class Backend(object):
+            def load(self, filename):
+                loaded.append(filename)
+                return XML(dump.simpleDump01)
+
+        rrd = RRD(self.rrdfile.name, mode="r", backend=Backend())
+        self.assertEquals(loaded, [self.rrdfile.name])
+        self.assertEquals(rrd.lastupdate, 920804400)
+
+
+class FetchManyTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filenames = []
+        for index in xrange(3):
+            filename = os.path.join(self.directory, "%s.rrd" % index)
+            rrd = RRD(filename, start=920804400, backend=native, ds=[
+                DataSource(dsName="speed", dsType="GAUGE", heartbeat=600)],
+                rra=[RRA(cf="AVERAGE", xff=0.5, steps=1, rows=24)])
+            rrd.create()
+            for time in xrange(920804700, 920806800, 300):
+                rrd.bufferValue(time, index)
+            rrd.update()
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_processes(self):
+        specs = [(filename, "AVERAGE", None, 920804400, 920806500)
+                 for filename in self.filenames]
+        specs.insert(1, os.path.join(self.directory, "missing.rrd"))
+        outcomes = list(fetchMany(specs, workers=2, backend=native,
+                                  returnStyle="columns"))
+        self.assertEquals([spec for spec, results, error in outcomes], specs)
+        spec, results, error = outcomes[1]
+        self.assertEquals(results, None)
+        self.assertNotEquals(error, None)
+        for index, (spec, (times, columns), error) in enumerate(
+                [outcomes[0]] + outcomes[2:]):
+            self.assertEquals(error, None)
+            row = list(times).index(920806500)
+            self.assertEquals(columns["speed"][row], index)
+
+    def test_threadsAsCompleted(self):
+        fetched = []
+
+        class Backend(object):
+            prepareObject = staticmethod(external.prepareObject)
+
+            def fetch(self, filename, query):
+                fetched.append((filename, query))
+                if filename == "bad.rrd":
+                    raise ExternalCommandError("no such file")
+                return {"ds": filename}
+
+        outcomes = list(fetchMany(
+            ["a.rrd", ("bad.rrd", "MAX"), ("b.rrd", "MIN", 3600)],
+            backend=Backend(), ordered=False))
+        self.assertEquals(sorted([spec for spec, results, error in outcomes]),
+                          sorted(["a.rrd", ("bad.rrd", "MAX"),
+                                  ("b.rrd", "MIN", 3600)]))
+        outcomes = dict([(spec, (results, error))
+                         for spec, results, error in outcomes])
+        self.assertEquals(outcomes["a.rrd"], ("a.rrd", None))
+        results, error = outcomes[("bad.rrd", "MAX")]
+        self.assertTrue(isinstance(error, ExternalCommandError))
+        self.assertTrue(("b.rrd", ["MIN", "--resolution", u"3600"])
+                        in fetched)
+
+
+class RecordingBackend(object):
+    """
+    A backend that keeps the values of each update instead of writing them.
+    """
+    prepareObject = staticmethod(external.prepareObject)
+
+    def __init__(self):
+        self.updates = []
+        # cleared to hold the writes back, as a slow disk would
+        self.ready = threading.Event()
+        self.ready.set()
+        self.error = None
+
+    def update(self, filename, data, debug=False):
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        self.updates.append(data)
+
+
+class WriteBehindTestCase(TestCase):
+
+    def setUp(self):
+        self.backend = RecordingBackend()
+
+    def test_count(self):
+        rrd = RRD("a.rrd", backend=self.backend, flushCount=3)
+        for index in xrange(7):
+            rrd.bufferValue(1000 + index, index)
+        self.assertEquals(len(self.backend.updates), 2)
+        self.assertEquals(self.backend.updates[1],
+                          [u"1003:3", u"1004:4", u"1005:5"])
+        self.assertEquals(len(rrd.values), 1)
+
+    def test_bytes(self):
+        # a reading of one value takes 16 bytes in the compact buffer
+        rrd = RRD("a.rrd", backend=self.backend, flushBytes=40)
+        rrd.bufferValue(1000, 1)
+        rrd.bufferValue(1001, 2)
+        self.assertEquals(self.backend.updates, [])
+        rrd.bufferValue(1002, 3)
+        self.assertEquals(len(self.backend.updates), 1)
+
+    def test_age(self):
+        rrd = RRD("a.rrd", backend=self.backend, flushAge=60)
+        rrd.bufferValue(1000, 1)
+        self.assertEquals(self.backend.updates, [])
+        rrd.values.started -= 61
+        rrd.bufferValue(1001, 2)
+        self.assertEquals(self.backend.updates, [[u"1000:1", u"1001:2"]])
+        self.assertEquals(rrd.values.age(), 0.0)
+
+    def test_bufferArray(self):
+        rrd = RRD("a.rrd", backend=self.backend, flushCount=10, ds=[
+            DataSource(dsName="speed", dsType="GAUGE")])
+        rrd.bufferArray(range(1000, 1020), range(20))
+        self.assertEquals(len(self.backend.updates), 1)
+        self.assertEquals(len(self.backend.updates[0]), 20)
+
+    def test_contextManager(self):
+        rrd = RRD("a.rrd", backend=self.backend)
+        rrd.update(template="speed")
+        with rrd:
+            rrd.bufferValue(1000, 1)
+            self.assertEquals(self.backend.updates, [])
+        self.assertEquals(self.backend.updates,
+                          [["--template", u"speed", u"1000:1"]])
+
+    def test_flushNothing(self):
+        rrd = RRD("a.rrd", backend=self.backend)
+        rrd.flush()
+        rrd.close()
+        self.assertEquals(self.backend.updates, [])
+
+
+class OutOfOrderTestCase(TestCase):
+
+    def setUp(self):
+        self.backend = RecordingBackend()
+        self.rrd = RRD("a.rrd", backend=self.backend)
+        self.rrd.lastWritten = 1000.0
+
+    def test_create(self):
+        self.backend.create = lambda filename, parameters: None
+        rrd = RRD("a.rrd", start=920804400, backend=self.backend)
+        rrd.create()
+        self.assertEquals(rrd.lastWritten, 920804400)
+        # an AT-style start can't be known without reading the file
+        rrd = RRD("a.rrd", start="now-1d", backend=self.backend)
+        rrd.create()
+        self.assertEquals(rrd.lastWritten, None)
+        # unless the backend can read its header
+
+        class Header(object):
+            lastupdate = 920808000
+
+        self.backend.loadHeader = lambda filename: Header()
+        rrd.create()
+        self.assertEquals(rrd.lastWritten, 920808000)
+
+    def test_default(self):
+        # without a policy, rrdtool is left to decide
+        self.rrd.bufferValue(1000, 1)
+        self.rrd.bufferValue(1000, 2)
+        self.rrd.update()
+        self.assertEquals(self.backend.updates, [[u"1000:1", u"1000:2"]])
+
+    def test_error(self):
+        self.rrd.bufferValue(1300, 1)
+        self.rrd.bufferValue(1300, 2)
+        self.assertRaises(UpdateError, self.rrd.update, outOfOrder="error")
+        self.assertEquals(self.backend.updates, [])
+        self.assertEquals(len(self.rrd.values), 2)
+
+    def test_lastWritten(self):
+        self.rrd.outOfOrder = "drop"
+        self.rrd.bufferValue(1300, 1)
+        self.rrd.update()
+        self.assertEquals(self.rrd.lastWritten, 1300)
+        # a late reading is dropped rather than failing the next update
+        self.rrd.bufferValue(1200, 2)
+        self.rrd.bufferValue(1600, 3)
+        self.rrd.update()
+        self.assertEquals(self.backend.updates, [[u"1300:1"], [u"1600:3"]])
+        self.rrd.bufferValue(1500, 4)
+        self.rrd.update()
+        self.assertEquals(len(self.backend.updates), 2)
+        self.assertEquals(len(self.rrd.values), 0)
+
+    def test_dryRun(self):
+        self.rrd.bufferValue(1600, 1)
+        self.rrd.bufferValue(900, 2)
+        self.rrd.update(outOfOrder="drop", dryRun=True)
+        self.assertEquals(len(self.rrd.values), 2)
+        # even when the policy leaves nothing to write
+        self.rrd.values = self.rrd.values.select([1])
+        self.rrd.update(outOfOrder="drop", dryRun=True)
+        self.assertEquals(list(self.rrd.values), [(900, u"2")])
+        self.assertEquals(self.backend.updates, [])
+
+    def test_sort(self):
+        rrd = RRD("a.rrd", backend=self.backend, outOfOrder="sort")
+        for seconds in [1600, 1300, 1900]:
+            rrd.bufferValue(seconds, seconds / 300)
+        rrd.update()
+        self.assertEquals(self.backend.updates,
+                          [[u"1300:4", u"1600:5", u"1900:6"]])
+
+    def test_flusher(self):
+        flusher = Flusher()
+        flusher.register(self.rrd)
+        self.rrd.bufferValue(900, 1)
+        self.rrd.bufferValue(1300, 2)
+        self.rrd.update(outOfOrder="drop")
+        self.assertEquals(flusher.pending, 0)
+
+
+
+class RestoreTestCase(TestCase):
+
+    def setUp(self):
+        self.backend = RecordingBackend()
+        self.flusher = Flusher()
+
+    def test_partialUpdate(self):
+        rrd = RRD("a.rrd", backend=self.backend)
+        self.flusher.register(rrd)
+        for seconds in [1300, 1600, 1900]:
+            rrd.bufferValue(seconds, seconds / 300)
+        self.backend.error = PartialUpdateError("failed", 1, "1900", 2)
+        self.assertRaises(PartialUpdateError, rrd.update)
+        # the readings before the failed command were written
+        self.assertEquals(list(rrd.values), [(1900, u"6")])
+        self.assertEquals(rrd.lastWritten, 1600)
+        self.assertEquals(self.flusher.pending, 1)
+        self.backend.error = None
+        rrd.update()
+        self.assertEquals(self.backend.updates, [[u"1900:6"]])
+        self.assertEquals(self.flusher.pending, 0)
+
+    def test_native(self):
+        rrdfile = tempfile.NamedTemporaryFile()
+        rrd = RRD(rrdfile.name, start=1000, backend=native, ds=[
+            DataSource(dsName="speed", dsType="GAUGE", heartbeat=600)],
+            rra=[RRA(cf="AVERAGE", xff=0.5, steps=1, rows=10)])
+        rrd.create()
+        self.flusher.register(rrd)
+        for seconds in [1300, 1600, "1600", 1900]:
+            rrd.bufferValue(seconds, 1)
+        self.assertRaises(UpdateError, rrd.update)
+        # 1300 and 1600 were written before the repeated 1600 failed
+        self.assertEquals(len(rrd.values), 1)
+        self.assertEquals(rrd.lastWritten, 1600)
+        rrd.update()
+        self.assertEquals(rrd.loadHeader().lastupdate, 1900)
+        self.assertEquals(self.flusher.pending, 0)
+
+
+class FlusherTestCase(TestCase):
+
+    def setUp(self):
+        self.backend = RecordingBackend()
+        self.flusher = Flusher(interval=0.05, workers=2)
+
+    def tearDown(self):
+        self.backend.ready.set()
+        self.flusher.stop(flush=False)
+
+    def waitFor(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_periodic(self):
+        rrds = [RRD("%s.rrd" % index, backend=self.backend)
+                for index in xrange(3)]
+        self.flusher.start()
+        for rrd in rrds:
+            self.flusher.register(rrd)
+            rrd.bufferValue(1000, 1)
+        self.assertEquals(self.flusher.pending, 3)
+        self.waitFor(lambda: len(self.backend.updates) == 3)
+        self.assertEquals(self.flusher.pending, 0)
+        rrds[0].bufferValue(1300, 2)
+        self.waitFor(lambda: len(self.backend.updates) == 4)
+
+    def test_offsets(self):
+        flusher = Flusher(interval=300)
+        offsets = set([flusher.nextDue(RRD("%s.rrd" % index), 3000) % 300
+                       for index in xrange(20)])
+        self.assertTrue(len(offsets) > 10)
+        rrd = RRD("a.rrd", step=60)
+        self.assertEquals(Flusher().getInterval(rrd), 60)
+        due = Flusher().nextDue(rrd, 3000)
+        self.assertTrue(3000 < due <= 3060)
+
+    def test_stop(self):
+        rrd = RRD("a.rrd", backend=self.backend)
+        flusher = Flusher(interval=3600)
+        flusher.start()
+        flusher.register(rrd)
+        rrd.bufferValue(1000, 1)
+        flusher.stop()
+        self.assertEquals(self.backend.updates, [[u"1000:1"]])
+
+    def test_backpressure(self):
+        self.flusher = Flusher(interval=3600, maxPending=2)
+        self.flusher.start()
+        rrd = RRD("a.rrd", backend=self.backend)
+        self.flusher.register(rrd)
+        rrd.bufferValue(1000, 1)
+        rrd.bufferValue(1001, 2)
+        self.assertEquals(self.backend.updates, [])
+        # going over the limit writes the buffer before returning
+        rrd.bufferValue(1002, 3)
+        self.assertEquals(self.backend.updates,
+                          [[u"1000:1", u"1001:2", u"1002:3"]])
+        self.assertEquals(self.flusher.pending, 0)
+
+    def test_timeout(self):
+        self.flusher = Flusher(interval=3600, maxPending=1, timeout=0.05)
+        self.flusher.start()
+        rrd = RRD("a.rrd", backend=self.backend)
+        self.flusher.register(rrd)
+        self.backend.ready.clear()
+        rrd.bufferValue(1000, 1)
+        self.assertRaises(QueueFullError, rrd.bufferValue, 1001, 2)
+        # the values are still written once the backend catches up
+        self.assertEquals(self.flusher.pending, 2)
+        self.backend.ready.set()
+        self.waitFor(lambda: self.flusher.pending == 0)
+        self.assertEquals(self.backend.updates, [[u"1000:1", u"1001:2"]])
+
+    def test_error(self):
+        rrd = RRD("a.rrd", backend=self.backend)
+        self.flusher.start()
+        self.flusher.register(rrd)
+        self.backend.error = ExternalCommandError("disk full")
+        rrd.bufferValue(1000, 1)
+        self.waitFor(lambda: "a.rrd" in self.flusher.errors)
+        self.assertEquals(len(rrd.values), 1)
+        self.backend.error = None
+        self.waitFor(lambda: "a.rrd" not in self.flusher.errors)
+        self.assertEquals(self.backend.updates, [[u"1000:1"]])
+
+    def test_unregister(self):
+        rrd = RRD("a.rrd", backend=self.backend)
+        self.flusher.register(rrd)
+        rrd.bufferValue(1000, 1)
+        self.flusher.unregister(rrd)
+        self.assertEquals(rrd.flusher, None)
+        self.assertEquals(self.flusher.pending, 0)
+        self.assertEquals(self.backend.updates, [[u"1000:1"]])
@@ -9,6 +9,12 @@ except ImportError:
 
 XML = ElementTree.XML
 
+# the C version of iterparse is much faster, where it's available
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    iterparse = ElementTree.iterparse
+
 
 def epoch(dt_obj=None):
     '''